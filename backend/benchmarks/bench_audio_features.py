@@ -0,0 +1,111 @@
+"""Parity check and timing of the shared-spectrogram feature engine.
+
+Run from the backend folder:
+    python -m benchmarks.bench_audio_features [--audio song.mp3] [--seconds 180]
+
+Without --audio a synthetic 3-minute track (chords, a kick drum and noise) is
+used. Both paths are run once, untimed, on a short excerpt first so librosa's
+numba JIT compilation is not counted. Exits non-zero if the new vector differs
+from the original per-feature librosa calls by more than the tolerance used in
+tests/test_audio_features.py.
+"""
+import argparse
+import sys
+import time
+import librosa
+import numpy as np
+from music_to_image.audio_features import aggregate, features_from_signal
+
+# Both paths derive every feature from the same float32 intermediates; the
+# tolerance only allows for reordered floating-point reductions
+PARITY_RTOL = 1e-5
+PARITY_ATOL = 1e-6
+FEATURE_LENGTH = 136
+
+
+def legacy_features(y, sr):
+    """The original extract_audio_features body: every feature from the raw signal."""
+    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
+    chroma_stft = librosa.feature.chroma_stft(y=y, sr=sr)
+    spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
+    zero_crossing_rate = librosa.feature.zero_crossing_rate(y=y)
+    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
+    rms = librosa.feature.rms(y=y)
+    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
+    spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)
+    spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
+    tonnetz = librosa.feature.tonnetz(y=y, sr=sr)
+    chroma_cqt = librosa.feature.chroma_cqt(y=y, sr=sr)
+    chroma_cens = librosa.feature.chroma_cens(y=y, sr=sr)
+    return np.concatenate(
+        [
+            aggregate(mfccs),
+            aggregate(chroma_stft),
+            aggregate(spectral_contrast),
+            aggregate(zero_crossing_rate),
+            aggregate(np.array([tempo]).reshape(-1, 1)),
+            aggregate(rms),
+            aggregate(spectral_centroid),
+            aggregate(spectral_bandwidth),
+            aggregate(spectral_rolloff),
+            aggregate(tonnetz),
+            aggregate(chroma_cqt),
+            aggregate(chroma_cens),
+        ]
+    )
+
+
+def synthetic_track(seconds, sr=44100):
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    chords = [(220.0, 277.2, 329.6), (196.0, 246.9, 293.7), (174.6, 220.0, 261.6)]
+    y = np.zeros_like(t)
+    for i, chord in enumerate(chords):
+        mask = (t // 4).astype(int) % len(chords) == i
+        for f in chord:
+            y[mask] += np.sin(2 * np.pi * f * t[mask])
+    beat = np.exp(-40 * (t % 0.5)) * np.sin(2 * np.pi * 60 * t)
+    y = 0.2 * y + 0.5 * beat + 0.02 * rng.standard_normal(len(t))
+    return (y / np.abs(y).max()).astype(np.float32), sr
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--audio", help="audio file to analyse instead of the synthetic track")
+    parser.add_argument("--seconds", type=float, default=180)
+    args = parser.parse_args()
+
+    if args.audio:
+        y, sr = librosa.load(args.audio, sr=None)
+    else:
+        y, sr = synthetic_track(args.seconds)
+    print(f"signal: {len(y) / sr:.1f} s at {sr} Hz")
+
+    # Warm-up: the first call of each librosa path pays for numba compilation
+    warmup = y[: 5 * sr]
+    legacy_features(warmup, sr)
+    features_from_signal(warmup, sr)
+
+    start = time.perf_counter()
+    expected = legacy_features(y, sr)
+    legacy_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    actual = features_from_signal(y, sr)
+    shared_seconds = time.perf_counter() - start
+
+    print(f"legacy: {legacy_seconds:6.2f} s")
+    print(f"shared: {shared_seconds:6.2f} s  ({legacy_seconds / shared_seconds:.2f}x)")
+
+    if actual.shape != (FEATURE_LENGTH,) or actual.shape != expected.shape:
+        print(f"PARITY FAILED: shapes {actual.shape} and {expected.shape}, expected ({FEATURE_LENGTH},)")
+        sys.exit(1)
+    if not np.allclose(actual, expected, rtol=PARITY_RTOL, atol=PARITY_ATOL):
+        worst = int(np.argmax(np.abs(actual - expected)))
+        print(f"PARITY FAILED at index {worst}: {actual[worst]!r} != {expected[worst]!r}")
+        sys.exit(1)
+    print(f"parity: OK ({FEATURE_LENGTH} values within rtol={PARITY_RTOL}, atol={PARITY_ATOL})")
+
+
+if __name__ == "__main__":
+    main()
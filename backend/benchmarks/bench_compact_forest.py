@@ -0,0 +1,111 @@
+"""Compact forest vs the joblib pickle: parity, load time, memory and predict latency.
+
+Run from the backend folder:
+    python -m benchmarks.bench_compact_forest [--rows 2000] [--repeats 20]
+
+Uses the deployed model/scaler when present, otherwise a synthetic
+RandomForest (see bench_forecast_predict). Load time and peak RSS are
+measured in a fresh interpreter per format so neither sees the other's pages.
+"""
+import argparse
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import joblib
+import numpy as np
+from benchmarks.bench_forecast_predict import load_or_build_model
+from stargazing.compact_forest import CompactForest, export_forest
+
+
+def child_load(kind, model_path, scaler_path, forest_dir):
+    """Runs in a subprocess: load one format, predict once, report time and peak RSS."""
+    before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    if kind == "joblib":
+        model, scaler = joblib.load(model_path), joblib.load(scaler_path)
+        loaded = time.perf_counter() - start
+        model.predict(scaler.transform(np.zeros((7, model.n_features_in_))))
+    else:
+        forest = CompactForest.load(forest_dir)
+        loaded = time.perf_counter() - start
+        forest.predict(np.zeros((7, forest.n_features_in_)))
+    first = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - before
+    # ru_maxrss is KiB on Linux, bytes on macOS
+    scale = 1024 if sys.platform == "darwin" else 1
+    print(f"{loaded:.4f} {first:.4f} {peak / scale / 1024:.1f}")
+
+
+def measure_load(kind, model_path, scaler_path, forest_dir):
+    output = subprocess.run(
+        [sys.executable, "-m", "benchmarks.bench_compact_forest", "--child", kind,
+         model_path, scaler_path, forest_dir],
+        check=True, capture_output=True, text=True,
+    ).stdout.split()
+    return float(output[0]), float(output[1]), float(output[2])
+
+
+def dir_size(path):
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == "--child":
+        child_load(*sys.argv[2:6])
+        return
+
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    model, scaler = load_or_build_model()
+    with tempfile.TemporaryDirectory() as workdir:
+        model_path = os.path.join(workdir, "model.pkl")
+        scaler_path = os.path.join(workdir, "scaler.pkl")
+        forest_dir = os.path.join(workdir, "forest")
+        joblib.dump(model, model_path)
+        joblib.dump(scaler, scaler_path)
+        start = time.perf_counter()
+        meta = export_forest(model, scaler, forest_dir)
+        print(f"export: {meta['n_trees']} trees, {meta['n_nodes']} nodes, "
+              f"depth {meta['max_depth']} in {time.perf_counter() - start:.2f}s")
+        print(f"size:   pickle {os.path.getsize(model_path) / 1e6:.1f} MB, "
+              f"compact {dir_size(forest_dir) / 1e6:.1f} MB")
+
+        for kind in ("joblib", "compact"):
+            loaded, first, peak = measure_load(kind, model_path, scaler_path, forest_dir)
+            print(f"{kind:>8}: load {loaded * 1000:8.1f} ms, first prediction after "
+                  f"{first * 1000:8.1f} ms, peak RSS +{peak:.0f} MB")
+
+        forest = CompactForest.load(forest_dir)
+        rng = np.random.default_rng(2)
+        X = rng.normal(scaler.mean_, scaler.scale_ * 1.5, size=(args.rows, forest.n_features_in_))
+        expected = model.predict(scaler.transform(X))
+        got = forest.predict(X)
+        diff = np.abs(expected - got)
+        print(f"parity: max |diff| {diff.max():.2e} over {args.rows} rows, "
+              f"{np.mean(diff < 1e-9):.2%} identical")
+        assert np.allclose(expected, got, atol=1e-6), "compact forest diverges from sklearn"
+
+        # Where the compact forest stops paying off (the service predicts 7 rows per site)
+        for rows in sorted({7, 35, 140, 500, args.rows}):
+            timings = {}
+            for name, fn in (
+                ("sklearn", lambda: model.predict(scaler.transform(X[:rows]))),
+                ("compact", lambda: forest.predict(X[:rows])),
+            ):
+                fn()
+                start = time.perf_counter()
+                for _ in range(args.repeats):
+                    fn()
+                timings[name] = (time.perf_counter() - start) / args.repeats
+            print(f"predict {rows:>5} rows: sklearn {timings['sklearn'] * 1000:.1f} ms, "
+                  f"compact {timings['compact'] * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
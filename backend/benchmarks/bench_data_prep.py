@@ -0,0 +1,130 @@
+"""Row-wise vs vectorised data preparation on a synthetic multi-year dataset.
+
+Run from the backend folder:
+    python -m benchmarks.bench_data_prep [--years 20]
+
+Builds NSB and weather CSVs shaped like the real exports (mixed m/d/YYYY and
+m/d/YY dates, "HH:MM" sun/moon times with blanks, unit-suffixed weather
+columns), then times the original apply()-based steps against data_prep and
+checks both give the same frame. Also compares reading the merged data back
+from CSV and Parquet.
+"""
+import argparse
+import os
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+import pandas as pd
+from stargazing import data_prep
+from stargazing.features import TARGET_COLUMN, TIME_COLUMNS
+
+WEATHER_COLUMNS = ["temperature_2m_mean (°C)", "rain_sum (mm)", "cloud_cover_mean (%)"]
+
+
+def make_inputs(workdir, years):
+    rng = np.random.default_rng(0)
+    days = [date(2000, 1, 1) + timedelta(days=i) for i in range(int(years * 365.25))]
+    n = len(days)
+
+    def clock(missing_share):
+        values = [f"{h:02d}:{m:02d}" for h, m in zip(rng.integers(0, 24, n), rng.integers(0, 60, n))]
+        return [v if keep else "" for v, keep in zip(values, rng.random(n) > missing_share)]
+
+    nsb = pd.DataFrame({
+        # Half the rows use two-digit years, as in the hand-edited source file
+        "Date": [d.strftime("%m/%d/%Y" if i % 2 else "%m/%d/%y") for i, d in enumerate(days)],
+        TARGET_COLUMN: np.where(rng.random(n) > 0.05, rng.normal(19, 1, n), np.nan),
+    })
+    for column in TIME_COLUMNS:
+        nsb[column] = clock(0.03 if column.startswith("Moon") else 0.0)
+    nsb_path = os.path.join(workdir, "nsb.csv")
+    nsb.to_csv(nsb_path, index=False)
+
+    weather = pd.DataFrame({"time": [d.isoformat() for d in days]})
+    for column in WEATHER_COLUMNS:
+        weather[column] = rng.normal(20, 5, n).round(1)
+    weather_path = os.path.join(workdir, "weather.csv")
+    with open(weather_path, "w", encoding="utf-8") as f:
+        f.write("latitude,longitude\n22.3,114.2\n\n")
+        weather.to_csv(f, index=False)
+    return nsb_path, weather_path
+
+
+# --- The original row-wise steps (data_filter.py / model_training.py) ---
+
+
+def parse_date(date_str):
+    for fmt in ("%m/%d/%Y", "%m/%d/%y"):
+        try:
+            return datetime.strptime(str(date_str), fmt)
+        except Exception:
+            continue
+    return pd.NaT
+
+
+def time_string_to_number(time_string):
+    try:
+        if pd.isna(time_string) or time_string in ["", None]:
+            return -1
+        time_only = datetime.strptime(time_string, "%H:%M").time()
+        return time_only.hour * 60 + time_only.minute
+    except Exception:
+        return -1
+
+
+def rowwise(nsb_path, weather_path):
+    df_nsb = pd.read_csv(nsb_path)
+    df_nsb = df_nsb[df_nsb.notna().sum(axis=1) > 1]
+    df_nsb["Date"] = df_nsb["Date"].apply(parse_date)
+    df_nsb["Date"] = df_nsb["Date"].dt.strftime("%Y-%m-%d")
+    df_weather = pd.read_csv(weather_path, skiprows=3)
+    df_weather["Date"] = pd.to_datetime(df_weather["time"], errors="coerce").dt.strftime("%Y-%m-%d")
+    df_weather = df_weather.drop(columns=["time"])
+    merged = data_prep.merge_nsb_weather(df_nsb, df_weather)
+
+    data = merged.drop(columns=["Date"]).rename(columns=data_prep.training_column_name)
+    for col in TIME_COLUMNS:
+        data[col] = data[col].apply(time_string_to_number)
+    data = data.dropna(subset=[TARGET_COLUMN])
+    for col in data.columns:
+        if col not in [TARGET_COLUMN] + TIME_COLUMNS:
+            data[col] = pd.to_numeric(data[col], errors="coerce")
+    return merged, data.fillna(data.mean(numeric_only=True))
+
+
+def vectorised(nsb_path, weather_path):
+    merged = data_prep.build_merged(nsb_path, weather_path)
+    return merged, data_prep.prepare_training_frame(merged)
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--years", type=float, default=20)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        nsb_path, weather_path = make_inputs(workdir, args.years)
+        (old_merged, old), old_time = timed(rowwise, nsb_path, weather_path)
+        (new_merged, new), new_time = timed(vectorised, nsb_path, weather_path)
+        print(f"{len(old)} nights: row-wise {old_time:.2f} s, vectorised {new_time:.2f} s "
+              f"({old_time / new_time:.1f}x)")
+        pd.testing.assert_frame_equal(old_merged, new_merged)
+        pd.testing.assert_frame_equal(old, new, check_dtype=False)
+        print("frames: identical")
+
+        for ext in (".csv", ".parquet"):
+            path = os.path.join(workdir, "merged" + ext)
+            data_prep.write_frame(new_merged, path)
+            _, read_time = timed(data_prep.read_frame, path)
+            print(f"read {ext:<8} {read_time * 1000:7.1f} ms, {os.path.getsize(path) / 1e6:.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
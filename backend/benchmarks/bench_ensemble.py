@@ -0,0 +1,109 @@
+"""Benchmark process_ensemble_grouped against the original pure-Python loop.
+
+Run from the backend folder:
+    python -m benchmarks.bench_ensemble [--members 51] [--days 15] [--repeats 200]
+
+Builds a synthetic Open-Meteo ensemble payload covering every VAR_METHOD
+variable (with some missing values) and checks both versions agree.
+"""
+import argparse
+import math
+import statistics
+import sys
+import time
+import numpy as np
+from stargazing.stargazing_service import VAR_METHOD, process_ensemble_grouped
+
+
+def legacy_process_ensemble_grouped(data):
+    """The original implementation, kept here as the reference."""
+    if isinstance(data, list):
+        data = data[0]
+    daily = data["daily"]
+    daily_units = data.get("daily_units", {})
+    dates = daily["time"]
+    date_dict = {date: {"date": date} for date in dates}
+    for var, method in VAR_METHOD.items():
+        member_keys = [k for k in daily if k.startswith(var + "_member")]
+        det_key = f"{var}_icon_seamless"
+        unit = daily_units.get(det_key) or daily_units.get(var) or ""
+        for idx, date in enumerate(dates):
+            values = []
+            for mk in member_keys:
+                values.append(daily[mk][idx])
+            if det_key in daily:
+                values.append(daily[det_key][idx])
+            values = [
+                v
+                for v in values
+                if v is not None and not (isinstance(v, float) and math.isnan(v))
+            ]
+            if not values:
+                continue
+            if method == "mean":
+                value = float(statistics.mean(values))
+            else:
+                value = float(statistics.median(values))
+            date_dict[date][var] = value
+            date_dict[date][f"{var}_unit"] = unit
+    return list(date_dict.values())
+
+
+def synthetic_payload(members, days):
+    rng = np.random.default_rng(0)
+    daily = {"time": [f"2025-06-{d + 1:02d}" for d in range(days)]}
+    units = {}
+    for var in VAR_METHOD:
+        base = rng.uniform(0, 1000)
+        units[var] = "unit"
+        for m in range(members):
+            values = (base + rng.normal(0, 5, days)).round(2).tolist()
+            # Open-Meteo returns null for missing members/days
+            for d in rng.choice(days, size=days // 5, replace=False):
+                values[d] = None
+            daily[f"{var}_member{m:02d}"] = values
+    # One variable with a day where every member is missing
+    first = next(iter(VAR_METHOD))
+    for m in range(members):
+        daily[f"{first}_member{m:02d}"][0] = None
+    return {"daily": daily, "daily_units": units}
+
+
+def timed(fn, payload, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        result = fn(payload)
+    return (time.perf_counter() - start) / repeats, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--members", type=int, default=51)
+    parser.add_argument("--days", type=int, default=15)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    payload = synthetic_payload(args.members, args.days)
+    legacy_seconds, expected = timed(legacy_process_ensemble_grouped, payload, args.repeats)
+    numpy_seconds, actual = timed(process_ensemble_grouped, payload, args.repeats)
+
+    print(f"{args.members} members x {args.days} days x {len(VAR_METHOD)} variables")
+    print(f"legacy: {legacy_seconds * 1000:8.2f} ms")
+    print(f"numpy:  {numpy_seconds * 1000:8.2f} ms  ({legacy_seconds / numpy_seconds:.1f}x)")
+
+    for old, new in zip(expected, actual):
+        if old.keys() != new.keys():
+            print(f"MISMATCH in keys for {old['date']}")
+            sys.exit(1)
+        for key, value in old.items():
+            same = value == new[key] or (
+                isinstance(value, float) and math.isclose(value, new[key], rel_tol=1e-12)
+            )
+            if not same:
+                print(f"MISMATCH {old['date']} {key}: {value} != {new[key]}")
+                sys.exit(1)
+    print("output: identical (means within 1e-12 relative float rounding)")
+
+
+if __name__ == "__main__":
+    main()
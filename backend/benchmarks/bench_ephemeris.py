@@ -0,0 +1,89 @@
+"""Computed ephemeris vs the Hong Kong Observatory rise/set CSVs, and lookup cost.
+
+Run from the backend folder:
+    python -m benchmarks.bench_ephemeris --sun data/Sun_rise_set_2025.csv --moon data/Moon_rise_set_2025.csv
+
+Prints the minute differences per event (HKO times are for Hong Kong, UTC+8)
+and compares parsing both CSVs with a table lookup for a 7-day forecast.
+"""
+import argparse
+import csv
+import time
+from datetime import date, datetime, timedelta
+import numpy as np
+from stargazing import ephemeris
+from stargazing.features import time_to_minutes
+from stargazing.stargazing_service import DEFAULT_LAT, DEFAULT_LON
+
+
+def load_times_csv(filepath):
+    """The parser the forecast used before the ephemeris tables."""
+    times = {}
+    with open(filepath, newline="", encoding="utf-8-sig") as csvfile:
+        reader = csv.DictReader(csvfile, delimiter=",")
+        for row in reader:
+            date_key = list(row.keys())[0]
+            date_obj = datetime.strptime(row[date_key].strip(), "%Y-%m-%d")
+            date_str = date_obj.strftime("%Y-%m-%d")
+            times[date_str] = {
+                "rise": row["RISE"].strip(),
+                "transit": row["TRAN."].strip(),
+                "set": row["SET"].strip(),
+            }
+    return times
+
+
+def compare(reference, body, lat, lon):
+    astronomy = ephemeris.astronomy_for_dates(sorted(reference), lat, lon)
+    for event in ("rise", "transit", "set"):
+        diffs, missing = [], 0
+        for day, values in reference.items():
+            expected = time_to_minutes(values[event])
+            got = astronomy[day][f"{body}_{event}"]
+            if (expected < 0) != (got < 0):
+                missing += 1
+            elif expected >= 0:
+                diffs.append(abs(expected - got))
+        diffs = np.array(diffs)
+        print(
+            f"{body}_{event:<8} mean |diff| {diffs.mean():.2f} min, max {diffs.max()} min, "
+            f"within 2 min {np.mean(diffs <= 2):.1%}, presence mismatches {missing}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sun")
+    parser.add_argument("--moon")
+    parser.add_argument("--lat", type=float, default=DEFAULT_LAT)
+    parser.add_argument("--lon", type=float, default=DEFAULT_LON)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    if args.sun:
+        compare(load_times_csv(args.sun), "sun", args.lat, args.lon)
+    if args.moon:
+        compare(load_times_csv(args.moon), "moon", args.lat, args.lon)
+
+    start = time.perf_counter()
+    ephemeris.compute_table(ephemeris._year_days(date.today().year), args.lat, args.lon)
+    print(f"compute one year: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    week = [(date.today() + timedelta(days=i)).isoformat() for i in range(7)]
+    ephemeris.astronomy_for_dates(week, args.lat, args.lon)  # warm the table cache
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        ephemeris.astronomy_for_dates(week, args.lat, args.lon)
+    lookup = (time.perf_counter() - start) / args.repeats
+    print(f"7-day lookup:     {lookup * 1e6:.1f} us")
+
+    if args.sun and args.moon:
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            load_times_csv(args.sun), load_times_csv(args.moon)
+        parse = (time.perf_counter() - start) / args.repeats
+        print(f"CSV parse:        {parse * 1e6:.1f} us ({parse / lookup:.0f}x)")
+
+
+if __name__ == "__main__":
+    main()
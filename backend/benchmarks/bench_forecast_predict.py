@@ -0,0 +1,77 @@
+"""Per-forecast prediction latency: one predict call per day vs one batched call.
+
+Run from the backend folder:
+    python -m benchmarks.bench_forecast_predict [--days 7] [--repeats 20]
+
+Uses the deployed model/scaler when present, otherwise a synthetic
+RandomForest of similar size (1000 trees, depth 20).
+"""
+import argparse
+import os
+import time
+import joblib
+import numpy as np
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+from stargazing.features import FEATURE_SPEC, build_feature_matrix
+from stargazing.stargazing_service import MODEL_PATH, SCALER_PATH, predict_mpsas
+
+
+def load_or_build_model():
+    if os.path.exists(MODEL_PATH) and os.path.exists(SCALER_PATH):
+        return joblib.load(MODEL_PATH), joblib.load(SCALER_PATH)
+    rng = np.random.default_rng(0)
+    X = rng.normal(size=(2000, len(FEATURE_SPEC)))
+    y = 19 + X[:, :5].sum(axis=1) * 0.1 + rng.normal(0, 0.1, 2000)
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(n_estimators=1000, max_depth=20, n_jobs=-1, random_state=0)
+    model.fit(scaler.transform(X), y)
+    return model, scaler
+
+
+def synthetic_entries(days):
+    rng = np.random.default_rng(1)
+    entries = []
+    for d in range(days):
+        entry = {"date": f"2025-06-{d + 1:02d}"}
+        for key, _, kind in FEATURE_SPEC:
+            if kind == "time":
+                entry[key] = f"{rng.integers(0, 24):02d}:{rng.integers(0, 60):02d}"
+            else:
+                entry[key] = float(rng.normal(20, 5))
+        entries.append(entry)
+    return entries
+
+
+def per_day_predict(model, scaler, entries):
+    """The original loop: a 1-row transform + predict per day."""
+    X = build_feature_matrix(entries)
+    return np.array([model.predict(scaler.transform(row.reshape(1, -1)))[0] for row in X])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--days", type=int, default=7)
+    parser.add_argument("--repeats", type=int, default=20)
+    args = parser.parse_args()
+
+    model, scaler = load_or_build_model()
+    entries = synthetic_entries(args.days)
+
+    timings = {}
+    outputs = {}
+    for name, fn in (("per-day", per_day_predict), ("batched", predict_mpsas)):
+        fn(model, scaler, entries)  # warm-up
+        start = time.perf_counter()
+        for _ in range(args.repeats):
+            outputs[name] = fn(model, scaler, entries)
+        timings[name] = (time.perf_counter() - start) / args.repeats
+        print(f"{name:>8}: {timings[name] * 1000:8.1f} ms per {args.days}-day forecast")
+
+    print(f"speedup: {timings['per-day'] / timings['batched']:.1f}x")
+    assert np.allclose(outputs["per-day"], outputs["batched"]), "predictions differ"
+    print("predictions: identical")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""Compare batched vs two-pass classifier-free guidance on CPU.
+
+Run from the backend folder:
+    python -m benchmarks.bench_guidance [--steps 50] [--repeats 3]
+
+Each mode runs in a fresh process so the reported peak RSS belongs to that
+mode alone. Uses the trained checkpoint when present, random weights otherwise.
+"""
+import argparse
+import multiprocessing as mp
+import os
+import resource
+import time
+import torch
+from music_to_image.model_architecture import EmotionConditionedUNet
+from music_to_image.model_registry import latest_diffusion_checkpoint
+from music_to_image.samplers import get_device_schedule, p_sample
+
+
+def _run(mode, steps, repeats, queue):
+    torch.manual_seed(0)
+    device = torch.device("cpu")
+    model = EmotionConditionedUNet().to(device)
+    checkpoint = latest_diffusion_checkpoint()
+    if os.path.exists(checkpoint):
+        model.load_state_dict(torch.load(checkpoint, map_location=device))
+    model.eval()
+    schedule = get_device_schedule(steps, device)
+    v = torch.tensor([0.6])
+    a = torch.tensor([0.4])
+
+    timings = []
+    for _ in range(repeats):
+        torch.manual_seed(0)
+        x = torch.randn(1, 3, 128, 128)
+        start = time.perf_counter()
+        for i in reversed(range(steps)):
+            t = torch.full((1,), i, dtype=torch.long)
+            x = p_sample(model, x, t, i, v, a, schedule, device, 5.0, mode)
+        timings.append(time.perf_counter() - start)
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((mode, min(timings), peak_mb, x))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--steps", type=int, default=50)
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+
+    ctx = mp.get_context("spawn")
+    results = {}
+    for mode in ("two_pass", "batched"):
+        queue = ctx.Queue()
+        proc = ctx.Process(target=_run, args=(mode, args.steps, args.repeats, queue))
+        proc.start()
+        name, seconds, peak_mb, image = queue.get()
+        proc.join()
+        results[name] = (seconds, peak_mb, image)
+        print(f"{name:>9}: {seconds:7.2f} s  peak RSS {peak_mb:8.1f} MB")
+
+    base, fast = results["two_pass"], results["batched"]
+    diff = (base[2] - fast[2]).abs().max().item()
+    print(f"speedup: {base[0] / fast[0]:.2f}x, max abs output difference: {diff:.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,53 @@
+"""Light-pollution query latency: single points, batches and areas.
+
+Run from the backend folder:
+    python -m benchmarks.bench_light_pollution [--points 1000] [--repeats 200]
+
+Also checks the vectorised batch lookup against geo_to_pixel applied point by point.
+"""
+import argparse
+import time
+import numpy as np
+from stargazing import light_pollution
+
+
+def per_call(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--points", type=int, default=1000)
+    parser.add_argument("--repeats", type=int, default=200)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    classes = light_pollution.load_classes()
+    print(f"load: {(time.perf_counter() - start) * 1000:.2f} ms for a {classes.shape} raster")
+
+    rng = np.random.default_rng(0)
+    lats = rng.uniform(light_pollution.lat_min, light_pollution.lat_max, args.points)
+    lons = rng.uniform(light_pollution.lon_min, light_pollution.lon_max, args.points)
+    points = np.column_stack([lats, lons]).tolist()
+
+    batch = light_pollution.query_points(points)
+    h, w = classes.shape
+    for (lat, lon), result in zip(points, batch):
+        x, y = light_pollution.geo_to_pixel(lat, lon, w, h)
+        assert result["mpsas"] == round(float(light_pollution.CLASS_MPSAS[classes[y, x]]), 2)
+    print("batch lookup: matches geo_to_pixel")
+
+    single = per_call(lambda: light_pollution.query_point(22.388, 114.370), args.repeats)
+    many = per_call(lambda: light_pollution.query_points(points), max(1, args.repeats // 10))
+    area = per_call(lambda: light_pollution.query_area(22.2, 22.5, 114.1, 114.4), args.repeats)
+    print(f"single point: {single * 1e6:8.1f} us")
+    print(f"{args.points} points:  {many * 1e6:8.1f} us ({many / args.points * 1e6:.2f} us/point)")
+    print(f"area:         {area * 1e6:8.1f} us")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""Exercise the Open-Meteo client against a local stub server.
+
+Run from the backend folder:
+    python -m benchmarks.stub_open_meteo
+
+The stub answers with a small ensemble payload and an ETag, honours
+If-None-Match with 304, and can be told to fail or hang. The script checks
+keep-alive reuse, conditional requests, retries, timeouts and the circuit
+breaker, then prints the client metrics.
+"""
+import gzip
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAYLOAD = {
+    "daily": {
+        "time": ["2025-01-01", "2025-01-02"],
+        "cloud_cover_mean_member01": [10, 80],
+        "cloud_cover_mean_member02": [20, 90],
+    }
+}
+ETAG = '"stub-v1"'
+
+
+class StubState:
+    def __init__(self):
+        self.mode = "ok"  # ok | fail | hang
+        self.hits = 0
+        self.connections = set()
+
+
+state = StubState()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        state.hits += 1
+        state.connections.add(self.client_address)
+        if state.mode == "hang":
+            time.sleep(3)
+        if state.mode == "fail":
+            self.send_response(503)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        if self.headers.get("If-None-Match") == ETAG:
+            self.send_response(304)
+            self.send_header("ETag", ETAG)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        body = json.dumps(PAYLOAD).encode()
+        if "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_response(200)
+            self.send_header("Content-Encoding", "gzip")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("ETag", ETAG)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def main():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    from stargazing import open_meteo
+
+    open_meteo.ENSEMBLE_URL = f"http://127.0.0.1:{server.server_port}/v1/ensemble"
+    open_meteo.READ_TIMEOUT = 1.0
+    open_meteo.breaker = open_meteo.CircuitBreaker(threshold=2, reset_after=1.0)
+    breaker = open_meteo.breaker
+
+    data = open_meteo.fetch_ensemble(22.38, 114.27)
+    assert data == PAYLOAD, "first fetch should return the payload"
+    data = open_meteo.fetch_ensemble(22.38, 114.27)
+    assert data == PAYLOAD, "304 should reuse the stored body"
+    assert open_meteo.metrics.not_modified == 1
+    print(f"keep-alive: {state.hits} requests over {len(state.connections)} connection(s)")
+
+    for mode in ("fail", "hang"):
+        state.mode = mode
+        start = time.perf_counter()
+        try:
+            open_meteo.fetch_ensemble(22.38, 114.27, retries=1)
+        except open_meteo.UpstreamError as e:
+            print(f"{mode}: {e} after {time.perf_counter() - start:.2f}s")
+    assert breaker.state == "open", "breaker should open after repeated failures"
+
+    try:
+        open_meteo.fetch_ensemble(22.38, 114.27)
+    except open_meteo.CircuitOpenError as e:
+        print(f"short-circuited: {e}")
+
+    state.mode = "ok"
+    time.sleep(1.1)
+    assert breaker.state == "half-open"
+    open_meteo.fetch_ensemble(22.38, 114.27)
+    assert breaker.state == "closed", "a successful trial request should close the breaker"
+
+    print(json.dumps(open_meteo.upstream_status(), indent=2))
+    open_meteo.close_session()
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,15 +1,123 @@
-from fastapi import FastAPI, UploadFile, File
+from contextlib import asynccontextmanager
+from typing import List, Optional
+from fastapi import Body, FastAPI, UploadFile, File, Response
+from fastapi.responses import JSONResponse
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from stargazing.stargazing_service import get_7day_stargazing_forecast
-from music_to_image.music_image_service import generate_image_from_music
+from stargazing.stargazing_service import forecast_cache, get_7day_stargazing_forecast, preload_ephemeris
+from stargazing.multi_site import SITE_SETS, get_multi_site_forecast
+from stargazing.open_meteo import close_async_client, close_session, upstream_status
+from stargazing.light_pollution import load_classes, query_area, query_point, query_points
+from music_to_image.music_image_service import (
+    MAX_UPLOAD_BYTES,
+    UploadTooLarge,
+    generate_image_from_music,
+    scheduler,
+)
+from music_to_image.model_registry import registry
+from music_to_image.samplers import get_sampler
+from music_to_image.worker_pool import shutdown_feature_pool
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Load the music and diffusion models once and keep them warm
+    try:
+        registry.load()
+    except Exception as e:
+        print(f"Music-to-image models not loaded at startup: {e}")
+    registry.start_watcher()
+    scheduler.start()
+    try:
+        preload_ephemeris()
+    except Exception as e:
+        print(f"Ephemeris tables not preloaded: {e}")
+    try:
+        load_classes()
+    except Exception as e:
+        print(f"Light-pollution raster not loaded: {e}")
+    forecast_cache.start_scheduler()
+    yield
+    forecast_cache.stop_scheduler()
+    await close_async_client()
+    close_session()
+    scheduler.stop()
+    shutdown_feature_pool()
+    registry.stop_watcher()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+class UploadSizeLimit:
+    """Rejects request bodies over `max_bytes` (+ `overhead` for multipart framing) with a 413,
+    counting bytes as they stream in.
+
+    A too-large Content-Length is refused before reading anything; chunked or
+    headerless bodies are cut off as soon as the running total passes the limit,
+    before the multipart parser spools the rest.
+    """
+
+    def __init__(self, app, path, max_bytes, overhead=0):
+        self.app = app
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_body = max_bytes + overhead
+
+    def _too_large(self):
+        return JSONResponse(
+            status_code=413,
+            content={"error": f"File is too large (limit {self.max_bytes / (1024 * 1024):g} MB)."},
+        )
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] != self.path:
+            return await self.app(scope, receive, send)
+
+        length = dict(scope["headers"]).get(b"content-length", b"")
+        if length.isdigit() and int(length) > self.max_body:
+            return await self._too_large()(scope, receive, send)
+
+        received = 0
+        exceeded = False
+
+        async def limited_receive():
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body:
+                    exceeded = True
+                    raise UploadTooLarge("Request body exceeds the upload limit")
+            return message
+
+        async def guarded_send(message):
+            # Once over the limit, whatever the app answers (FastAPI turns the
+            # parse failure into a 400) is replaced by our 413
+            if not exceeded:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not exceeded:
+                raise
+        if exceeded:
+            await self._too_large()(scope, receive, send)
+
+
+# Added before CORS so that CORS wraps it and its 413 stays readable by the browser.
+# Allow some room for the multipart boundaries and headers.
+app.add_middleware(UploadSizeLimit, path="/api/music-to-image", max_bytes=MAX_UPLOAD_BYTES, overhead=64 * 1024)
+
 
-app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],  # For development, allow all. Restrict in production.
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "Retry-After", "X-Feature-Cache"],
 )
 
 
@@ -19,10 +127,74 @@ def root():
 
 
 @app.get("/api/stargazing-forecast")
-def stargazing_forecast():
-    return get_7day_stargazing_forecast()
+async def stargazing_forecast(sites: Optional[str] = None, site_set: Optional[str] = None):
+    # No sites: the original single-location 7-day list
+    if sites is None and site_set is None:
+        return await run_in_threadpool(get_7day_stargazing_forecast)
+    try:
+        return await get_multi_site_forecast(sites, site_set)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+
+@app.get("/api/stargazing-sites")
+def stargazing_sites():
+    return SITE_SETS
+
+
+@app.get("/api/stargazing-forecast/upstream")
+def stargazing_upstream():
+    return upstream_status()
+
+
+@app.get("/api/light-pollution")
+def light_pollution(lat: float, lon: float):
+    try:
+        result = query_point(lat, lon)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if result is None:
+        return JSONResponse(status_code=404, content={"error": "Location is outside the light-pollution map"})
+    return result
+
+
+@app.post("/api/light-pollution/batch")
+def light_pollution_batch(points: List[List[float]] = Body(..., embed=True)):
+    # {"points": [[lat, lon], ...]}; points outside the map come back as null
+    if any(len(point) != 2 for point in points):
+        return JSONResponse(status_code=400, content={"error": "Each point must be [lat, lon]"})
+    try:
+        return {"results": query_points(points)}
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+
+
+@app.get("/api/light-pollution/area")
+def light_pollution_area(lat_min: float, lat_max: float, lon_min: float, lon_max: float):
+    try:
+        result = query_area(lat_min, lat_max, lon_min, lon_max)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    if result is None:
+        return JSONResponse(status_code=404, content={"error": "Area is outside the light-pollution map"})
+    return result
+
+
+@app.get("/api/music-to-image/models")
+def music_to_image_models():
+    return registry.stats()
 
 
 @app.post("/api/music-to-image")
-async def music_to_image(file: UploadFile = File(...)):
-    return await generate_image_from_music(file)
+async def music_to_image(
+    response: Response,
+    file: UploadFile = File(...),
+    sampler: str = "ddpm",
+    steps: Optional[int] = None,
+):
+    # Reject unknown samplers and out-of-range step counts before any work is queued
+    try:
+        get_sampler(sampler, steps)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"error": str(e)})
+    return await generate_image_from_music(file, response, sampler=sampler, steps=steps)
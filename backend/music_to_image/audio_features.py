@@ -0,0 +1,233 @@
+import io
+import os
+import re
+import tempfile
+from contextlib import contextmanager
+import librosa
+import numpy as np
+import soundfile as sf
+
+# How uploads are decoded before analysis:
+#   "excerpt" - resample to ANALYSIS_SR and keep the centred ANALYSIS_SECONDS (default)
+#   "stream"  - walk the whole file in fixed-size blocks, resampled to ANALYSIS_SR,
+#               with running statistics (formats soundfile cannot read fall back to "excerpt")
+#   "full"    - decode the whole file at its native rate (original behaviour)
+DECODE_MODE = os.environ.get("MUSIC_DECODE_MODE", "excerpt")
+# 44.1 kHz is what most uploads already use, so they skip resampling
+ANALYSIS_SR = int(os.environ.get("MUSIC_ANALYSIS_SR", "44100"))
+ANALYSIS_SECONDS = float(os.environ.get("MUSIC_ANALYSIS_SECONDS", "45"))
+# Stream mode: frames per block (~24 s at 44.1 kHz) and a cap on audio analysed
+STREAM_BLOCK_FRAMES = int(os.environ.get("MUSIC_STREAM_BLOCK_FRAMES", "2048"))
+STREAM_MAX_SECONDS = float(os.environ.get("MUSIC_STREAM_MAX_SECONDS", "600"))
+# Shorter trailing stream blocks are skipped (too short for the lowest CQT octave)
+STREAM_MIN_BLOCK_SECONDS = 2.0
+
+# Bump the leading number whenever the feature vector for a given file would
+# change; the decode settings are part of it because they change the vector too.
+FEATURE_VERSION = f"2-{DECODE_MODE}-{ANALYSIS_SR}-{ANALYSIS_SECONDS:g}"
+
+# --- Audio Feature Extraction ---
+#
+# librosa's feature functions each recompute their own spectrogram when given
+# a raw signal. Here the STFT, mel spectrogram and CQT are computed once and
+# every feature is derived from those, using the same librosa defaults
+# (n_fft=2048, hop_length=512) so the 136-value vector is unchanged.
+
+
+def aggregate(feature_matrix):
+    return np.concatenate(
+        [np.mean(feature_matrix, axis=1), np.std(feature_matrix, axis=1)]
+    )
+
+
+def spectral_intermediates(y, sr):
+    """STFT magnitude/power, log-mel spectrogram and CQT magnitude, each computed once."""
+    magnitude = np.abs(librosa.stft(y))
+    power = magnitude ** 2
+    log_mel = librosa.power_to_db(librosa.feature.melspectrogram(S=power, sr=sr))
+
+    # chroma_cqt/chroma_cens/tonnetz would each estimate tuning from their own STFT
+    tuning = librosa.estimate_tuning(S=magnitude, sr=sr, bins_per_octave=36)
+    cqt = np.abs(
+        librosa.cqt(y=y, sr=sr, n_bins=7 * 36, bins_per_octave=36, tuning=tuning)
+    )
+    return {"magnitude": magnitude, "power": power, "log_mel": log_mel, "cqt": cqt}
+
+
+def feature_matrices(y, sr):
+    """Frame-level feature matrices (and tempo) in extract_audio_features order."""
+    spec = spectral_intermediates(y, sr)
+    magnitude = spec["magnitude"]
+
+    onset_envelope = librosa.onset.onset_strength(
+        S=spec["log_mel"], sr=sr, aggregate=np.median
+    )
+    tempo, _ = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr)
+    chroma_cqt = librosa.feature.chroma_cqt(C=spec["cqt"], sr=sr)
+
+    return [
+        ("mfcc", librosa.feature.mfcc(S=spec["log_mel"], n_mfcc=13)),
+        ("chroma_stft", librosa.feature.chroma_stft(S=spec["power"], sr=sr)),
+        ("spectral_contrast", librosa.feature.spectral_contrast(S=magnitude, sr=sr)),
+        ("zero_crossing_rate", librosa.feature.zero_crossing_rate(y=y)),
+        ("tempo", np.array([tempo]).reshape(-1, 1)),
+        ("rms", librosa.feature.rms(y=y)),
+        ("spectral_centroid", librosa.feature.spectral_centroid(S=magnitude, sr=sr)),
+        ("spectral_bandwidth", librosa.feature.spectral_bandwidth(S=magnitude, sr=sr)),
+        ("spectral_rolloff", librosa.feature.spectral_rolloff(S=magnitude, sr=sr)),
+        ("tonnetz", librosa.feature.tonnetz(chroma=chroma_cqt, sr=sr)),
+        ("chroma_cqt", chroma_cqt),
+        ("chroma_cens", librosa.feature.chroma_cens(C=spec["cqt"], sr=sr)),
+    ]
+
+
+def features_from_signal(y, sr):
+    """136-value feature vector (FEATURE_COLUMNS order) for a mono signal."""
+    return np.concatenate([aggregate(matrix) for _, matrix in feature_matrices(y, sr)])
+
+
+class RunningStats:
+    """Per-row mean/std over frames seen block by block; matches aggregate() on the concatenation."""
+
+    def __init__(self):
+        self.count = 0
+        self.mean = None
+        self.m2 = None
+
+    def update(self, feature_matrix):
+        n_block = feature_matrix.shape[1]
+        if n_block == 0:
+            return
+        block_mean = np.mean(feature_matrix, axis=1)
+        block_m2 = np.sum((feature_matrix - block_mean[:, None]) ** 2, axis=1)
+        if self.count == 0:
+            self.count, self.mean, self.m2 = n_block, block_mean, block_m2
+            return
+        # Chan et al. pairwise update
+        total = self.count + n_block
+        delta = block_mean - self.mean
+        self.mean = self.mean + delta * n_block / total
+        self.m2 = self.m2 + block_m2 + delta ** 2 * self.count * n_block / total
+        self.count = total
+
+    def aggregate(self):
+        return np.concatenate([self.mean, np.sqrt(self.m2 / self.count)])
+
+
+def _rewind(source):
+    if hasattr(source, "seek"):
+        source.seek(0)
+    return source
+
+
+def load_excerpt(music_file_path, sr=ANALYSIS_SR, seconds=ANALYSIS_SECONDS):
+    """Decode only the centred `seconds` of the file, resampled to `sr`."""
+    duration = librosa.get_duration(path=_rewind(music_file_path))
+    offset = max(0.0, (duration - seconds) / 2)
+    return librosa.load(_rewind(music_file_path), sr=sr, offset=offset, duration=seconds)
+
+
+def stream_features(music_file_path, block_frames=STREAM_BLOCK_FRAMES, max_seconds=STREAM_MAX_SECONDS):
+    """Feature vector from fixed-size blocks, so memory does not grow with file length.
+
+    Blocks are read at the file's native rate and resampled to ANALYSIS_SR, so
+    the features match the excerpt mode's rate (and FEATURE_VERSION). Frame-level
+    features are aggregated with running mean/std across blocks. Tempo is
+    estimated per block and averaged; its std is 0 as in the whole-signal path,
+    which yields a single tempo value.
+    """
+    sr = librosa.get_samplerate(_rewind(music_file_path))
+    blocks = librosa.stream(
+        _rewind(music_file_path), block_length=block_frames, frame_length=2048, hop_length=512, mono=True
+    )
+    stats, tempos, seen = None, [], 0.0
+    for block in blocks:
+        block_seconds = len(block) / sr
+        if stats is not None and block_seconds < STREAM_MIN_BLOCK_SECONDS:
+            break
+        if sr != ANALYSIS_SR:
+            block = librosa.resample(block, orig_sr=sr, target_sr=ANALYSIS_SR)
+        matrices = feature_matrices(block, ANALYSIS_SR)
+        if stats is None:
+            stats = [RunningStats() for _ in matrices]
+        for running, (name, matrix) in zip(stats, matrices):
+            if name == "tempo":
+                tempos.append(float(matrix[0, 0]))
+            else:
+                running.update(matrix)
+        seen += block_seconds
+        if seen >= max_seconds:
+            break
+    if stats is None:
+        raise ValueError("Audio file contains no samples")
+
+    parts = []
+    for running, (name, _) in zip(stats, matrices):
+        if name == "tempo":
+            parts.append(np.array([np.mean(tempos), 0.0]))
+        else:
+            parts.append(running.aggregate())
+    return np.concatenate(parts)
+
+
+@contextmanager
+def audio_source(data, filename=None):
+    """Something librosa can decode for in-memory upload bytes.
+
+    Formats libsndfile understands (wav, flac, ogg, and mp3 on recent builds)
+    are decoded straight from a BytesIO. Anything else (e.g. m4a) needs
+    ffmpeg through audioread, which only takes a path, so it goes to a
+    uniquely named temp file that is removed afterwards.
+    """
+    buffer = io.BytesIO(data)
+    try:
+        sf.info(buffer)
+    except Exception:
+        pass
+    else:
+        yield _rewind(buffer)
+        return
+
+    # Only keep a short alphanumeric extension from the client-supplied name
+    suffix = os.path.splitext(os.path.basename(filename or ""))[1]
+    if not re.fullmatch(r"\.[A-Za-z0-9]{1,5}", suffix):
+        suffix = ""
+    fd, temp_path = tempfile.mkstemp(prefix="upload_", suffix=suffix)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        yield temp_path
+    finally:
+        os.remove(temp_path)
+
+
+def _soundfile_readable(source):
+    try:
+        sf.info(_rewind(source))
+    except Exception:
+        return False
+    return True
+
+
+def _extract(source, mode):
+    if mode == "stream":
+        # librosa.stream reads through soundfile only; m4a (and mp3 on older
+        # libsndfile) would fail, so those are analysed as an excerpt instead
+        if _soundfile_readable(source):
+            return stream_features(source)
+        mode = "excerpt"
+    if mode == "excerpt":
+        y, sr = load_excerpt(source)
+    elif mode == "full":
+        y, sr = librosa.load(_rewind(source), sr=None)
+    else:
+        raise ValueError(f"Unknown decode mode: {mode}")
+    return features_from_signal(y, sr)
+
+
+def extract_audio_features(music_file, mode=DECODE_MODE, filename=None):
+    """Extract audio features from a music file path or the raw bytes of an upload."""
+    if isinstance(music_file, (bytes, bytearray, memoryview)):
+        with audio_source(bytes(music_file), filename) as source:
+            return _extract(source, mode)
+    return _extract(music_file, mode)
@@ -0,0 +1,120 @@
+import asyncio
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+
+class _Job:
+    def __init__(self, v, a, seed, options):
+        self.v = v
+        self.a = a
+        self.seed = seed
+        self.options = options
+        # Only jobs with the same sampler settings can share a denoising loop
+        self.group = tuple(sorted(options.items()))
+        self.future = Future()
+
+
+class BatchScheduler:
+    """Collects generation jobs for a short window and runs them as one batch.
+
+    `generate_fn(emotions, seeds, **options)` must return one result per
+    (valence, arousal) pair. It runs on a single worker thread, so torch
+    never has two denoising loops competing for the same cores.
+    """
+
+    def __init__(self, generate_fn, max_batch_size=4, max_wait=0.05):
+        self.generate_fn = generate_fn
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._worker = None
+        self._lock = threading.Lock()
+        self._stopping = False
+
+    def start(self):
+        with self._lock:
+            if self._worker is not None:
+                return
+            self._stopping = False
+            self._worker = threading.Thread(target=self._run, name="diffusion-batcher", daemon=True)
+            self._worker.start()
+
+    def stop(self):
+        with self._lock:
+            if self._worker is None:
+                return
+            self._stopping = True
+            self._queue.put(None)
+            worker, self._worker = self._worker, None
+        worker.join(timeout=10)
+
+    def pending(self):
+        return self._queue.qsize()
+
+    def submit(self, v, a, seed=None, **options):
+        """Queue a job; returns a concurrent.futures.Future for its result."""
+        self.start()
+        job = _Job(v, a, seed, options)
+        self._queue.put(job)
+        return job.future
+
+    async def generate(self, v, a, seed=None, **options):
+        return await asyncio.wrap_future(self.submit(v, a, seed, **options))
+
+    def _collect(self, first):
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if job is None:
+                self._stopping = True
+                break
+            batch.append(job)
+        return batch
+
+    def _run(self):
+        while not self._stopping:
+            job = self._queue.get()
+            if job is None:
+                break
+            batch = self._collect(job)
+
+            groups = {}
+            for job in batch:
+                groups.setdefault(job.group, []).append(job)
+            for jobs in groups.values():
+                self._run_group(jobs)
+
+        # Fail whatever was still queued at shutdown instead of leaving it hanging
+        while True:
+            try:
+                job = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if job is not None and job.future.set_running_or_notify_cancel():
+                job.future.set_exception(RuntimeError("Image generation scheduler stopped"))
+
+    def _run_group(self, jobs):
+        jobs = [job for job in jobs if job.future.set_running_or_notify_cancel()]
+        if not jobs:
+            return
+        try:
+            results = self.generate_fn(
+                [(job.v, job.a) for job in jobs],
+                [job.seed for job in jobs],
+                **jobs[0].options,
+            )
+        except Exception as e:
+            for job in jobs:
+                job.future.set_exception(e)
+            return
+        for job, result in zip(jobs, results):
+            job.future.set_result(result)
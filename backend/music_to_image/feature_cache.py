@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def content_key(data, feature_version):
+    """Cache key for an upload: hash of its bytes plus the feature pipeline version."""
+    digest = hashlib.sha256(data).hexdigest()
+    return f"{digest}-v{feature_version}"
+
+
+class FeatureCache:
+    """LRU cache of audio feature vectors and emotion predictions, keyed by upload content.
+
+    Entries live in memory; when `cache_dir` is set they are also written there
+    as small JSON files so repeat uploads survive a restart. Predictions are
+    stored per music-model version, so a hot-swapped model recomputes them
+    from the cached features without touching librosa.
+    """
+
+    def __init__(self, max_entries=256, cache_dir=None):
+        self.max_entries = max_entries
+        self.cache_dir = cache_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _read_disk(self, key):
+        if not self.cache_dir:
+            return None
+        try:
+            with open(self._disk_path(key), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            return {
+                "features": np.asarray(entry["features"], dtype=np.float64),
+                "predictions": {k: tuple(v) for k, v in entry["predictions"].items()},
+            }
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_disk(self, key, entry):
+        if not self.cache_dir:
+            return
+        path = self._disk_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(
+                    {
+                        "features": entry["features"].tolist(),
+                        "predictions": {k: list(v) for k, v in entry["predictions"].items()},
+                    },
+                    f,
+                )
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Could not write feature cache entry {key}: {e}")
+
+    def _lookup(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+        entry = self._read_disk(key)
+        if entry is not None:
+            self._remember(key, entry)
+        return entry
+
+    def _remember(self, key, entry):
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def lookup(self, key):
+        """Return {"features", "predictions"} for `key`, or None on a miss."""
+        entry = self._lookup(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return entry
+
+    def put(self, key, features, model_version=None, prediction=None):
+        existing = self._lookup(key)
+        predictions = dict(existing["predictions"]) if existing else {}
+        if model_version is not None and prediction is not None:
+            predictions[model_version] = tuple(prediction)
+        entry = {"features": features, "predictions": predictions}
+        self._remember(key, entry)
+        self._write_disk(key, entry)
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "disk": self.cache_dir,
+        }
@@ -0,0 +1,175 @@
+import os
+import re
+import threading
+import time
+import joblib
+import torch
+from .model_architecture import EmotionConditionedUNet
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODELS_DIR = os.path.join(BASE_DIR, "models")
+MUSIC_MODEL_PATH = os.path.join(MODELS_DIR, "music_model_optimized.joblib")
+DIFFUSION_MODEL_PATH = os.path.join(MODELS_DIR, "diffusion_epoch1650.pth")
+
+# Seconds between checks for a new/updated checkpoint on disk
+WATCH_INTERVAL = float(os.environ.get("MODEL_WATCH_INTERVAL", "30"))
+
+_CHECKPOINT_PATTERN = re.compile(r"^diffusion_epoch(\d+)\.pth$")
+
+
+def latest_diffusion_checkpoint(models_dir=MODELS_DIR):
+    """Return the diffusion checkpoint with the highest epoch number."""
+    best_path, best_epoch = DIFFUSION_MODEL_PATH, -1
+    if os.path.isdir(models_dir):
+        for name in os.listdir(models_dir):
+            match = _CHECKPOINT_PATTERN.match(name)
+            if match and int(match.group(1)) > best_epoch:
+                best_epoch = int(match.group(1))
+                best_path = os.path.join(models_dir, name)
+    return best_path
+
+
+def _file_signature(path):
+    if not os.path.exists(path):
+        return None
+    stat = os.stat(path)
+    return (path, stat.st_mtime_ns, stat.st_size)
+
+
+def _public_info(info):
+    return {k: v for k, v in info.items() if k != "signature"}
+
+
+class LoadedModels:
+    """Immutable set of warm models; a request holds one for its whole lifetime."""
+
+    def __init__(self, unet, unet_info, music_model, music_info, device):
+        self.unet = unet
+        self.unet_info = unet_info
+        self.music_model = music_model
+        self.music_info = music_info
+        self.device = device
+
+
+class ModelRegistry:
+    """Loads the music regressor and diffusion UNet once and hot-swaps them on change."""
+
+    def __init__(self, models_dir=MODELS_DIR, music_model_path=MUSIC_MODEL_PATH):
+        self.models_dir = models_dir
+        self.music_model_path = music_model_path
+        self.device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+        self._models = None
+        self._swap_count = 0
+        self._load_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._watcher = None
+
+    def _load_unet(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Diffusion model not found at: {path}")
+        start = time.perf_counter()
+        unet = EmotionConditionedUNet().to(self.device)
+        unet.load_state_dict(torch.load(path, map_location=self.device))
+        unet.eval()
+        tensors = list(unet.parameters()) + list(unet.buffers())
+        info = {
+            "path": path,
+            "signature": _file_signature(path),
+            "load_seconds": round(time.perf_counter() - start, 3),
+            "file_bytes": os.path.getsize(path),
+            "memory_bytes": sum(t.numel() * t.element_size() for t in tensors),
+            "loaded_at": time.time(),
+        }
+        return unet, info
+
+    def _load_music_model(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"Music model not found at: {path}")
+        start = time.perf_counter()
+        music_model = joblib.load(path)
+        signature = _file_signature(path)
+        info = {
+            "path": path,
+            "signature": signature,
+            # Identifies this exact file, e.g. for caching its predictions
+            "version": f"{signature[1]:x}-{signature[2]:x}",
+            "load_seconds": round(time.perf_counter() - start, 3),
+            "file_bytes": os.path.getsize(path),
+            "loaded_at": time.time(),
+        }
+        return music_model, info
+
+    def load(self):
+        """Load (or reload) whatever changed on disk and swap it in atomically."""
+        with self._load_lock:
+            current = self._models
+            unet_path = latest_diffusion_checkpoint(self.models_dir)
+
+            if current and current.unet_info["signature"] == _file_signature(unet_path):
+                unet, unet_info = current.unet, current.unet_info
+            else:
+                unet, unet_info = self._load_unet(unet_path)
+
+            music_path = self.music_model_path
+            if current and current.music_info["signature"] == _file_signature(music_path):
+                music_model, music_info = current.music_model, current.music_info
+            else:
+                music_model, music_info = self._load_music_model(music_path)
+
+            if current and unet is current.unet and music_model is current.music_model:
+                return current
+            # Build the new set completely before publishing it so readers
+            # never see a half-loaded model.
+            self._models = LoadedModels(unet, unet_info, music_model, music_info, self.device)
+            if current is not None:
+                self._swap_count += 1
+                print(f"Hot-swapped models: {unet_info['path']}, {music_info['path']}")
+            return self._models
+
+    def get(self):
+        """Return the current warm models, loading them on first use."""
+        models = self._models
+        if models is None:
+            models = self.load()
+        return models
+
+    def stats(self):
+        models = self._models
+        if models is None:
+            return {"loaded": False}
+        return {
+            "loaded": True,
+            "device": str(models.device),
+            "swap_count": self._swap_count,
+            "diffusion": _public_info(models.unet_info),
+            "music": _public_info(models.music_info),
+        }
+
+    # --- Hot-swap watcher ---
+
+    def _watch(self, interval):
+        while not self._stop_event.wait(interval):
+            try:
+                self.load()
+            except Exception as e:
+                # Keep serving the previous models if the new file is bad or half-written
+                print(f"Model reload failed, keeping current models: {e}")
+
+    def start_watcher(self, interval=WATCH_INTERVAL):
+        if self._watcher is not None or interval <= 0:
+            return
+        self._stop_event.clear()
+        self._watcher = threading.Thread(
+            target=self._watch, args=(interval,), name="model-watcher", daemon=True
+        )
+        self._watcher.start()
+
+    def stop_watcher(self):
+        if self._watcher is None:
+            return
+        self._stop_event.set()
+        self._watcher.join(timeout=5)
+        self._watcher = None
+
+
+registry = ModelRegistry()
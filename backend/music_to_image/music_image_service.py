@@ -1,71 +1,29 @@
+import asyncio
 import os
-import joblib
 import torch
 import numpy as np
 import pandas as pd
-import librosa
 import base64
 import io
 from PIL import Image
-from fastapi import UploadFile
-from .model_architecture import EmotionConditionedUNet
-
-BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-MUSIC_MODEL_PATH = os.path.join(BASE_DIR, "models", "music_model_optimized.joblib")
-DIFFUSION_MODEL_PATH = os.path.join(BASE_DIR, "models", "diffusion_epoch1650.pth")
-
-# --- Audio Feature Extraction ---
-
-def extract_audio_features(music_file_path):
-    """Extract audio features from music file."""
-    y, sr = librosa.load(music_file_path, sr=None)
-
-    # Extract features
-    mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-    chroma_stft = librosa.feature.chroma_stft(y=y, sr=sr)
-    spectral_contrast = librosa.feature.spectral_contrast(y=y, sr=sr)
-    zero_crossing_rate = librosa.feature.zero_crossing_rate(y=y)
-    tempo, _ = librosa.beat.beat_track(y=y, sr=sr)
-    rms = librosa.feature.rms(y=y)
-    spectral_centroid = librosa.feature.spectral_centroid(y=y, sr=sr)
-    spectral_bandwidth = librosa.feature.spectral_bandwidth(y=y, sr=sr)
-    spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
-    tonnetz = librosa.feature.tonnetz(y=y, sr=sr)
-    chroma_cqt = librosa.feature.chroma_cqt(y=y, sr=sr)
-    chroma_cens = librosa.feature.chroma_cens(y=y, sr=sr)
-
-    def aggregate(feature_matrix):
-        return np.concatenate(
-            [np.mean(feature_matrix, axis=1), np.std(feature_matrix, axis=1)]
-        )
-
-    features = np.concatenate(
-        [
-            aggregate(mfccs),
-            aggregate(chroma_stft),
-            aggregate(spectral_contrast),
-            aggregate(zero_crossing_rate),
-            aggregate(np.array([tempo]).reshape(-1, 1)),
-            aggregate(rms),
-            aggregate(spectral_centroid),
-            aggregate(spectral_bandwidth),
-            aggregate(spectral_rolloff),
-            aggregate(tonnetz),
-            aggregate(chroma_cqt),
-            aggregate(chroma_cens),
-        ]
-    )
-
-    return features
-
-def predict_music_emotion(audio_path):
-    """Predict valence and arousal from audio file."""
-    if not os.path.exists(MUSIC_MODEL_PATH):
-        raise FileNotFoundError(f"Music model not found at: {MUSIC_MODEL_PATH}")
-    
-    trained_model = joblib.load(MUSIC_MODEL_PATH)
-    features = extract_audio_features(audio_path)
-
+from fastapi import Response, UploadFile
+from fastapi.responses import JSONResponse
+from .model_registry import registry
+from .audio_features import DECODE_MODE, FEATURE_VERSION, extract_audio_features
+from .feature_cache import FeatureCache, content_key
+from .samplers import get_sampler
+from .batch_scheduler import BatchScheduler
+from .worker_pool import (
+    StageSaturated,
+    StageTimer,
+    feature_stage,
+    generation_stage,
+    run_in_feature_pool,
+)
+
+# --- Emotion Prediction ---
+
+def _feature_columns():
     columns = []
     for i in range(13):
         columns.append(f"mfcc_dct{i}_mean")
@@ -99,116 +57,148 @@ def predict_music_emotion(audio_path):
         columns.append(f"chroma_cens_chord{i}_mean")
         columns.append(f"chroma_cens_chord{i}_std")
 
+    return columns
+
+FEATURE_COLUMNS = _feature_columns()
+
+def predict_emotion_from_features(features, trained_model=None):
+    """Predict valence and arousal from an extract_audio_features vector."""
+    if trained_model is None:
+        trained_model = registry.get().music_model
     features_reshaped = features.reshape(1, -1)
-    features_df = pd.DataFrame(features_reshaped, columns=columns)
+    features_df = pd.DataFrame(features_reshaped, columns=FEATURE_COLUMNS)
     predicted_va = trained_model.predict(features_df)
     valence = float(predicted_va[0][0])
     arousal = float(predicted_va[0][1])
     
     return valence, arousal
 
+def predict_music_emotion(audio_path):
+    """Predict valence and arousal from audio file."""
+    return predict_emotion_from_features(extract_audio_features(audio_path))
+
 # --- Diffusion Generation ---
 
-def cosine_beta_schedule(timesteps, s=0.008):
-    steps = timesteps + 1
-    x = torch.linspace(0, timesteps, steps)
-    alphas_cumprod = torch.cos(((x / timesteps) + s) / (1 + s) * torch.pi * 0.5) ** 2
-    alphas_cumprod = alphas_cumprod / alphas_cumprod[0]
-    betas = 1 - (alphas_cumprod[1:] / alphas_cumprod[:-1])
-    return torch.clip(betas, 0.001, 0.02)
-
-def get_noise_schedule(timesteps=1000):
-    betas = cosine_beta_schedule(timesteps)
-    alphas = 1. - betas
-    alphas_cumprod = torch.cumprod(alphas, dim=0)
-    sqrt_alphas_cumprod = torch.sqrt(alphas_cumprod)
-    sqrt_one_minus_alphas_cumprod = torch.sqrt(1. - alphas_cumprod)
-    
-    return {
-        'betas': betas,
-        'sqrt_alphas_cumprod': sqrt_alphas_cumprod,
-        'sqrt_one_minus_alphas_cumprod': sqrt_one_minus_alphas_cumprod,
-    }
-
-@torch.no_grad()
-def p_sample(model, x, t, t_index, v, a, schedule, device, guidance_scale=3.0):
-    betas_t = schedule['betas'][t][:, None, None, None]
-    sqrt_one_minus_alphas_cumprod_t = schedule['sqrt_one_minus_alphas_cumprod'][t][:, None, None, None]
-    sqrt_recip_alphas_t = torch.sqrt(1.0 / (1. - betas_t))
-    
-    if guidance_scale != 1.0:
-        noise_cond = model(x, t, v, a)
-        noise_uncond = model(x, t, torch.zeros_like(v), torch.zeros_like(a))
-        predicted_noise = noise_uncond + guidance_scale * (noise_cond - noise_uncond)
-    else:
-        predicted_noise = model(x, t, v, a)
-    
-    model_mean = sqrt_recip_alphas_t * (x - betas_t * predicted_noise / sqrt_one_minus_alphas_cumprod_t)
-    
-    if t_index == 0:
-        return model_mean
-    else:
-        noise = torch.randn_like(x)
-        return model_mean + torch.sqrt(betas_t) * noise
-
-def generate_image(v, a, guidance_scale=5.0, timesteps=50, seed=None):
-    if not os.path.exists(DIFFUSION_MODEL_PATH):
-        raise FileNotFoundError(f"Diffusion model not found at: {DIFFUSION_MODEL_PATH}")
-
-    v_norm = v / 9.0
-    a_norm = a / 9.0
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-    print(f"Generating image on device: {device}")
-    
-    if seed is not None:
-        torch.manual_seed(seed)
-        if torch.cuda.is_available():
-            torch.cuda.manual_seed(seed)
-    
-    model = EmotionConditionedUNet().to(device)
-    model.load_state_dict(torch.load(DIFFUSION_MODEL_PATH, map_location=device))
-    model.eval()
-    
-    schedule = get_noise_schedule(timesteps)
-    for key in schedule:
-        schedule[key] = schedule[key].to(device)
-    
-    x = torch.randn(1, 3, 128, 128, device=device)
-    v_tensor = torch.tensor([v_norm], dtype=torch.float32, device=device)
-    a_tensor = torch.tensor([a_norm], dtype=torch.float32, device=device)
-    
-    # Use a smaller number of timesteps for faster generation in API if possible, 
-    # but keeping 1000 for quality as per original code.
-    # To speed up, one might reduce timesteps, but that requires a different schedule or model support.
-    
-    for i in reversed(range(timesteps)):
-        t = torch.full((1,), i, device=device, dtype=torch.long)
-        x = p_sample(model, x, t, i, v_tensor, a_tensor, schedule, device, guidance_scale)
-    
-    img = x.squeeze().permute(1, 2, 0).cpu().numpy()
-    img = (img * 0.5 + 0.5).clip(0, 1)
-    
-    # Convert to PIL Image
-    img_uint8 = (img * 255).astype(np.uint8)
-    pil_img = Image.fromarray(img_uint8)
-    
-    return pil_img
+def generate_images(emotions, seeds=None, guidance_scale=5.0, timesteps=None, guidance_mode="batched", sampler="ddpm"):
+    """Generate one image per (valence, arousal) pair in a single batched denoising loop.
+
+    `sampler` is one of SAMPLERS ("ddpm", "ddim", "dpm_solver"); `timesteps`
+    is the number of sampling steps (sampler default when None). DDIM and
+    DPM-Solver skip through the trained 1000-step schedule, so 10-20 steps
+    are usually enough. Each image draws its noise from its own seed.
+    """
+    models = registry.get()
+    model = models.unet
+    device = models.device
+    sampler = get_sampler(sampler, timesteps)
+    if seeds is None:
+        seeds = [None] * len(emotions)
+
+    print(f"Generating {len(emotions)} image(s) on device: {device} ({sampler.name}, {sampler.steps} steps)")
+
+    generators = []
+    for seed in seeds:
+        generator = torch.Generator(device=device)
+        if seed is None:
+            generator.seed()
+        else:
+            generator.manual_seed(seed)
+        generators.append(generator)
+
+    x = torch.stack([
+        torch.randn(3, 128, 128, generator=g, device=device) for g in generators
+    ])
+    v_tensor = torch.tensor([v / 9.0 for v, _ in emotions], dtype=torch.float32, device=device)
+    a_tensor = torch.tensor([a / 9.0 for _, a in emotions], dtype=torch.float32, device=device)
+
+    x = sampler.sample(model, x, v_tensor, a_tensor, guidance_scale, guidance_mode, generators)
+
+    images = []
+    for sample in x:
+        img = sample.permute(1, 2, 0).cpu().numpy()
+        img = (img * 0.5 + 0.5).clip(0, 1)
+
+        # Convert to PIL Image
+        img_uint8 = (img * 255).astype(np.uint8)
+        images.append(Image.fromarray(img_uint8))
+
+    return images
+
+def generate_image(v, a, guidance_scale=5.0, timesteps=None, seed=None, guidance_mode="batched", sampler="ddpm"):
+    return generate_images([(v, a)], [seed], guidance_scale, timesteps, guidance_mode, sampler)[0]
+
+# Jobs arriving within MAX_WAIT of each other share one denoising loop
+scheduler = BatchScheduler(
+    generate_images,
+    max_batch_size=int(os.environ.get("DIFFUSION_MAX_BATCH", "4")),
+    max_wait=float(os.environ.get("DIFFUSION_MAX_WAIT_MS", "50")) / 1000,
+)
 
 # --- Main Service Function ---
 
-async def generate_image_from_music(file: UploadFile):
-    # Save uploaded file temporarily
-    temp_filename = f"temp_{file.filename}"
-    with open(temp_filename, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
+MAX_UPLOAD_BYTES = int(float(os.environ.get("MUSIC_MAX_UPLOAD_MB", "20")) * 1024 * 1024)
+
+feature_cache = FeatureCache(
+    max_entries=int(os.environ.get("MUSIC_FEATURE_CACHE_SIZE", "256")),
+    cache_dir=os.environ.get("MUSIC_FEATURE_CACHE_DIR") or None,
+)
+
+class UploadTooLarge(Exception):
+    pass
+
+async def read_upload(file: UploadFile, max_bytes=MAX_UPLOAD_BYTES, chunk_size=1024 * 1024):
+    """Read the upload into memory chunk by chunk, stopping as soon as it exceeds `max_bytes`."""
+    buffer = io.BytesIO()
+    while True:
+        chunk = await file.read(chunk_size)
+        if not chunk:
+            break
+        if buffer.tell() + len(chunk) > max_bytes:
+            raise UploadTooLarge(f"File is too large (limit {max_bytes // (1024 * 1024)} MB).")
+        buffer.write(chunk)
+    return buffer.getvalue()
+
+async def generate_image_from_music(file: UploadFile, response: Response, sampler="ddpm", steps=None):
+    timer = StageTimer()
     
     try:
-        # 1. Predict Emotion
-        valence, arousal = predict_music_emotion(temp_filename)
+        content = await read_upload(file)
+        # Hashing up to 20 MB and the cache's disk I/O stay off the event loop
+        cache_key = await asyncio.to_thread(content_key, content, FEATURE_VERSION)
+
+        # 1. Predict Emotion, reusing cached features/predictions for repeat uploads
+        models = await asyncio.to_thread(registry.get)
+        model_version = models.music_info["version"]
+        cached = await asyncio.to_thread(feature_cache.lookup, cache_key)
+        response.headers["X-Feature-Cache"] = "hit" if cached else "miss"
+
+        if cached and model_version in cached["predictions"]:
+            valence, arousal = cached["predictions"][model_version]
+        else:
+            if cached:
+                features = cached["features"]
+            else:
+                # librosa decodes the bytes in a worker process, no temp file for most formats
+                with feature_stage:
+                    features = await timer.run(
+                        "features",
+                        run_in_feature_pool(
+                            extract_audio_features, content, DECODE_MODE, file.filename
+                        ),
+                    )
+            valence, arousal = await timer.run(
+                "emotion",
+                asyncio.to_thread(predict_emotion_from_features, features, models.music_model),
+            )
+            await asyncio.to_thread(
+                feature_cache.put, cache_key, features, model_version, (valence, arousal)
+            )
         
-        # 2. Generate Image
-        pil_img = generate_image(valence, arousal)
+        # 2. Generate Image (batched on the dedicated diffusion thread)
+        with generation_stage:
+            pil_img = await timer.run(
+                "diffusion", scheduler.generate(valence, arousal, timesteps=steps, sampler=sampler)
+            )
         
         # 3. Convert to Base64
         buffered = io.BytesIO()
@@ -221,9 +211,18 @@ async def generate_image_from_music(file: UploadFile):
             "image": f"data:image/png;base64,{img_str}"
         }
         
+    except UploadTooLarge as e:
+        return JSONResponse(
+            status_code=413, content={"error": str(e)}, headers={"Server-Timing": timer.header()}
+        )
+    except StageSaturated as e:
+        return JSONResponse(
+            status_code=429,
+            content={"error": str(e)},
+            headers={"Retry-After": str(e.retry_after), "Server-Timing": timer.header()},
+        )
     except Exception as e:
         return {"error": str(e)}
     finally:
-        # Cleanup
-        if os.path.exists(temp_filename):
-            os.remove(temp_filename)
+        # Only reaches the client when a plain dict is returned; JSONResponses carry their own
+        response.headers["Server-Timing"] = timer.header()
@@ -0,0 +1,213 @@
+import torch
+from functools import lru_cache
+
+# Number of diffusion steps the UNet was trained with
+TRAINED_TIMESTEPS = 1000
+
+# --- Noise Schedule ---
+
+def cosine_beta_schedule(timesteps, s=0.008):
+    steps = timesteps + 1
+    x = torch.linspace(0, timesteps, steps)
+    alphas_cumprod = torch.cos(((x / timesteps) + s) / (1 + s) * torch.pi * 0.5) ** 2
+    alphas_cumprod = alphas_cumprod / alphas_cumprod[0]
+    betas = 1 - (alphas_cumprod[1:] / alphas_cumprod[:-1])
+    return torch.clip(betas, 0.001, 0.02)
+
+def get_noise_schedule(timesteps=1000):
+    betas = cosine_beta_schedule(timesteps)
+    alphas = 1. - betas
+    alphas_cumprod = torch.cumprod(alphas, dim=0)
+    sqrt_alphas_cumprod = torch.sqrt(alphas_cumprod)
+    sqrt_one_minus_alphas_cumprod = torch.sqrt(1. - alphas_cumprod)
+    
+    return {
+        'betas': betas,
+        'alphas_cumprod': alphas_cumprod,
+        'sqrt_alphas_cumprod': sqrt_alphas_cumprod,
+        'sqrt_one_minus_alphas_cumprod': sqrt_one_minus_alphas_cumprod,
+    }
+
+@lru_cache(maxsize=8)
+def get_device_schedule(timesteps, device):
+    """Noise schedule moved to `device`, computed once per (timesteps, device)."""
+    schedule = get_noise_schedule(timesteps)
+    return {key: value.to(device) for key, value in schedule.items()}
+
+# --- Guidance ---
+
+GUIDANCE_MODES = ("batched", "two_pass")
+
+def predict_guided_noise(model, x, t, v, a, guidance_scale, guidance_mode="batched"):
+    """Classifier-free guided noise prediction.
+
+    "batched" stacks the conditional and unconditional inputs into one
+    forward pass of twice the batch size; "two_pass" runs them separately.
+    """
+    if guidance_scale == 1.0:
+        return model(x, t, v, a)
+
+    if guidance_mode == "batched":
+        batch = x.shape[0]
+        noise = model(
+            torch.cat([x, x]),
+            torch.cat([t, t]),
+            torch.cat([v, torch.zeros_like(v)]),
+            torch.cat([a, torch.zeros_like(a)]),
+        )
+        noise_cond, noise_uncond = noise[:batch], noise[batch:]
+    elif guidance_mode == "two_pass":
+        noise_cond = model(x, t, v, a)
+        noise_uncond = model(x, t, torch.zeros_like(v), torch.zeros_like(a))
+    else:
+        raise ValueError(f"Unknown guidance mode: {guidance_mode}")
+    return noise_uncond + guidance_scale * (noise_cond - noise_uncond)
+
+# --- Samplers ---
+
+def randn_like(x, generators=None):
+    """Gaussian noise shaped like `x`, drawn per sample from `generators` when given.
+
+    Per-sample generators keep each image reproducible from its own seed no
+    matter which other requests it was batched with.
+    """
+    if generators is None:
+        return torch.randn_like(x)
+    return torch.stack([
+        torch.randn(x.shape[1:], generator=g, device=x.device, dtype=x.dtype)
+        for g in generators
+    ])
+
+@torch.no_grad()
+def p_sample(model, x, t, t_index, v, a, schedule, device, guidance_scale=3.0, guidance_mode="batched", generators=None):
+    betas_t = schedule['betas'][t][:, None, None, None]
+    sqrt_one_minus_alphas_cumprod_t = schedule['sqrt_one_minus_alphas_cumprod'][t][:, None, None, None]
+    sqrt_recip_alphas_t = torch.sqrt(1.0 / (1. - betas_t))
+    
+    predicted_noise = predict_guided_noise(model, x, t, v, a, guidance_scale, guidance_mode)
+    
+    model_mean = sqrt_recip_alphas_t * (x - betas_t * predicted_noise / sqrt_one_minus_alphas_cumprod_t)
+    
+    if t_index == 0:
+        return model_mean
+    else:
+        noise = randn_like(x, generators)
+        return model_mean + torch.sqrt(betas_t) * noise
+
+
+class Sampler:
+    """Base class: turns pure noise `x` into an image in `self.steps` UNet evaluations."""
+
+    name = None
+    # Most steps one request may ask for; each step is a full UNet evaluation
+    max_steps = TRAINED_TIMESTEPS
+
+    def __init__(self, steps):
+        # Above TRAINED_TIMESTEPS the skipped timesteps repeat (h = 0 for DPM-Solver)
+        limit = min(self.max_steps, TRAINED_TIMESTEPS)
+        if not 1 <= steps <= limit:
+            raise ValueError(f"steps for {self.name} must be between 1 and {limit}")
+        self.steps = steps
+
+    def sample(self, model, x, v, a, guidance_scale, guidance_mode="batched", generators=None):
+        raise NotImplementedError
+
+    def skip_timesteps(self, device):
+        """`steps` evenly spaced timesteps of the trained schedule, from noisiest to cleanest."""
+        t = torch.linspace(TRAINED_TIMESTEPS - 1, 0, self.steps, device=device)
+        return t.round().long()
+
+
+class DDPMSampler(Sampler):
+    """Ancestral sampling over a cosine schedule rebuilt for `steps` steps (original behaviour)."""
+
+    name = "ddpm"
+    max_steps = 250
+
+    @torch.no_grad()
+    def sample(self, model, x, v, a, guidance_scale, guidance_mode="batched", generators=None):
+        schedule = get_device_schedule(self.steps, x.device)
+        for i in reversed(range(self.steps)):
+            t = torch.full((x.shape[0],), i, device=x.device, dtype=torch.long)
+            x = p_sample(model, x, t, i, v, a, schedule, x.device, guidance_scale, guidance_mode, generators)
+        return x
+
+
+class DDIMSampler(Sampler):
+    """DDIM over a strided subset of the trained 1000-step schedule; deterministic when eta=0."""
+
+    name = "ddim"
+    max_steps = 100
+
+    def __init__(self, steps, eta=0.0):
+        super().__init__(steps)
+        self.eta = eta
+
+    @torch.no_grad()
+    def sample(self, model, x, v, a, guidance_scale, guidance_mode="batched", generators=None):
+        alphas_cumprod = get_device_schedule(TRAINED_TIMESTEPS, x.device)['alphas_cumprod']
+        timesteps = self.skip_timesteps(x.device)
+        one = torch.ones((), device=x.device)
+
+        for i, step in enumerate(timesteps):
+            t = step.repeat(x.shape[0])
+            alpha_t = alphas_cumprod[step]
+            alpha_prev = alphas_cumprod[timesteps[i + 1]] if i + 1 < len(timesteps) else one
+
+            eps = predict_guided_noise(model, x, t, v, a, guidance_scale, guidance_mode)
+            x0 = ((x - torch.sqrt(1 - alpha_t) * eps) / torch.sqrt(alpha_t)).clamp(-1, 1)
+
+            sigma = self.eta * torch.sqrt((1 - alpha_prev) / (1 - alpha_t) * (1 - alpha_t / alpha_prev))
+            direction = torch.sqrt(torch.clamp(1 - alpha_prev - sigma ** 2, min=0)) * eps
+            x = torch.sqrt(alpha_prev) * x0 + direction
+            if self.eta > 0 and i + 1 < len(timesteps):
+                x = x + sigma * randn_like(x, generators)
+        return x
+
+
+class DPMSolverSampler(Sampler):
+    """Second-order multistep DPM-Solver++ (data prediction) over the trained schedule."""
+
+    name = "dpm_solver"
+    max_steps = 50
+
+    @torch.no_grad()
+    def sample(self, model, x, v, a, guidance_scale, guidance_mode="batched", generators=None):
+        alphas_cumprod = get_device_schedule(TRAINED_TIMESTEPS, x.device)['alphas_cumprod']
+        timesteps = self.skip_timesteps(x.device)
+        alpha = torch.sqrt(alphas_cumprod)
+        sigma = torch.sqrt(1 - alphas_cumprod)
+        lambdas = torch.log(alpha) - torch.log(sigma)
+
+        prev_x0, prev_h = None, None
+        for i, step in enumerate(timesteps):
+            t = step.repeat(x.shape[0])
+            eps = predict_guided_noise(model, x, t, v, a, guidance_scale, guidance_mode)
+            x0 = ((x - sigma[step] * eps) / alpha[step]).clamp(-1, 1)
+
+            if i + 1 == len(timesteps):
+                # Final step lands on clean data (sigma = 0); take the first-order update
+                return x0
+
+            nxt = timesteps[i + 1]
+            h = lambdas[nxt] - lambdas[step]
+            if prev_x0 is None:
+                denoised = x0
+            else:
+                r = prev_h / h
+                denoised = (1 + 1 / (2 * r)) * x0 - (1 / (2 * r)) * prev_x0
+            x = (sigma[nxt] / sigma[step]) * x - alpha[nxt] * torch.expm1(-h) * denoised
+            prev_x0, prev_h = x0, h
+        return x
+
+
+SAMPLERS = {cls.name: cls for cls in (DDPMSampler, DDIMSampler, DPMSolverSampler)}
+
+
+def get_sampler(name="ddpm", steps=None):
+    """Build a sampler by name; `steps` defaults to 50 for DDPM and 15 otherwise."""
+    if name not in SAMPLERS:
+        raise ValueError(f"Unknown sampler '{name}', choose from: {', '.join(SAMPLERS)}")
+    if steps is None:
+        steps = 50 if name == "ddpm" else 15
+    return SAMPLERS[name](steps)
@@ -0,0 +1,114 @@
+import asyncio
+import multiprocessing
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+# librosa feature extraction workers (separate processes, so they don't hold the GIL)
+FEATURE_WORKERS = int(os.environ.get("MUSIC_FEATURE_WORKERS", "2"))
+# Requests allowed to wait for or run each stage before we answer 429
+MAX_PENDING_FEATURES = int(os.environ.get("MUSIC_MAX_PENDING_FEATURES", "8"))
+MAX_PENDING_GENERATIONS = int(os.environ.get("MUSIC_MAX_PENDING_GENERATIONS", "8"))
+
+
+class StageSaturated(Exception):
+    """Raised when a stage already has its maximum number of requests in flight."""
+
+    def __init__(self, stage, retry_after=5):
+        super().__init__(f"Server is busy ({stage}), please try again shortly.")
+        self.stage = stage
+        self.retry_after = retry_after
+
+
+class BoundedStage:
+    """Counts requests inside a pipeline stage and rejects new ones past `max_pending`."""
+
+    def __init__(self, name, max_pending):
+        self.name = name
+        self.max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    @property
+    def pending(self):
+        return self._pending
+
+    def __enter__(self):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise StageSaturated(self.name)
+            self._pending += 1
+        return self
+
+    def __exit__(self, *exc):
+        with self._lock:
+            self._pending -= 1
+        return False
+
+
+class StageTimer:
+    """Collects per-stage durations and renders them as a Server-Timing header."""
+
+    def __init__(self):
+        self.durations = {}
+
+    async def run(self, stage, awaitable):
+        start = time.perf_counter()
+        try:
+            return await awaitable
+        finally:
+            self.durations[stage] = (time.perf_counter() - start) * 1000
+
+    def header(self):
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.durations.items())
+
+
+_feature_pool = None
+_feature_pool_lock = threading.Lock()
+
+
+def get_feature_pool():
+    """Process pool for librosa work, created on first use."""
+    global _feature_pool
+    with _feature_pool_lock:
+        if _feature_pool is None:
+            # spawn: forking a process that already runs torch threads can deadlock
+            _feature_pool = ProcessPoolExecutor(
+                max_workers=FEATURE_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _feature_pool
+
+
+def discard_feature_pool(pool):
+    """Drop `pool` after a worker died, unless another request already replaced it."""
+    global _feature_pool
+    with _feature_pool_lock:
+        if _feature_pool is pool:
+            _feature_pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def shutdown_feature_pool():
+    global _feature_pool
+    with _feature_pool_lock:
+        if _feature_pool is not None:
+            _feature_pool.shutdown(wait=False, cancel_futures=True)
+            _feature_pool = None
+
+
+async def run_in_feature_pool(fn, *args):
+    """Run `fn` in the feature pool; a broken pool (e.g. an OOM-killed worker) is rebuilt once."""
+    loop = asyncio.get_running_loop()
+    pool = get_feature_pool()
+    try:
+        return await loop.run_in_executor(pool, fn, *args)
+    except BrokenProcessPool:
+        discard_feature_pool(pool)
+    return await loop.run_in_executor(get_feature_pool(), fn, *args)
+
+
+feature_stage = BoundedStage("feature extraction", MAX_PENDING_FEATURES)
+generation_stage = BoundedStage("image generation", MAX_PENDING_GENERATIONS)
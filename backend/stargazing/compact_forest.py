@@ -0,0 +1,179 @@
+"""Flat, memory-mappable export of the stargazing RandomForest.
+
+Unpickling a 2000-tree forest builds millions of Python-side node objects
+and keeps them all resident. The export writes every tree's nodes into a few
+flat .npy arrays (one row per node, trees back to back) that are opened with
+mmap_mode="r", so loading is near-instant and pages are only read as they
+are touched.
+
+The StandardScaler is folded into the thresholds: the forest splits on
+(x - mean) / scale <= t, which for scale > 0 is x <= t * scale + mean, so
+prediction takes the raw feature matrix.
+
+Export a trained model with:
+    python -m stargazing.compact_forest model/stargazing_model.pkl model/stargazing_scaler.pkl model/stargazing_forest
+"""
+import argparse
+import json
+import os
+import shutil
+import numpy as np
+
+FORMAT_VERSION = 1
+ARRAYS = ("feature", "threshold", "left", "right", "value", "roots")
+# Rows walked through the forest together; keeps the per-level gathers cache-sized
+PREDICT_CHUNK_ROWS = 64
+
+
+def flatten_forest(model, scaler=None):
+    """Node arrays for all trees of a fitted RandomForestRegressor (leaves point to themselves)."""
+    n_features = model.n_features_in_
+    mean = np.zeros(n_features)
+    scale = np.ones(n_features)
+    if scaler is not None:
+        if getattr(scaler, "mean_", None) is not None:
+            mean = scaler.mean_
+        if getattr(scaler, "scale_", None) is not None:
+            scale = scaler.scale_
+
+    parts = {name: [] for name in ARRAYS}
+    offset = 0
+    max_depth = 0
+    for estimator in model.estimators_:
+        tree = estimator.tree_
+        n = tree.node_count
+        index = np.arange(offset, offset + n, dtype=np.int32)
+        is_leaf = tree.children_left < 0
+        feature = np.where(is_leaf, 0, tree.feature).astype(np.int32)
+        parts["feature"].append(feature)
+        parts["threshold"].append(
+            np.where(is_leaf, 0.0, tree.threshold * scale[feature] + mean[feature])
+        )
+        parts["left"].append(np.where(is_leaf, index, tree.children_left + offset).astype(np.int32))
+        parts["right"].append(np.where(is_leaf, index, tree.children_right + offset).astype(np.int32))
+        parts["value"].append(tree.value[:, 0, 0].astype(np.float64))
+        parts["roots"].append(np.array([offset], dtype=np.int32))
+        max_depth = max(max_depth, tree.max_depth)
+        offset += n
+
+    arrays = {name: np.concatenate(chunks) for name, chunks in parts.items()}
+    if n_features <= np.iinfo(np.int16).max:
+        arrays["feature"] = arrays["feature"].astype(np.int16)
+    meta = {
+        "format_version": FORMAT_VERSION,
+        "n_features": int(n_features),
+        "n_trees": len(model.estimators_),
+        "n_nodes": int(offset),
+        "max_depth": int(max_depth),
+    }
+    return arrays, meta
+
+
+def export_forest(model, scaler, out_dir):
+    """Write the flattened forest to `out_dir` (one .npy per array plus meta.json).
+
+    The export is built in a sibling temp directory and renamed into place, so
+    readers see either the previous export or the new one, never a mix.
+    """
+    arrays, meta = flatten_forest(model, scaler)
+    out_dir = os.path.normpath(out_dir)
+    parent, name = os.path.split(out_dir)
+    temp_dir = os.path.join(parent, f".{name}.tmp")
+    old_dir = os.path.join(parent, f".{name}.old")
+    for leftover in (temp_dir, old_dir):
+        shutil.rmtree(leftover, ignore_errors=True)
+    os.makedirs(temp_dir)
+    for array_name, array in arrays.items():
+        np.save(os.path.join(temp_dir, f"{array_name}.npy"), array)
+    with open(os.path.join(temp_dir, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f, indent=2)
+    # A directory cannot be renamed over a non-empty one: move the old export aside first.
+    # Processes that memory-mapped it keep their open files.
+    if os.path.exists(out_dir):
+        os.rename(out_dir, old_dir)
+    os.rename(temp_dir, out_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+    return meta
+
+
+def is_exported(path):
+    return os.path.exists(os.path.join(path, "meta.json"))
+
+
+class CompactForest:
+    """Vectorised RandomForest inference over memory-mapped node arrays.
+
+    Built for the service's batches (7 rows per site): there it is an order of
+    magnitude faster than sklearn, whose predict has ~150 ms of fixed overhead.
+    Per row it is slower, since each tree level is a numpy gather rather than
+    sklearn's compiled walk; on a 1000-tree, depth-20 forest the two cross at
+    roughly 250 rows (bench_compact_forest prints the table). Score large
+    offline batches with the pickled model instead.
+    """
+
+    def __init__(self, arrays, meta):
+        self.meta = meta
+        self.feature = arrays["feature"]
+        self.threshold = arrays["threshold"]
+        self.left = arrays["left"]
+        self.right = arrays["right"]
+        self.value = arrays["value"]
+        self.roots = arrays["roots"]
+        self.n_features_in_ = meta["n_features"]
+
+    @classmethod
+    def load(cls, path, mmap_mode="r"):
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        if meta.get("format_version") != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact forest format in {path}")
+        arrays = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode=mmap_mode)
+            for name in ARRAYS
+        }
+        return cls(arrays, meta)
+
+    def predict(self, X):
+        """Mean leaf value over all trees for each row of the raw (unscaled) matrix."""
+        X = np.asarray(X, dtype=np.float64)
+        if X.ndim != 2 or X.shape[1] != self.n_features_in_:
+            raise ValueError(f"Expected {self.n_features_in_} features, got shape {X.shape}")
+        prediction = np.empty(X.shape[0])
+        for start in range(0, X.shape[0], PREDICT_CHUNK_ROWS):
+            prediction[start:start + PREDICT_CHUNK_ROWS] = self._predict_chunk(X[start:start + PREDICT_CHUNK_ROWS])
+        return prediction
+
+    def _predict_chunk(self, X):
+        n_rows, n_trees = X.shape[0], len(self.roots)
+        # One (row, tree) walker per pair, flattened row-major; only walkers that
+        # have not reached a leaf are gathered and advanced on each level
+        node = np.tile(np.asarray(self.roots, dtype=np.int64), n_rows)
+        row = np.repeat(np.arange(n_rows), n_trees)
+        active = np.arange(node.size)
+        X_flat = X.ravel()
+        n_features = X.shape[1]
+        while active.size:
+            current = node[active]
+            left = self.left[current]
+            inner = left != current  # leaves point to themselves
+            active, current, left = active[inner], current[inner], left[inner]
+            if not active.size:
+                break
+            go_left = X_flat[row[active] * n_features + self.feature[current]] <= self.threshold[current]
+            node[active] = np.where(go_left, left, self.right[current])
+        return self.value[node].reshape(n_rows, n_trees).mean(axis=1)
+
+def main():
+    import joblib
+
+    parser = argparse.ArgumentParser(description="Export a pickled forest + scaler to the compact format.")
+    parser.add_argument("model")
+    parser.add_argument("scaler")
+    parser.add_argument("out_dir")
+    args = parser.parse_args()
+    meta = export_forest(joblib.load(args.model), joblib.load(args.scaler), args.out_dir)
+    print(f"Exported {meta['n_trees']} trees, {meta['n_nodes']} nodes to {args.out_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,47 +1,27 @@
-import pandas as pd
-from datetime import datetime
+"""Merge the NSB readings with the weather history into one CSV.
 
-# File paths
-nsb_path = r"C:\Users\cxoox\Desktop\star_analysis\nsb_sun_moon.csv"
-weather_path = r"C:\Users\cxoox\Desktop\star_analysis\history_weather.csv"
-output_path = r"C:\Users\cxoox\Desktop\star_analysis\merged_nsb_weather.csv"
+Kept for the original workflow; the work is done by data_prep.py, which also
+writes Parquet/Feather:
+    python data_filter.py --nsb nsb_sun_moon.csv --weather history_weather.csv --out merged_nsb_weather.csv
+"""
+import argparse
 
+if __package__:
+    from .data_prep import build_merged
+else:  # run as a script from this folder
+    from data_prep import build_merged
 
-# Helper to parse mixed date formats
-def parse_date(date_str):
-    for fmt in ("%m/%d/%Y", "%m/%d/%y"):
-        try:
-            return datetime.strptime(str(date_str), fmt)
-        except Exception:
-            continue
-    return pd.NaT
 
+def main():
+    parser = argparse.ArgumentParser(description="Merge NSB readings with weather history.")
+    parser.add_argument("--nsb", required=True, help="NSB + sun/moon CSV")
+    parser.add_argument("--weather", required=True, help="Open-Meteo history CSV")
+    parser.add_argument("--out", default="merged_nsb_weather.csv")
+    args = parser.parse_args()
 
-# Read NSB file
-df_nsb = pd.read_csv(nsb_path)
-df_nsb = df_nsb[df_nsb.notna().sum(axis=1) > 1]
+    build_merged(args.nsb, args.weather, args.out)
+    print(f"Merged file saved to: {args.out}")
 
-# Parse mixed date formats in NSB
-df_nsb["Date"] = df_nsb["Date"].apply(parse_date)
-df_nsb["Date"] = df_nsb["Date"].dt.strftime("%Y-%m-%d")
 
-# Read weather file, skip metadata rows (header is on line 4, so skip 3)
-df_weather = pd.read_csv(weather_path, skiprows=3)
-df_weather["Date"] = pd.to_datetime(df_weather["time"], errors="coerce").dt.strftime(
-    "%Y-%m-%d"
-)
-df_weather = df_weather.drop(columns=["time"])
-
-# Merge: left join, so all NSB dates are kept, weather is merged in
-merged = pd.merge(df_nsb, df_weather, on="Date", how="left")
-
-# Reorder columns: Date, Max Night Sky Brightness (MPSAS), then the rest
-cols = merged.columns.tolist()
-cols.remove("Date")
-cols.remove("Max Night Sky Brightness (MPSAS)")
-ordered_cols = ["Date", "Max Night Sky Brightness (MPSAS)"] + cols
-merged = merged[ordered_cols]
-
-# Save to CSV
-merged.to_csv(output_path, index=False)
-print(f"Merged file saved to: {output_path}")
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,135 @@
+"""Merge nightly NSB readings with Open-Meteo history and prepare the training frame.
+
+    python -m stargazing.data_prep --nsb nsb_sun_moon.csv --weather history_weather.csv \\
+        --out merged_nsb_weather.parquet
+
+Everything is column-wise: dates are parsed with explicit formats picked by
+the length of the year field, "HH:MM" times are split and combined with
+integer arithmetic, and the result is written as Parquet or Feather (by file
+extension; .csv still works) so training reads typed columns back directly.
+"""
+import argparse
+import os
+import pandas as pd
+
+if __package__:
+    from .features import TARGET_COLUMN, TIME_COLUMNS, training_column_name
+else:  # run as a script from this folder
+    from features import TARGET_COLUMN, TIME_COLUMNS, training_column_name
+
+# The Open-Meteo history export has 3 metadata lines above its header
+WEATHER_SKIPROWS = 3
+
+
+def parse_mixed_dates(values):
+    """Dates written as m/d/YYYY or m/d/YY (NaT otherwise), parsed column-wise."""
+    text = pd.Series(values, copy=False).astype(str).str.strip()
+    year_digits = text.str.rsplit("/", n=1).str[-1].str.len()
+    long_year = pd.to_datetime(text.where(year_digits == 4), format="%m/%d/%Y", errors="coerce")
+    short_year = pd.to_datetime(text.where(year_digits == 2), format="%m/%d/%y", errors="coerce")
+    return long_year.fillna(short_year)
+
+
+def times_to_minutes(values):
+    """"HH:MM" strings to minutes since midnight; -1 if missing or invalid."""
+    parts = pd.Series(values, copy=False).astype(str).str.split(":", n=1, expand=True)
+    if parts.shape[1] < 2:
+        return pd.Series(-1, index=parts.index, dtype="int64")
+    hours = pd.to_numeric(parts[0], errors="coerce")
+    minutes = pd.to_numeric(parts[1], errors="coerce")
+    valid = (
+        hours.between(0, 23)
+        & minutes.between(0, 59)
+        & (hours % 1 == 0)
+        & (minutes % 1 == 0)
+    )
+    return (hours * 60 + minutes).where(valid, -1).astype("int64")
+
+
+def load_nsb(path):
+    df_nsb = pd.read_csv(path)
+    # Drop rows that only have a date (nights without a reading)
+    df_nsb = df_nsb[df_nsb.notna().sum(axis=1) > 1]
+    df_nsb["Date"] = parse_mixed_dates(df_nsb["Date"]).dt.strftime("%Y-%m-%d")
+    return df_nsb
+
+
+def load_weather(path, skiprows=WEATHER_SKIPROWS):
+    df_weather = pd.read_csv(path, skiprows=skiprows)
+    df_weather["Date"] = pd.to_datetime(
+        df_weather["time"], format="%Y-%m-%d", errors="coerce"
+    ).dt.strftime("%Y-%m-%d")
+    return df_weather.drop(columns=["time"])
+
+
+def merge_nsb_weather(df_nsb, df_weather):
+    """Left join on Date (every NSB night is kept), Date and target first."""
+    merged = pd.merge(df_nsb, df_weather, on="Date", how="left")
+    cols = merged.columns.tolist()
+    cols.remove("Date")
+    cols.remove(TARGET_COLUMN)
+    return merged[["Date", TARGET_COLUMN] + cols]
+
+
+def prepare_training_frame(merged, keep_date=False):
+    """Numeric frame ready for training: unit-free names, time columns in minutes,
+    rows without a target dropped, other gaps filled with column means."""
+    data = merged if keep_date else merged.drop(columns=["Date"], errors="ignore")
+    # Weather columns carry units ("rain_sum (mm)"); match them to the feature spec
+    data = data.rename(columns=training_column_name)
+    data = data.dropna(subset=[TARGET_COLUMN]).copy()
+
+    for col in data.columns:
+        if col in TIME_COLUMNS:
+            data[col] = times_to_minutes(data[col])
+        elif col != "Date" and not pd.api.types.is_numeric_dtype(data[col]):
+            data[col] = pd.to_numeric(data[col], errors="coerce")
+
+    return data.fillna(data.mean(numeric_only=True))
+
+
+def write_frame(df, path):
+    """Write by extension: .parquet, .feather or .csv (atomically)."""
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    ext = os.path.splitext(path)[1].lower()
+    temp_path = os.path.join(directory, f".{os.path.basename(path)}.tmp")
+    if ext == ".parquet":
+        df.to_parquet(temp_path, index=False)
+    elif ext == ".feather":
+        df.reset_index(drop=True).to_feather(temp_path)
+    elif ext == ".csv":
+        df.to_csv(temp_path, index=False)
+    else:
+        raise ValueError(f"Unsupported output format: {path}")
+    os.replace(temp_path, path)
+
+
+def read_frame(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".parquet":
+        return pd.read_parquet(path)
+    if ext == ".feather":
+        return pd.read_feather(path)
+    return pd.read_csv(path)
+
+
+def build_merged(nsb_path, weather_path, out_path=None):
+    merged = merge_nsb_weather(load_nsb(nsb_path), load_weather(weather_path))
+    if out_path:
+        write_frame(merged, out_path)
+    return merged
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge NSB readings with weather history.")
+    parser.add_argument("--nsb", required=True, help="NSB + sun/moon CSV")
+    parser.add_argument("--weather", required=True, help="Open-Meteo history CSV")
+    parser.add_argument("--out", required=True, help=".parquet, .feather or .csv")
+    args = parser.parse_args()
+    merged = build_merged(args.nsb, args.weather, args.out)
+    print(f"Merged {len(merged)} nights saved to: {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""Offline sun/moon rise, transit and set times and moon illumination.
+
+Replaces the Hong Kong Observatory yearly CSVs, which had to be re-downloaded
+every year. Times are computed with low-precision series (Astronomical
+Almanac, sun ~0.01 deg, moon ~0.3 deg), good to about a minute for the sun
+and one to two minutes for the moon, which is the resolution the model sees.
+
+One table per (year, location) is computed in a single vectorised pass and
+stored as a small .npz: `times` is int16 (days x 6) in minutes since local
+midnight (-1 when the body does not rise/transit/set that day, as in the HKO
+tables), `illumination` is float32 (days). Tables are indexed by day of year.
+
+Build tables ahead of time with:
+    python -m stargazing.ephemeris --lat 22.31 --lon 114.17 --years 2025 2026
+"""
+import argparse
+import os
+from datetime import date
+from functools import lru_cache
+import numpy as np
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+EPHEMERIS_DIR = os.path.join(BASE_DIR, "data", "ephemeris")
+
+# Columns of a table, named like the forecast entry / feature keys
+EVENT_KEYS = ["sun_rise", "sun_transit", "sun_set", "moon_rise", "moon_transit", "moon_set"]
+# Hong Kong Time, used when a caller does not know the location's offset
+HK_UTC_OFFSET_MINUTES = 8 * 60
+# Altitude of the centre at rise/set: refraction + semidiameter
+SUN_HORIZON = -0.833
+# Altitude samples per day; events are interpolated between samples
+SAMPLE_MINUTES = 5
+
+J2000 = 2451545.0
+DEG = np.pi / 180
+
+
+def julian_day(ordinals, minutes_utc):
+    """Julian day for proleptic Gregorian day ordinals plus minutes past 00:00 UTC."""
+    # date(2000, 1, 1).toordinal() == 730120 is JD 2451544.5 at midnight
+    return ordinals - 730120 + 2451544.5 + minutes_utc / 1440.0
+
+
+def _ecliptic_to_equatorial(lon, lat, obliquity):
+    """Right ascension and declination (degrees) from ecliptic coordinates (degrees)."""
+    lon, lat, eps = lon * DEG, lat * DEG, obliquity * DEG
+    ra = np.arctan2(np.sin(lon) * np.cos(eps) - np.tan(lat) * np.sin(eps), np.cos(lon))
+    dec = np.arcsin(np.sin(lat) * np.cos(eps) + np.cos(lat) * np.sin(eps) * np.sin(lon))
+    return ra / DEG, dec / DEG
+
+
+def sun_position(jd):
+    """Ecliptic longitude (deg), right ascension and declination (deg) of the sun."""
+    n = jd - J2000
+    mean_lon = 280.460 + 0.9856474 * n
+    anomaly = (357.528 + 0.9856003 * n) * DEG
+    ecl_lon = mean_lon + 1.915 * np.sin(anomaly) + 0.020 * np.sin(2 * anomaly)
+    obliquity = 23.439 - 0.0000004 * n
+    ra, dec = _ecliptic_to_equatorial(ecl_lon, np.zeros_like(ecl_lon), obliquity)
+    return ecl_lon, ra, dec
+
+
+def moon_position(jd):
+    """Ecliptic longitude/latitude, right ascension, declination and horizontal parallax (deg)."""
+    t = (jd - J2000) / 36525
+
+    def s(a, b):
+        return np.sin((a + b * t) * DEG)
+
+    def c(a, b):
+        return np.cos((a + b * t) * DEG)
+
+    ecl_lon = (
+        218.32 + 481267.881 * t
+        + 6.29 * s(135.0, 477198.87) - 1.27 * s(259.3, -413335.36)
+        + 0.66 * s(235.7, 890534.22) + 0.21 * s(269.9, 954397.74)
+        - 0.19 * s(357.5, 35999.05) - 0.11 * s(186.5, 966404.03)
+    )
+    ecl_lat = (
+        5.13 * s(93.3, 483202.02) + 0.28 * s(228.2, 960400.89)
+        - 0.28 * s(318.3, 6003.15) - 0.17 * s(217.6, -407332.21)
+    )
+    parallax = (
+        0.9508
+        + 0.0518 * c(135.0, 477198.87) + 0.0095 * c(259.3, -413335.36)
+        + 0.0078 * c(235.7, 890534.22) + 0.0028 * c(269.9, 954397.74)
+    )
+    obliquity = 23.439 - 0.0000004 * (jd - J2000)
+    ra, dec = _ecliptic_to_equatorial(ecl_lon, ecl_lat, obliquity)
+    return ecl_lon, ecl_lat, ra, dec, parallax
+
+
+def hour_angle(jd, lon, ra):
+    """Local hour angle in (-180, 180] degrees."""
+    t = (jd - J2000) / 36525
+    sidereal = 280.46061837 + 360.98564736629 * (jd - J2000) + 0.000387933 * t * t
+    return (sidereal + lon - ra + 180) % 360 - 180
+
+
+def altitude(lat, dec, ha):
+    lat, dec, ha = lat * DEG, dec * DEG, ha * DEG
+    return np.arcsin(np.sin(lat) * np.sin(dec) + np.cos(lat) * np.cos(dec) * np.cos(ha)) / DEG
+
+
+def _first_crossing(values, minutes, rising):
+    """Minute of the first upward (or downward) zero crossing per row, -1 if none."""
+    before, after = values[:, :-1], values[:, 1:]
+    if rising:
+        crossed = (before < 0) & (after >= 0)
+    else:
+        crossed = (before >= 0) & (after < 0)
+    found = crossed.any(axis=1)
+    idx = crossed.argmax(axis=1)
+    rows = np.arange(values.shape[0])
+    v0, v1 = before[rows, idx], after[rows, idx]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        fraction = v0 / (v0 - v1)
+    result = minutes[idx] + fraction * (minutes[1] - minutes[0])
+    result = np.minimum(np.rint(result), 1439)
+    return np.where(found, result, -1).astype(np.int16)
+
+
+def _events(alt_minus_horizon, ha, minutes):
+    """Rise, transit and set minutes for (days x samples) altitude/hour-angle grids."""
+    return (
+        _first_crossing(alt_minus_horizon, minutes, rising=True),
+        # The +180 -> -180 wrap is a downward jump, so only the meridian counts
+        _first_crossing(ha, minutes, rising=True),
+        _first_crossing(alt_minus_horizon, minutes, rising=False),
+    )
+
+
+def compute_table(days, lat, lon, utc_offset_minutes=HK_UTC_OFFSET_MINUTES):
+    """Ephemeris for a list of dates at one location.
+
+    Returns (times, illumination): int16 (days x 6) minutes since local midnight
+    in EVENT_KEYS order, and the moon's illuminated fraction at the local
+    midnight that ends each date (i.e. during that night).
+    """
+    ordinals = np.array([d.toordinal() for d in days], dtype=float)[:, None]
+    minutes = np.arange(0, 1440 + SAMPLE_MINUTES, SAMPLE_MINUTES, dtype=float)
+    jd = julian_day(ordinals, minutes[None, :] - utc_offset_minutes)
+
+    _, sun_ra, sun_dec = sun_position(jd)
+    sun_ha = hour_angle(jd, lon, sun_ra)
+    sun_events = _events(altitude(lat, sun_dec, sun_ha) - SUN_HORIZON, sun_ha, minutes)
+
+    _, _, moon_ra, moon_dec, parallax = moon_position(jd)
+    moon_ha = hour_angle(jd, lon, moon_ra)
+    # Upper limb on the horizon, corrected for refraction and topocentric parallax
+    moon_horizon = 0.7275 * parallax - 0.5667
+    moon_events = _events(altitude(lat, moon_dec, moon_ha) - moon_horizon, moon_ha, minutes)
+
+    times = np.stack(sun_events + moon_events, axis=1)
+
+    night = julian_day(ordinals[:, 0], 1440.0 - utc_offset_minutes)
+    sun_lon, _, _ = sun_position(night)
+    moon_lon, moon_lat, _, _, _ = moon_position(night)
+    elongation = np.arccos(np.cos(moon_lat * DEG) * np.cos((moon_lon - sun_lon) * DEG))
+    illumination = ((1 - np.cos(elongation)) / 2).astype(np.float32)
+    return times, illumination
+
+
+def _year_days(year):
+    start = date(year, 1, 1).toordinal()
+    return [date.fromordinal(o) for o in range(start, date(year + 1, 1, 1).toordinal())]
+
+
+def table_path(year, lat, lon, utc_offset_minutes):
+    return os.path.join(
+        EPHEMERIS_DIR, f"ephemeris_{year}_{lat:.2f}_{lon:.2f}_{utc_offset_minutes:+d}.npz"
+    )
+
+
+def _location_key(lat, lon, utc_offset_minutes):
+    # ~1 km changes rise/set times by a few seconds; round so tables are shared
+    return round(float(lat), 2), round(float(lon), 2), int(utc_offset_minutes)
+
+
+def build_year(year, lat, lon, utc_offset_minutes=HK_UTC_OFFSET_MINUTES):
+    """Compute one year's table and write it next to the others; returns the path."""
+    lat, lon, utc_offset_minutes = _location_key(lat, lon, utc_offset_minutes)
+    times, illumination = compute_table(_year_days(year), lat, lon, utc_offset_minutes)
+    path = table_path(year, lat, lon, utc_offset_minutes)
+    os.makedirs(EPHEMERIS_DIR, exist_ok=True)
+    temp_path = path + ".tmp.npz"
+    np.savez(temp_path, times=times, illumination=illumination)
+    os.replace(temp_path, path)
+    return path
+
+
+@lru_cache(maxsize=64)
+def _year_table(year, lat, lon, utc_offset_minutes):
+    path = table_path(year, lat, lon, utc_offset_minutes)
+    if os.path.exists(path):
+        with np.load(path) as table:
+            return table["times"], table["illumination"]
+    # Not prebuilt (ad-hoc site or a new year): compute in memory, ~tens of ms
+    return compute_table(_year_days(year), lat, lon, utc_offset_minutes)
+
+
+def year_table(year, lat, lon, utc_offset_minutes=HK_UTC_OFFSET_MINUTES):
+    """(times, illumination) for a whole year, loaded or computed once per process."""
+    return _year_table(year, *_location_key(lat, lon, utc_offset_minutes))
+
+
+def preload(lat, lon, utc_offset_minutes=HK_UTC_OFFSET_MINUTES, years=None):
+    """Make sure tables for `years` (default: this year and next) exist on disk and are loaded."""
+    if years is None:
+        this_year = date.today().year
+        years = [this_year, this_year + 1]
+    key = _location_key(lat, lon, utc_offset_minutes)
+    for year in years:
+        if not os.path.exists(table_path(year, *key)):
+            build_year(year, *key)
+        _year_table(year, *key)
+
+
+def astronomy_for_dates(dates, lat, lon, utc_offset_minutes=HK_UTC_OFFSET_MINUTES):
+    """{date: {event key: minutes or -1, "moon_illumination": fraction}} for "YYYY-MM-DD" dates."""
+    result = {}
+    for date_str in dates:
+        day = date.fromisoformat(date_str)
+        times, illumination = year_table(day.year, lat, lon, utc_offset_minutes)
+        row = day.timetuple().tm_yday - 1
+        values = {key: int(times[row, j]) for j, key in enumerate(EVENT_KEYS)}
+        values["moon_illumination"] = float(illumination[row])
+        result[date_str] = values
+    return result
+
+
+def format_minutes(minutes):
+    """"HH:MM" like the HKO tables, "" for -1."""
+    if minutes < 0:
+        return ""
+    return f"{minutes // 60:02d}:{minutes % 60:02d}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute sun/moon ephemeris tables.")
+    parser.add_argument("--lat", type=float, required=True)
+    parser.add_argument("--lon", type=float, required=True)
+    parser.add_argument("--utc-offset", type=int, default=HK_UTC_OFFSET_MINUTES, help="minutes")
+    parser.add_argument("--years", type=int, nargs="+", default=[date.today().year])
+    args = parser.parse_args()
+    for year in args.years:
+        print(build_year(year, args.lat, args.lon, args.utc_offset))
+
+
+if __name__ == "__main__":
+    main()
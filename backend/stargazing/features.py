@@ -0,0 +1,82 @@
+import re
+import numpy as np
+
+# Feature order of the stargazing model, shared by training and prediction.
+# Each entry: (key in a forecast entry, column in the merged NSB/weather CSV, kind)
+# "time" features are minutes since midnight (-1 if missing); "HH:MM" strings from
+# the training CSVs are converted, ephemeris minutes are used as is.
+FEATURE_SPEC = [
+    ("sun_rise", "Sun Rise", "time"),
+    ("sun_transit", "Sun Transit", "time"),
+    ("sun_set", "Sun Set", "time"),
+    ("moon_rise", "Moon Rise", "time"),
+    ("moon_transit", "Moon Transit", "time"),
+    ("moon_set", "Moon Set", "time"),
+    ("temperature_2m_mean", "temperature_2m_mean", "number"),
+    ("temperature_2m_max", "temperature_2m_max", "number"),
+    ("temperature_2m_min", "temperature_2m_min", "number"),
+    ("apparent_temperature_mean", "apparent_temperature_mean", "number"),
+    ("apparent_temperature_max", "apparent_temperature_max", "number"),
+    ("apparent_temperature_min", "apparent_temperature_min", "number"),
+    ("rain_sum", "rain_sum", "number"),
+    ("wind_speed_10m_max", "wind_speed_10m_max", "number"),
+    ("wind_gusts_10m_max", "wind_gusts_10m_max", "number"),
+    ("wind_direction_10m_dominant", "wind_direction_10m_dominant", "number"),
+    ("shortwave_radiation_sum", "shortwave_radiation_sum", "number"),
+    ("et0_fao_evapotranspiration", "et0_fao_evapotranspiration", "number"),
+    ("cloud_cover_mean", "cloud_cover_mean", "number"),
+    ("cloud_cover_max", "cloud_cover_max", "number"),
+    ("cloud_cover_min", "cloud_cover_min", "number"),
+    ("dew_point_2m_mean", "dew_point_2m_mean", "number"),
+    ("dew_point_2m_min", "dew_point_2m_min", "number"),
+    ("dew_point_2m_max", "dew_point_2m_max", "number"),
+    ("wind_speed_10m_mean", "wind_speed_10m_mean", "number"),
+    ("wind_speed_10m_min", "wind_speed_10m_min", "number"),
+    ("winddirection_10m_dominant", "winddirection_10m_dominant", "number"),
+    ("precipitation_sum", "precipitation_sum", "number"),
+    ("snowfall_sum", "snowfall_sum", "number"),
+    ("pressure_msl_mean", "pressure_msl_mean", "number"),
+    ("pressure_msl_max", "pressure_msl_max", "number"),
+    ("pressure_msl_min", "pressure_msl_min", "number"),
+    ("surface_pressure_mean", "surface_pressure_mean", "number"),
+    ("surface_pressure_max", "surface_pressure_max", "number"),
+    ("surface_pressure_min", "surface_pressure_min", "number"),
+    ("wind_gusts_10m_mean", "wind_gusts_10m_mean", "number"),
+    ("wind_gusts_10m_min", "wind_gusts_10m_min", "number"),
+    ("relative_humidity_2m_mean", "relative_humidity_2m_mean", "number"),
+    ("relative_humidity_2m_max", "relative_humidity_2m_max", "number"),
+    ("relative_humidity_2m_min", "relative_humidity_2m_min", "number"),
+    ("et0_fao_evapotranspiration_sum", "et0_fao_evapotranspiration_sum", "number"),
+]
+
+FEATURE_KEYS = [key for key, _, _ in FEATURE_SPEC]
+TRAINING_COLUMNS = [column for _, column, _ in FEATURE_SPEC]
+TIME_COLUMNS = [column for _, column, kind in FEATURE_SPEC if kind == "time"]
+TARGET_COLUMN = "Max Night Sky Brightness (MPSAS)"
+
+
+def training_column_name(column):
+    """Open-Meteo history exports name columns like "rain_sum (mm)"; drop the unit."""
+    if column == TARGET_COLUMN:
+        return column
+    return re.sub(r"\s*\(.*\)$", "", column)
+
+
+def time_to_minutes(tstr):
+    if isinstance(tstr, (int, np.integer)):
+        return int(tstr)
+    if not tstr or tstr in ["", None]:
+        return -1
+    h, m = map(int, tstr.split(":"))
+    return h * 60 + m
+
+
+def build_feature_matrix(entries):
+    """One row per forecast entry, columns in FEATURE_SPEC order (missing weather -> 0)."""
+    X = np.empty((len(entries), len(FEATURE_SPEC)), dtype=float)
+    for j, (key, _, kind) in enumerate(FEATURE_SPEC):
+        if kind == "time":
+            X[:, j] = [time_to_minutes(entry.get(key, None)) for entry in entries]
+        else:
+            X[:, j] = [entry.get(key, 0) for entry in entries]
+    return X
@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import datetime
+
+
+def atomic_write_json(path, data):
+    """Write JSON to a temp file next to `path`, then rename it over `path`."""
+    directory = os.path.dirname(path) or "."
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".forecast_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class ForecastCache:
+    """In-memory forecast with TTL and stale-while-revalidate semantics.
+
+    - fresh value: returned as is
+    - stale value: returned immediately while one background thread refreshes it
+    - no value: the caller computes it; concurrent callers wait for that same
+      computation instead of each hitting the upstream API (single flight)
+
+    A value is fresh while it is younger than `ttl` seconds and was computed
+    today, since the forecast starts from the day it was fetched. An empty
+    result never replaces a previous good one.
+    """
+
+    def __init__(self, compute_fn, ttl, cache_path=None, name="forecast"):
+        self.compute_fn = compute_fn
+        self.ttl = ttl
+        self.cache_path = cache_path
+        self.name = name
+        self._value = None
+        self._fetched_at = 0.0
+        self._refresh_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._scheduler = None
+        self._load_from_disk()
+
+    def _load_from_disk(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return
+        try:
+            with open(self.cache_path, "r", encoding="utf-8") as f:
+                value = json.load(f)
+        except (OSError, ValueError):
+            return
+        if value:
+            self._value = value
+            self._fetched_at = os.path.getmtime(self.cache_path)
+
+    def has_value(self):
+        return bool(self._value)
+
+    @property
+    def value(self):
+        return self._value
+
+    def is_fresh(self):
+        if not self._value:
+            return False
+        today = datetime.now().strftime("%Y-%m-%d")
+        fetched_day = datetime.fromtimestamp(self._fetched_at).strftime("%Y-%m-%d")
+        return fetched_day == today and time.time() - self._fetched_at < self.ttl
+
+    def get(self):
+        if self.is_fresh():
+            return self._value
+        if self._value:
+            self.refresh_in_background()
+            return self._value
+        return self.refresh()
+
+    def refresh(self):
+        """Recompute now; if another thread is already doing so, wait for its result."""
+        started = time.time()
+        with self._refresh_lock:
+            if self._fetched_at >= started and self._value:
+                # Someone else refreshed while we were waiting for the lock
+                return self._value
+            value = self.compute_fn()
+            self.store(value)
+            return self._value if self._value is not None else value
+
+    def store(self, value):
+        """Publish a value computed elsewhere (e.g. by a batched async fetch)."""
+        if not value:
+            return
+        self._value = value
+        self._fetched_at = time.time()
+        if self.cache_path:
+            try:
+                atomic_write_json(self.cache_path, value)
+            except OSError as e:
+                print(f"Could not write {self.name} cache: {e}")
+
+    def refresh_in_background(self):
+        if self._refresh_lock.locked():
+            return
+        threading.Thread(target=self._safe_refresh, name=f"{self.name}-refresh", daemon=True).start()
+
+    def _safe_refresh(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"Background {self.name} refresh failed, serving stale data: {e}")
+
+    # --- Scheduled refresh ---
+
+    def _run_scheduler(self, interval):
+        while not self._stop_event.wait(interval):
+            if not self.is_fresh():
+                self._safe_refresh()
+
+    def start_scheduler(self, interval=None):
+        if self._scheduler is not None:
+            return
+        self._stop_event.clear()
+        self._scheduler = threading.Thread(
+            target=self._run_scheduler,
+            args=(interval or min(self.ttl, 3600),),
+            name=f"{self.name}-scheduler",
+            daemon=True,
+        )
+        self._scheduler.start()
+
+    def stop_scheduler(self):
+        if self._scheduler is None:
+            return
+        self._stop_event.set()
+        self._scheduler.join(timeout=5)
+        self._scheduler = None
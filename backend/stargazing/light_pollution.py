@@ -0,0 +1,173 @@
+"""Sky brightness at a point or over an area, from the Hong Kong light-pollution raster.
+
+The raster is the same un-blurred crop the frontend samples in the browser
+(hk_lightpollution_noblur.png, drawn over IMG_LAT/IMG_LNG in HKStargazing.tsx).
+Each pixel's colour is matched once to the nearest atlas colour class and the
+class indices are saved as a uint8 .npy, which is memory-mapped for queries:
+a lookup is index arithmetic plus one array read, with no image decoding per
+request.
+"""
+import os
+import threading
+import numpy as np
+
+if __package__:
+    from .stargazing_service import BASE_DIR, mpsas_to_bortle
+else:  # run as a script from this folder
+    from stargazing_service import BASE_DIR, mpsas_to_bortle
+
+RASTER_PATH = os.path.join(BASE_DIR, "assets", "hk_lightpollution_noblur.png")
+CLASSES_PATH = os.path.join(BASE_DIR, "data", "hk_lightpollution_classes.npy")
+
+# Lat/lon extent of the raster (same as IMG_LAT_* / IMG_LNG_* in the frontend)
+lat_min, lat_max = 21.95, 22.75
+lon_min, lon_max = 113.5, 114.69
+
+# Atlas colours and their sky-brightness band (MPSAS), as in the frontend COLOR_TABLE
+COLOR_TABLE = [
+    ((0, 0, 0), 22.00, 21.99),
+    ((32, 32, 32), 21.99, 21.93),
+    ((64, 64, 64), 21.93, 21.89),
+    ((0, 0, 64), 21.89, 21.81),
+    ((0, 0, 128), 21.81, 21.69),
+    ((0, 64, 0), 21.69, 21.51),
+    ((0, 128, 0), 21.51, 21.25),
+    ((128, 128, 0), 21.25, 20.91),
+    ((192, 192, 64), 20.91, 20.49),
+    ((192, 128, 0), 20.49, 20.02),
+    ((192, 96, 0), 20.02, 19.50),
+    ((128, 0, 0), 19.50, 18.95),
+    ((192, 0, 0), 18.95, 18.38),
+    ((255, 64, 64), 18.38, 17.80),
+    ((192, 192, 192), 17.80, 17.50),
+]
+# Representative value per class: the middle of its band
+CLASS_MPSAS = np.array([(high + low) / 2 for _, high, low in COLOR_TABLE], dtype=np.float32)
+CLASS_BORTLE = [mpsas_to_bortle(float(mpsas)) for mpsas in CLASS_MPSAS]
+CLASS_RANGE = [f"{high:.2f}~{low:.2f}" for _, high, low in COLOR_TABLE]
+CLASS_RANGE[-1] = f"<{COLOR_TABLE[-1][1]:.2f}"
+
+MAX_BATCH_POINTS = 1000
+
+_classes = None
+_classes_lock = threading.Lock()
+
+
+# 經緯度轉像素座標 (same mapping as geo_to_pixel in frontend/scripts/crop.py)
+def geo_to_pixel(lat, lon, w, h):
+    x = int((lon - lon_min) / (lon_max - lon_min) * w)
+    y = int((lat_max - lat) / (lat_max - lat_min) * h)
+    return x, y
+
+
+def build_classes(raster_path=None, out_path=None):
+    """Classify every raster pixel by nearest atlas colour and save the indices.
+
+    Paths default to RASTER_PATH / CLASSES_PATH as they are at call time.
+    """
+    from PIL import Image
+
+    raster_path = raster_path or RASTER_PATH
+    out_path = out_path or CLASSES_PATH
+
+    with Image.open(raster_path) as img:
+        rgb = np.asarray(img.convert("RGB"), dtype=np.int32)
+    colors = np.array([color for color, _, _ in COLOR_TABLE], dtype=np.int32)
+    distance = ((rgb[:, :, None, :] - colors[None, None, :, :]) ** 2).sum(axis=-1)
+    classes = distance.argmin(axis=-1).astype(np.uint8)
+    os.makedirs(os.path.dirname(out_path), exist_ok=True)
+    temp_path = out_path + ".tmp.npy"
+    np.save(temp_path, classes)
+    os.replace(temp_path, out_path)
+    return classes
+
+
+def load_classes():
+    """Memory-mapped class raster, rebuilt if the PNG is newer than the saved indices."""
+    global _classes
+    if _classes is None:
+        with _classes_lock:
+            if _classes is None:
+                if not os.path.exists(CLASSES_PATH) or (
+                    os.path.getmtime(CLASSES_PATH) < os.path.getmtime(RASTER_PATH)
+                ):
+                    build_classes()
+                _classes = np.load(CLASSES_PATH, mmap_mode="r")
+    return _classes
+
+
+def _describe(lat, lon, class_index):
+    return {
+        "lat": lat,
+        "lon": lon,
+        "mpsas": round(float(CLASS_MPSAS[class_index]), 2),
+        "bortle": CLASS_BORTLE[class_index],
+        "sky": CLASS_RANGE[class_index],
+    }
+
+
+def _check_coordinates(lat, lon):
+    if not (np.isfinite(lat).all() and np.isfinite(lon).all()):
+        raise ValueError("Coordinates must be finite numbers")
+
+
+def query_point(lat, lon):
+    """Sky brightness at one location, or None outside the raster."""
+    return query_points([(lat, lon)])[0]
+
+
+def query_points(points):
+    """Sky brightness for many (lat, lon) pairs in one vectorised lookup."""
+    if len(points) > MAX_BATCH_POINTS:
+        raise ValueError(f"At most {MAX_BATCH_POINTS} points per request")
+    if not len(points):
+        return []
+    coords = np.asarray(points, dtype=float).reshape(-1, 2)
+    lat, lon = coords[:, 0], coords[:, 1]
+    _check_coordinates(lat, lon)
+    classes = load_classes()
+    h, w = classes.shape
+    # geo_to_pixel, vectorised (floor == int() inside the raster)
+    x = np.floor((lon - lon_min) / (lon_max - lon_min) * w).astype(np.int64)
+    y = np.floor((lat_max - lat) / (lat_max - lat_min) * h).astype(np.int64)
+    inside = (x >= 0) & (x < w) & (y >= 0) & (y < h)
+    found = np.zeros(len(coords), dtype=np.int64)
+    found[inside] = classes[y[inside], x[inside]]
+    return [
+        _describe(float(la), float(lo), int(c)) if ok else None
+        for la, lo, c, ok in zip(lat, lon, found, inside)
+    ]
+
+
+def query_area(area_lat_min, area_lat_max, area_lon_min, area_lon_max):
+    """Darkest spot, mean brightness and Bortle distribution inside a lat/lon box."""
+    _check_coordinates(
+        np.array([area_lat_min, area_lat_max]), np.array([area_lon_min, area_lon_max])
+    )
+    if area_lat_min >= area_lat_max or area_lon_min >= area_lon_max:
+        raise ValueError("Area minimums must be below maximums")
+    classes = load_classes()
+    h, w = classes.shape
+    x1, y1 = geo_to_pixel(area_lat_max, area_lon_min, w, h)  # 左上
+    x2, y2 = geo_to_pixel(area_lat_min, area_lon_max, w, h)  # 右下
+    x1, y1 = max(x1, 0), max(y1, 0)
+    x2, y2 = min(x2 + 1, w), min(y2 + 1, h)
+    if x1 >= x2 or y1 >= y2:
+        return None
+    window = np.asarray(classes[y1:y2, x1:x2])
+    mpsas = CLASS_MPSAS[window]
+    darkest_y, darkest_x = np.unravel_index(np.argmax(mpsas), mpsas.shape)
+    # Pixel centre of the darkest cell
+    darkest_lat = lat_max - (y1 + darkest_y + 0.5) / h * (lat_max - lat_min)
+    darkest_lon = lon_min + (x1 + darkest_x + 0.5) / w * (lon_max - lon_min)
+    counts = np.bincount(window.ravel(), minlength=len(COLOR_TABLE))
+    return {
+        "pixels": int(window.size),
+        "mpsas_mean": round(float(mpsas.mean()), 2),
+        "mpsas_min": round(float(mpsas.min()), 2),
+        "mpsas_max": round(float(mpsas.max()), 2),
+        "darkest": _describe(round(darkest_lat, 5), round(darkest_lon, 5), int(window[darkest_y, darkest_x])),
+        "bortle_share": {
+            CLASS_BORTLE[i]: round(int(n) / window.size, 4) for i, n in enumerate(counts) if n
+        },
+    }
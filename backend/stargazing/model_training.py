@@ -1,85 +1,83 @@
+"""Train the stargazing sky-brightness model.
+
+    python model_training.py --data merged.parquet               # pruned search, resumable
+    python model_training.py --data merged.parquet --mode full   # original search, no pruning
+    python model_training.py --data merged.parquet --compare --trials 20  # wall clock of both
+
+The pruned search grows each fold's forest with warm_start in stages
+(GROWTH_STAGES of n_estimators), reports the mean fold MSE after every fold
+and lets a MedianPruner stop trials that are already worse than the median.
+A full trial costs the same as one cross_val_score; a pruned one stops early.
+
+Trials are stored in SQLite (--storage) under --study-name plus a fingerprint
+of the training split, so an interrupted study on the same data resumes and
+several processes started on it share the study; new data starts a new one.
+Only in-memory studies use a fixed sampler seed: processes sharing a stored
+study would otherwise all propose the same trials.
+"""
+import argparse
+import hashlib
+import os
+import time
+import warnings
 import numpy as np
 import pandas as pd
-import matplotlib.pyplot as plt
-from sklearn.model_selection import train_test_split
+from sklearn.model_selection import KFold, train_test_split
 from sklearn.preprocessing import StandardScaler
 from sklearn.ensemble import RandomForestRegressor
 from sklearn.metrics import mean_squared_error, r2_score
 import joblib
-import os
-import sys
-from datetime import datetime
 
 # Add Optuna
 import optuna
 from sklearn.model_selection import cross_val_score
 
+if __package__:
+    from .compact_forest import export_forest
+    from .data_prep import prepare_training_frame, read_frame
+    from .features import TARGET_COLUMN, TRAINING_COLUMNS
+else:  # run as a script from this folder
+    from compact_forest import export_forest
+    from data_prep import prepare_training_frame, read_frame
+    from features import TARGET_COLUMN, TRAINING_COLUMNS
 
-def time_string_to_number(time_string):
-    """
-    Convert a time string in the format 'HH:MM' to a number of minutes since midnight.
-    Returns -1 if missing or invalid.
-    """
-    try:
-        if pd.isna(time_string) or time_string in ["", None]:
-            return -1
-        time_only = datetime.strptime(time_string, "%H:%M").time()
-        return time_only.hour * 60 + time_only.minute
-    except Exception:
-        return -1
-
-
-script_dir = os.path.dirname(os.path.abspath(sys.argv[0]))
-data = pd.read_csv(r"C:\Users\cxoox\Desktop\star_analysis\merged_nsb_weather.csv")
-data = data.drop(columns=["Date"])
-
-# Convert time strings to numbers, using -1 for missing
-for col in [
-    "Sun Rise",
-    "Sun Transit",
-    "Sun Set",
-    "Moon Rise",
-    "Moon Transit",
-    "Moon Set",
-]:
-    data[col] = data[col].apply(time_string_to_number)
-
-# Drop rows with missing target only
-data = data.dropna(subset=["Max Night Sky Brightness (MPSAS)"])
-
-# Convert all columns except already-handled time columns to numeric
-for col in data.columns:
-    if col not in [
-        "Max Night Sky Brightness (MPSAS)",
-        "Sun Rise",
-        "Sun Transit",
-        "Sun Set",
-        "Moon Rise",
-        "Moon Transit",
-        "Moon Set",
-    ]:
-        data[col] = pd.to_numeric(data[col], errors="coerce")
-
-# Fill missing values in features with column means
-data = data.fillna(data.mean(numeric_only=True))
-
-y = data["Max Night Sky Brightness (MPSAS)"].values.ravel()
-X = data.drop(columns=["Max Night Sky Brightness (MPSAS)"])
-
-# Split data
-X_train, X_test, y_train, y_test = train_test_split(
-    X, y, test_size=0.2, random_state=42
-)
-
-# Standardize features
-scaler = StandardScaler()
-X_train_scaled = scaler.fit_transform(X_train)
-X_test_scaled = scaler.transform(X_test)
-
-
-# Optuna hyperparameter optimization
-def objective(trial):
-    params = {
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+MODEL_DIR = os.path.join(BASE_DIR, "model")
+DEFAULT_STORAGE = f"sqlite:///{os.path.join(MODEL_DIR, 'optuna_study.db')}"
+DEFAULT_STUDY_NAME = "stargazing-rf"
+
+CV_FOLDS = 5
+# Fractions of a trial's n_estimators at which the pruner sees intermediate scores
+GROWTH_STAGES = (0.25, 0.5, 1.0)
+
+
+# --- Data ---
+
+
+def load_training_data(path):
+    """Feature frame (TRAINING_COLUMNS order) and target from the merged NSB/weather file."""
+    data = prepare_training_frame(read_frame(path))
+    y = data[TARGET_COLUMN].values.ravel()
+    # Same column order the service uses to build its prediction matrix
+    X = data[TRAINING_COLUMNS]
+    return X, y, data
+
+
+def split_and_scale(X, y):
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=0.2, random_state=42
+    )
+    scaler = StandardScaler()
+    X_train_scaled = scaler.fit_transform(X_train)
+    X_test_scaled = scaler.transform(X_test)
+    return X_train_scaled, X_test_scaled, y_train, y_test, scaler
+
+
+# --- Hyperparameter search ---
+
+
+def suggest_params(trial):
+    return {
         "n_estimators": trial.suggest_int("n_estimators", 200, 2000, step=200),
         "max_depth": trial.suggest_int("max_depth", 5, 30),
         "min_samples_split": trial.suggest_int("min_samples_split", 2, 10),
@@ -88,72 +86,227 @@ def objective(trial):
         "random_state": 42,
         "n_jobs": -1,
     }
-    model = RandomForestRegressor(**params)
-    scores = cross_val_score(
-        model, X_train_scaled, y_train, cv=5, scoring="neg_mean_squared_error"
+
+
+def full_objective(X_train_scaled, y_train):
+    """The original objective: a complete 5-fold cross_val_score per trial."""
+
+    def objective(trial):
+        model = RandomForestRegressor(**suggest_params(trial))
+        scores = cross_val_score(
+            model, X_train_scaled, y_train, cv=CV_FOLDS, scoring="neg_mean_squared_error"
+        )
+        return scores.mean()
+
+    return objective
+
+
+def pruned_objective(X_train_scaled, y_train):
+    """Same folds and score as full_objective, reported per fold at growing forest sizes.
+
+    Step k * CV_FOLDS + f is the mean -MSE of folds 0..f at stage k, so steps
+    are comparable across trials and the pruner can act after the first fold.
+    """
+    # cross_val_score(cv=5) on a regressor uses an unshuffled KFold
+    folds = list(KFold(n_splits=CV_FOLDS).split(X_train_scaled))
+
+    def objective(trial):
+        params = suggest_params(trial)
+        n_estimators = params.pop("n_estimators")
+        models = [RandomForestRegressor(warm_start=True, **params) for _ in folds]
+        score = None
+        for stage, fraction in enumerate(GROWTH_STAGES):
+            fold_scores = []
+            for f, ((train_idx, val_idx), model) in enumerate(zip(folds, models)):
+                # warm_start only fits the trees added since the previous stage
+                model.set_params(n_estimators=max(1, int(round(n_estimators * fraction))))
+                model.fit(X_train_scaled[train_idx], y_train[train_idx])
+                prediction = model.predict(X_train_scaled[val_idx])
+                fold_scores.append(-mean_squared_error(y_train[val_idx], prediction))
+                score = float(np.mean(fold_scores))
+                trial.report(score, stage * CV_FOLDS + f)
+                if trial.should_prune():
+                    raise optuna.TrialPruned()
+        return score
+
+    return objective
+
+
+def make_pruner():
+    return optuna.pruners.MedianPruner(n_startup_trials=5, n_warmup_steps=1)
+
+
+def data_fingerprint(X_train_scaled, y_train):
+    """Short hash of the training split, so stored studies never mix datasets."""
+    digest = hashlib.sha256()
+    for array in (X_train_scaled, y_train):
+        array = np.ascontiguousarray(array, dtype=np.float64)
+        digest.update(str(array.shape).encode())
+        digest.update(array.tobytes())
+    return digest.hexdigest()[:12]
+
+
+def run_search(X_train_scaled, y_train, mode="pruned", n_trials=40, storage=None,
+               study_name=DEFAULT_STUDY_NAME, timeout=None, enqueue=None):
+    """Run (or resume) a study; returns it. `storage=None` keeps it in memory.
+
+    A stored study is named `study_name`-<data fingerprint> and resumed only on
+    identical data. `enqueue` is a list of parameter dicts to evaluate first
+    (e.g. the previous best).
+    """
+    if mode == "pruned":
+        objective = pruned_objective(X_train_scaled, y_train)
+        pruner = make_pruner()
+    elif mode == "full":
+        objective = full_objective(X_train_scaled, y_train)
+        pruner = optuna.pruners.NopPruner()
+    else:
+        raise ValueError(f"Unknown search mode: {mode}")
+    study = optuna.create_study(
+        direction="maximize",
+        storage=storage,
+        study_name=f"{study_name}-{data_fingerprint(X_train_scaled, y_train)}" if storage else None,
+        load_if_exists=storage is not None,
+        pruner=pruner,
+        # Seeded only in memory (reproducible --compare runs); shared studies need distinct proposals
+        sampler=optuna.samplers.TPESampler(seed=42 if storage is None else None),
+    )
+    for params in enqueue or []:
+        study.enqueue_trial(params, skip_if_exists=True)
+    # With shared storage, count trials other processes already finished
+    done = len([t for t in study.trials if t.state.is_finished()])
+    remaining = max(0, n_trials - done)
+    if remaining:
+        study.optimize(objective, n_trials=remaining, timeout=timeout, show_progress_bar=True)
+    else:
+        print(f"Study '{study.study_name}' already has {done} finished trials on this data; "
+              f"running none (raise --trials to search further)")
+    return study
+
+
+def compare_searches(X_train_scaled, y_train, n_trials):
+    """Wall clock and best CV score of the original and the pruned search."""
+    results = {}
+    for mode in ("full", "pruned"):
+        start = time.perf_counter()
+        study = run_search(X_train_scaled, y_train, mode=mode, n_trials=n_trials)
+        elapsed = time.perf_counter() - start
+        pruned = len([t for t in study.trials if t.state == optuna.trial.TrialState.PRUNED])
+        results[mode] = elapsed
+        print(
+            f"{mode:>6}: {elapsed:8.1f} s for {n_trials} trials ({pruned} pruned), "
+            f"best CV MSE {-study.best_value:.4f}, params {study.best_params}"
+        )
+    print(f"speedup: {results['full'] / results['pruned']:.1f}x")
+
+
+# --- Final model ---
+
+
+def train_best(params, X_train_scaled, y_train):
+    best_params = dict(params, random_state=42, n_jobs=-1)
+    best_model = RandomForestRegressor(**best_params)
+    best_model.fit(X_train_scaled, y_train)
+    return best_model
+
+
+def evaluate(model, X_test_scaled, y_test):
+    y_pred = model.predict(X_test_scaled)
+    mse, r2 = mean_squared_error(y_test, y_pred), r2_score(y_test, y_pred)
+    print("Test set Mean Squared Error (MSE):", mse)
+    print("Test set R-squared (R2):", r2)
+    return {"mse": float(mse), "r2": float(r2)}
+
+
+def save_artifacts(model, scaler, out_dir=MODEL_DIR):
+    """Pickles plus the compact memory-mapped export the service prefers."""
+    os.makedirs(out_dir, exist_ok=True)
+    joblib.dump(model, os.path.join(out_dir, "stargazing_model.pkl"))
+    joblib.dump(scaler, os.path.join(out_dir, "stargazing_scaler.pkl"))
+    export_forest(model, scaler, os.path.join(out_dir, "stargazing_forest"))
+
+
+def plot_diagnostics(model, data, feature_names):
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    # Plot correlation heatmap
+    corr = data.corr()
+    plt.figure(figsize=(20, 16))
+    sns.heatmap(
+        corr,  # the correlation matrix
+        xticklabels=corr.columns,  # use column names on x‑axis
+        yticklabels=corr.columns,  # use column names on y‑axis
+        annot=True,  # write numeric value in each cell
+        fmt=".2f",  # format annotations to 2 decimal places
+        cmap="coolwarm",  # diverging color palette
+        linewidths=0.5,  # lines between cells
+    )
+    plt.xticks(rotation=45, ha="right")
+    plt.title("Correlation Heatmap")
+    plt.tight_layout()
+    plt.show()
+
+    # Plot feature importances
+    feature_importances = model.feature_importances_
+    indices = np.argsort(feature_importances)[::-1]
+    features = np.asarray(feature_names)[indices]
+    importances = feature_importances[indices]
+
+    plt.figure(figsize=(10, 6))
+    plt.title("Feature Importances")
+    plt.bar(range(len(importances)), importances, align="center")
+    plt.xticks(range(len(importances)), features, rotation=90)
+    plt.xlim([-1, len(importances)])
+    plt.tight_layout()
+    plt.show()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the stargazing sky-brightness model.")
+    parser.add_argument("--data", required=True, help="merged NSB/weather file (.parquet, .feather or .csv)")
+    parser.add_argument("--mode", choices=["pruned", "full"], default="pruned")
+    parser.add_argument("--trials", type=int, default=40)
+    parser.add_argument("--timeout", type=float, default=None, help="seconds")
+    parser.add_argument("--storage", default=DEFAULT_STORAGE, help="Optuna storage URL, '' for in-memory")
+    parser.add_argument("--study-name", default=DEFAULT_STUDY_NAME)
+    parser.add_argument("--out-dir", default=MODEL_DIR)
+    parser.add_argument("--compare", action="store_true", help="time the full vs pruned search and exit")
+    parser.add_argument("--plots", action="store_true")
+    args = parser.parse_args()
+
+    warnings.filterwarnings("ignore", category=UserWarning)
+    X, y, data = load_training_data(args.data)
+    X_train_scaled, X_test_scaled, y_train, y_test, scaler = split_and_scale(X, y)
+
+    if args.compare:
+        compare_searches(X_train_scaled, y_train, args.trials)
+        return
+
+    if args.storage.startswith("sqlite:///"):
+        os.makedirs(os.path.dirname(os.path.abspath(args.storage[len("sqlite:///"):])), exist_ok=True)
+    study = run_search(
+        X_train_scaled, y_train, mode=args.mode, n_trials=args.trials,
+        storage=args.storage or None, study_name=args.study_name, timeout=args.timeout,
     )
-    return scores.mean()
-
-
-study = optuna.create_study(direction="maximize")
-study.optimize(objective, n_trials=40, show_progress_bar=True)
-
-print("Best trial:")
-print(study.best_trial)
-
-# Train best model on full training set
-best_params = study.best_trial.params
-best_params["random_state"] = 42
-best_params["n_jobs"] = -1
-best_model = RandomForestRegressor(**best_params)
-best_model.fit(X_train_scaled, y_train)
-
-# Evaluate on test set
-y_pred = best_model.predict(X_test_scaled)
-print("Test set Mean Squared Error (MSE):", mean_squared_error(y_test, y_pred))
-print("Test set R-squared (R2):", r2_score(y_test, y_pred))
-
-# Feature importances
-importances = best_model.feature_importances_
-feature_names = X.columns
-feat_imp = pd.Series(importances, index=feature_names).sort_values(ascending=False)
-print("\nTop 10 Feature Importances:")
-print(feat_imp.head(10))
-
-# Save model and scaler
-print("Saving best model and scaler...")
-joblib.dump(best_model, f"{script_dir}/stargazing_model.pkl")
-joblib.dump(scaler, f"{script_dir}/stargazing_scaler.pkl")
-
-# Plot correlation heatmap
-corr = data.corr()
-plt.figure(figsize=(20, 16))
-sns.heatmap(
-    corr,  # the correlation matrix
-    xticklabels=corr.columns,  # use column names on x‑axis
-    yticklabels=corr.columns,  # use column names on y‑axis
-    annot=True,  # write numeric value in each cell
-    fmt=".2f",  # format annotations to 2 decimal places
-    cmap="coolwarm",  # diverging color palette
-    linewidths=0.5,  # lines between cells
-)
-plt.xticks(rotation=45, ha="right")
-# plt.savefig(f"{script_dir}/correlation_heatmap.png", dpi=300, bbox_inches="tight")
-plt.title("Correlation Heatmap")
-plt.tight_layout()
-plt.show()
-
-# Plot feature importances
-feature_importances = model.feature_importances_
-indices = np.argsort(feature_importances)[::-1]
-features = X.columns[indices]
-importances = feature_importances[indices]
-
-plt.figure(figsize=(10, 6))
-plt.title("Feature Importances")
-plt.bar(range(len(importances)), importances, align="center")
-plt.xticks(range(len(importances)), features, rotation=90)
-plt.xlim([-1, len(importances)])
-plt.tight_layout()
-# plt.savefig(f"{script_dir}/feature_importances.png", dpi=300, bbox_inches="tight")
-plt.show()
+    print("Best trial:")
+    print(study.best_trial)
+
+    # Train best model on full training set
+    best_model = train_best(study.best_trial.params, X_train_scaled, y_train)
+    evaluate(best_model, X_test_scaled, y_test)
+
+    # Feature importances
+    feat_imp = pd.Series(best_model.feature_importances_, index=X.columns).sort_values(ascending=False)
+    print("\nTop 10 Feature Importances:")
+    print(feat_imp.head(10))
+
+    print("Saving best model and scaler...")
+    save_artifacts(best_model, scaler, args.out_dir)
+
+    if args.plots:
+        plot_diagnostics(best_model, data, X.columns)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,165 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+from .forecast_cache import ForecastCache
+from .open_meteo import fetch_ensemble_async
+from .stargazing_service import (
+    BASE_DIR,
+    FORECAST_TTL,
+    compute_7day_stargazing_forecast,
+    forecast_from_ensemble,
+)
+
+# Dark-sky spots inside the frontend's light-pollution map (21.95-22.75N, 113.5-114.69E)
+SITE_SETS = {
+    "hk_dark_sky": [
+        {"id": "wan_tsai", "name": "Sai Kung Wan Tsai (Dark Sky Park)", "lat": 22.388, "lon": 114.370},
+        {"id": "tai_long_wan", "name": "Tai Long Wan", "lat": 22.411, "lon": 114.381},
+        {"id": "high_island", "name": "High Island Reservoir East Dam", "lat": 22.361, "lon": 114.371},
+        {"id": "tung_ping_chau", "name": "Tung Ping Chau", "lat": 22.545, "lon": 114.430},
+        {"id": "tai_mo_shan", "name": "Tai Mo Shan", "lat": 22.410, "lon": 114.124},
+        {"id": "ha_pak_nai", "name": "Ha Pak Nai", "lat": 22.437, "lon": 113.947},
+        {"id": "ngong_ping", "name": "Ngong Ping, Lantau", "lat": 22.256, "lon": 113.905},
+        {"id": "shek_pik", "name": "Shek Pik Reservoir, Lantau", "lat": 22.225, "lon": 113.889},
+        {"id": "cape_d_aguilar", "name": "Cape D'Aguilar", "lat": 22.209, "lon": 114.259},
+    ],
+}
+
+MAX_SITES = 20
+# Ad-hoc coordinate sites are cached in memory only, up to this many
+MAX_CACHED_SITES = 64
+
+_site_caches = OrderedDict()
+_inflight = {}
+
+
+def parse_sites(sites=None, site_set=None):
+    """Sites from a named set and/or a "lat,lon;lat,lon" list."""
+    selected = []
+    if site_set:
+        if site_set not in SITE_SETS:
+            raise ValueError(f"Unknown site set '{site_set}', choose from: {', '.join(SITE_SETS)}")
+        selected.extend(SITE_SETS[site_set])
+    for part in (sites or "").split(";"):
+        if not part.strip():
+            continue
+        try:
+            lat, lon = (float(v) for v in part.split(","))
+        except ValueError:
+            raise ValueError(f"Invalid site '{part}', expected 'lat,lon'")
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"Site '{part}' is out of range")
+        site_id = f"{lat:.3f},{lon:.3f}"
+        selected.append({"id": site_id, "name": site_id, "lat": lat, "lon": lon})
+    if not selected:
+        raise ValueError("No sites given")
+    if len(selected) > MAX_SITES:
+        raise ValueError(f"At most {MAX_SITES} sites per request")
+    return selected
+
+
+def _is_named(site):
+    return any(site in sites for sites in SITE_SETS.values())
+
+
+def site_cache(site):
+    """Per-site forecast cache; named sites also persist to disk."""
+    cache = _site_caches.get(site["id"])
+    if cache is None:
+        cache_path = None
+        if _is_named(site):
+            cache_path = os.path.join(BASE_DIR, "data", f"forecast_cache_{site['id']}.json")
+        cache = ForecastCache(
+            lambda: compute_7day_stargazing_forecast(site["lat"], site["lon"]),
+            ttl=FORECAST_TTL,
+            cache_path=cache_path,
+            name=f"forecast-{site['id']}",
+        )
+        _site_caches[site["id"]] = cache
+        while len(_site_caches) > MAX_CACHED_SITES:
+            _site_caches.popitem(last=False)
+    _site_caches.move_to_end(site["id"])
+    return cache
+
+
+async def _fetch_site(site):
+    data = await fetch_ensemble_async(site["lat"], site["lon"])
+    # Aggregation and prediction are CPU work; keep them off the event loop
+    forecast = await asyncio.to_thread(forecast_from_ensemble, data)
+    site_cache(site).store(forecast)
+    return forecast
+
+
+def _fetch_done(key, task):
+    _inflight.pop(key, None)
+    # Retrieve the outcome so a failed background refresh nobody awaited is not reported as lost
+    if not task.cancelled():
+        task.exception()
+
+
+def _fetch_once(site):
+    """One upstream fetch per site at a time, shared by concurrent requests.
+
+    Callers await it through asyncio.shield, so a client that disconnects
+    cancels only its own wait, not the fetch other requests share.
+    """
+    task = _inflight.get(site["id"])
+    if task is None:
+        task = asyncio.ensure_future(_fetch_site(site))
+        _inflight[site["id"]] = task
+        task.add_done_callback(lambda t, key=site["id"]: _fetch_done(key, t))
+    return task
+
+
+def rank_sites(site_forecasts):
+    """For each night, sites ordered darkest first (ties broken by less cloud)."""
+    by_date = {}
+    for site in site_forecasts:
+        for day in site["forecast"]:
+            by_date.setdefault(day["date"], []).append(
+                {
+                    "id": site["id"],
+                    "name": site["name"],
+                    "mpsas": day["mpsas"],
+                    "bortle": day["bortle"],
+                    "cloud_cover_mean": day["cloud_cover_mean"],
+                }
+            )
+    ranking = []
+    for date in sorted(by_date):
+        entries = sorted(by_date[date], key=lambda e: (-e["mpsas"], e["cloud_cover_mean"]))
+        ranking.append({"date": date, "best_site": entries[0]["id"], "sites": entries})
+    return ranking
+
+
+async def get_multi_site_forecast(sites=None, site_set=None):
+    selected = parse_sites(sites, site_set)
+
+    missing = []
+    for site in selected:
+        cache = site_cache(site)
+        if cache.is_fresh():
+            continue
+        # Stale sites are refreshed by the same single-flight fetch, without waiting for it
+        task = _fetch_once(site)
+        if not cache.has_value():
+            missing.append((site, task))
+
+    outcomes = await asyncio.gather(
+        *(asyncio.shield(task) for _, task in missing), return_exceptions=True
+    )
+    missing = [site for site, _ in missing]
+    errors = {
+        site["id"]: str(outcome)
+        for site, outcome in zip(missing, outcomes)
+        if isinstance(outcome, Exception)
+    }
+
+    site_forecasts = []
+    for site in selected:
+        entry = dict(site, forecast=site_cache(site).value or [])
+        if site["id"] in errors:
+            entry["error"] = errors[site["id"]]
+        site_forecasts.append(entry)
+    return {"sites": site_forecasts, "ranking": rank_sites(site_forecasts)}
@@ -0,0 +1,370 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from collections import OrderedDict, deque
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+# Open-Meteo ensemble API; overridable to point at a local stub server
+ENSEMBLE_URL = os.environ.get(
+    "OPEN_METEO_ENSEMBLE_URL", "https://ensemble-api.open-meteo.com/v1/ensemble"
+)
+
+DAILY_VARIABLES = [
+    "temperature_2m_mean",
+    "temperature_2m_min",
+    "temperature_2m_max",
+    "apparent_temperature_mean",
+    "apparent_temperature_min",
+    "apparent_temperature_max",
+    "wind_speed_10m_mean",
+    "wind_speed_10m_min",
+    "wind_speed_10m_max",
+    "wind_direction_10m_dominant",
+    "relative_humidity_2m_mean",
+    "relative_humidity_2m_max",
+    "relative_humidity_2m_min",
+    "wind_gusts_10m_mean",
+    "wind_gusts_10m_min",
+    "wind_gusts_10m_max",
+    "cloud_cover_mean",
+    "cloud_cover_min",
+    "precipitation_sum",
+    "precipitation_hours",
+    "rain_sum",
+    "pressure_msl_mean",
+    "pressure_msl_min",
+    "pressure_msl_max",
+    "surface_pressure_min",
+    "surface_pressure_mean",
+    "surface_pressure_max",
+    "dew_point_2m_mean",
+    "dew_point_2m_min",
+    "dew_point_2m_max",
+    "et0_fao_evapotranspiration",
+    "shortwave_radiation_sum",
+    "cloud_cover_max",
+]
+
+CONNECT_TIMEOUT = float(os.environ.get("OPEN_METEO_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.environ.get("OPEN_METEO_READ_TIMEOUT", "20"))
+MAX_RETRIES = int(os.environ.get("OPEN_METEO_MAX_RETRIES", "2"))
+# Consecutive failed fetches before we stop calling upstream for BREAKER_RESET seconds
+BREAKER_THRESHOLD = int(os.environ.get("OPEN_METEO_BREAKER_THRESHOLD", "3"))
+BREAKER_RESET = float(os.environ.get("OPEN_METEO_BREAKER_RESET", "300"))
+# Statuses worth retrying; anything else non-200 fails immediately
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Locations whose last 200 response is kept for conditional requests
+MAX_CACHED_RESPONSES = 64
+
+
+def ensemble_params(lat, lon):
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "daily": ",".join(DAILY_VARIABLES),
+        "models": "ecmwf_ifs025",
+        "timezone": "auto",
+        "wind_speed_unit": "ms",
+    }
+
+
+class UpstreamError(Exception):
+    pass
+
+
+class CircuitOpenError(UpstreamError):
+    pass
+
+
+def backoff_delay(attempt, base=0.5, cap=8.0):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+
+class CircuitBreaker:
+    """Stops calling a failing upstream; callers fall back to their last good cache.
+
+    After `threshold` consecutive failures the breaker opens for `reset_after`
+    seconds, then lets a single trial request through (half-open). Success
+    closes it again; failure re-opens it. Only the call that took the trial
+    slot releases it, so calls already in flight cannot let a second trial through.
+    """
+
+    def __init__(self, threshold=BREAKER_THRESHOLD, reset_after=BREAKER_RESET):
+        self.threshold = threshold
+        self.reset_after = reset_after
+        self._failures = 0
+        self._opened_at = None
+        self._trial_running = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self._opened_at is None:
+            return "closed"
+        if time.monotonic() - self._opened_at >= self.reset_after:
+            return "half-open"
+        return "open"
+
+    def allow(self):
+        """(allowed, trial): `trial` is True when this call took the half-open trial slot."""
+        with self._lock:
+            state = self.state
+            if state == "closed":
+                return True, False
+            if state == "half-open" and not self._trial_running:
+                self._trial_running = True
+                return True, True
+            return False, False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._opened_at is not None or self._failures >= self.threshold:
+                self._opened_at = time.monotonic()
+
+    def release_trial(self):
+        """Free the half-open trial slot; called by the trial call however it ended."""
+        with self._lock:
+            self._trial_running = False
+
+
+class UpstreamMetrics:
+    """Counters and recent latencies of Open-Meteo calls."""
+
+    def __init__(self, window=200):
+        self.requests = 0
+        self.failures = 0
+        self.retries = 0
+        self.not_modified = 0
+        self.short_circuited = 0
+        self._latencies = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def observe(self, seconds):
+        with self._lock:
+            self.requests += 1
+            self._latencies.append(seconds)
+
+    def count(self, name):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self._latencies)
+        summary = {
+            "requests": self.requests,
+            "failures": self.failures,
+            "retries": self.retries,
+            "not_modified": self.not_modified,
+            "short_circuited": self.short_circuited,
+        }
+        if latencies:
+            summary["latency_ms"] = {
+                "last": round(self._latencies[-1] * 1000, 1),
+                "p50": round(latencies[len(latencies) // 2] * 1000, 1),
+                "p95": round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] * 1000, 1),
+                "max": round(latencies[-1] * 1000, 1),
+            }
+        return summary
+
+
+breaker = CircuitBreaker()
+metrics = UpstreamMetrics()
+
+# Last 200 response per query, for conditional (If-None-Match / If-Modified-Since) requests;
+# least recently used first, capped at MAX_CACHED_RESPONSES
+_validators = OrderedDict()
+_validators_lock = threading.Lock()
+
+
+def _cache_key(params):
+    return tuple(sorted(params.items()))
+
+
+def _conditional_headers(key):
+    headers = {"Accept-Encoding": "gzip, deflate"}
+    with _validators_lock:
+        cached = _validators.get(key)
+        if cached:
+            _validators.move_to_end(key)
+    if cached:
+        if cached["etag"]:
+            headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            headers["If-Modified-Since"] = cached["last_modified"]
+    return headers
+
+
+def _handle_response(key, status_code, headers, json_fn):
+    """Body for a 200/304, or an UpstreamError saying whether to retry."""
+    if status_code == 200:
+        try:
+            data = json_fn()
+        except ValueError:
+            # e.g. an HTML error page from a proxy; a failure like any bad status
+            error = UpstreamError("Open-Meteo returned a non-JSON body")
+            error.retryable = True
+            return None, error
+        etag, last_modified = headers.get("ETag"), headers.get("Last-Modified")
+        if etag or last_modified:
+            with _validators_lock:
+                _validators[key] = {"etag": etag, "last_modified": last_modified, "data": data}
+                _validators.move_to_end(key)
+                while len(_validators) > MAX_CACHED_RESPONSES:
+                    _validators.popitem(last=False)
+        return data, None
+    if status_code == 304:
+        with _validators_lock:
+            cached = _validators.get(key)
+        if cached:
+            metrics.count("not_modified")
+            return cached["data"], None
+    error = UpstreamError(f"Open-Meteo returned HTTP {status_code}")
+    error.retryable = status_code in RETRY_STATUSES
+    return None, error
+
+
+def _before_request():
+    """Whether this call is the half-open trial; raises CircuitOpenError when short-circuited."""
+    allowed, trial = breaker.allow()
+    if not allowed:
+        metrics.count("short_circuited")
+        raise CircuitOpenError("Open-Meteo circuit is open after repeated failures")
+    return trial
+
+
+def _after_failure(error):
+    breaker.record_failure()
+    metrics.count("failures")
+    raise error
+
+
+# --- Sync client (single-site forecast, background refreshes) ---
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Shared keep-alive session for the threads that refresh forecasts."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=10, max_retries=0)
+            _session.mount("https://", adapter)
+            _session.mount("http://", adapter)
+        return _session
+
+
+def close_session():
+    global _session
+    with _session_lock:
+        if _session is not None:
+            _session.close()
+            _session = None
+
+
+def fetch_ensemble(lat, lon, retries=MAX_RETRIES):
+    """Ensemble forecast JSON for one location; raises UpstreamError on failure."""
+    trial = _before_request()
+    params = ensemble_params(lat, lon)
+    key = _cache_key(params)
+    try:
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                response = get_session().get(
+                    ENSEMBLE_URL,
+                    params=params,
+                    headers=_conditional_headers(key),
+                    timeout=(CONNECT_TIMEOUT, READ_TIMEOUT),
+                )
+            except requests.RequestException as e:
+                error = UpstreamError(f"Open-Meteo request failed: {e}")
+                error.retryable = True
+            else:
+                metrics.observe(time.perf_counter() - start)
+                data, error = _handle_response(key, response.status_code, response.headers, response.json)
+                if error is None:
+                    breaker.record_success()
+                    return data
+            if not error.retryable or attempt == retries:
+                break
+            metrics.count("retries")
+            time.sleep(backoff_delay(attempt))
+        _after_failure(error)
+    finally:
+        # Never leave a half-open trial marked as running, whatever ended the call
+        if trial:
+            breaker.release_trial()
+
+
+# --- Async client (concurrent multi-site fetches) ---
+
+_async_client = None
+
+
+def get_async_client():
+    """Shared pooled client, so connections to Open-Meteo are reused across requests."""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+            limits=httpx.Limits(max_connections=10, max_keepalive_connections=10),
+        )
+    return _async_client
+
+
+async def close_async_client():
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+async def fetch_ensemble_async(lat, lon, retries=MAX_RETRIES):
+    trial = _before_request()
+    params = ensemble_params(lat, lon)
+    key = _cache_key(params)
+    client = get_async_client()
+    try:
+        for attempt in range(retries + 1):
+            start = time.perf_counter()
+            try:
+                response = await client.get(
+                    ENSEMBLE_URL, params=params, headers=_conditional_headers(key)
+                )
+            except httpx.TransportError as e:
+                error = UpstreamError(f"Open-Meteo request failed: {e}")
+                error.retryable = True
+            else:
+                metrics.observe(time.perf_counter() - start)
+                data, error = _handle_response(key, response.status_code, response.headers, response.json)
+                if error is None:
+                    breaker.record_success()
+                    return data
+            if not error.retryable or attempt == retries:
+                break
+            metrics.count("retries")
+            await asyncio.sleep(backoff_delay(attempt))
+        _after_failure(error)
+    finally:
+        # Also runs on CancelledError, so a cancelled trial cannot wedge the breaker half-open
+        if trial:
+            breaker.release_trial()
+
+
+def upstream_status():
+    return {"circuit": breaker.state, **metrics.snapshot()}
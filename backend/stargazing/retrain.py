@@ -0,0 +1,261 @@
+"""Incremental retraining of the stargazing model.
+
+    python -m stargazing.retrain ingest --nsb nsb_sun_moon.csv --weather history_weather.csv
+    python -m stargazing.retrain train            # refit if the data changed
+    python -m stargazing.retrain train --search   # also re-run the hyperparameter search
+
+`ingest` upserts merged NSB/weather rows into a store partitioned by month
+(data/training_store/YYYY-MM.parquet, one row per night, newest row wins)
+and records a content hash per partition in manifest.json. Re-ingesting the
+full exports only rewrites the months whose rows actually changed, e.g. new
+nights or weather history that arrived late.
+
+`train` compares the manifest with the one the current model was trained on.
+If nothing changed it stops; otherwise it refits with the stored best
+hyperparameters, and re-runs the Optuna search only when asked or when the
+last search is older than SEARCH_INTERVAL_DAYS. Each run writes a new
+model/versions/vNNNN (pickles, compact forest, meta.json) and then points
+model/LATEST at it; the service loads whatever LATEST names on its next
+forecast, without a restart.
+
+Training needs more than the API does; install requirements-train.txt
+(optuna for the search, pyarrow for the Parquet store).
+"""
+import argparse
+import hashlib
+import json
+import os
+import tempfile
+from datetime import datetime, timedelta
+import pandas as pd
+
+# Only the package/script choice is conditional: a missing optuna or pyarrow must
+# surface as itself, not as a failed fallback import
+if __package__:
+    from . import data_prep
+    from .model_training import (
+        DEFAULT_STORAGE,
+        DEFAULT_STUDY_NAME,
+        MODEL_DIR,
+        evaluate,
+        run_search,
+        save_artifacts,
+        split_and_scale,
+        train_best,
+    )
+    from .features import TARGET_COLUMN, TRAINING_COLUMNS
+else:  # run as a script from this folder
+    import data_prep
+    from model_training import (
+        DEFAULT_STORAGE,
+        DEFAULT_STUDY_NAME,
+        MODEL_DIR,
+        evaluate,
+        run_search,
+        save_artifacts,
+        split_and_scale,
+        train_best,
+    )
+    from features import TARGET_COLUMN, TRAINING_COLUMNS
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORE_DIR = os.path.join(BASE_DIR, "data", "training_store")
+MANIFEST_PATH = os.path.join(STORE_DIR, "manifest.json")
+VERSIONS_DIR = os.path.join(MODEL_DIR, "versions")
+LATEST_PATH = os.path.join(MODEL_DIR, "LATEST")
+SEARCH_INTERVAL_DAYS = 30
+SEARCH_TRIALS = 40
+
+
+def _publish(temp_path, path):
+    """Rename a finished temp file over `path`, readable like a normally created file.
+
+    mkstemp files are 0600; left that way, an API running as another user would
+    fail to read LATEST and quietly keep serving the old model.
+    """
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp_path, 0o666 & ~umask)
+    os.replace(temp_path, path)
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".retrain_", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=2)
+    _publish(temp_path, path)
+
+
+def _read_json(path, default=None):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+# --- Partitioned store ---
+
+
+def partition_hash(df):
+    return hashlib.sha256(pd.util.hash_pandas_object(df, index=False).values.tobytes()).hexdigest()
+
+
+def partition_path(partition):
+    return os.path.join(STORE_DIR, f"{partition}.parquet")
+
+
+def load_manifest():
+    return _read_json(MANIFEST_PATH, {})
+
+
+def ingest(merged):
+    """Upsert merged rows into their month partitions; returns the partitions that changed."""
+    merged = merged.dropna(subset=["Date"])
+    manifest = load_manifest()
+    changed = []
+    for partition, rows in merged.groupby(merged["Date"].str[:7]):
+        path = partition_path(partition)
+        if os.path.exists(path):
+            rows = pd.concat([data_prep.read_frame(path), rows], ignore_index=True)
+        rows = (
+            rows.drop_duplicates(subset=["Date"], keep="last")
+            .sort_values("Date")
+            .reset_index(drop=True)
+        )
+        digest = partition_hash(rows)
+        if manifest.get(partition) == digest:
+            continue
+        data_prep.write_frame(rows, path)
+        manifest[partition] = digest
+        changed.append(partition)
+    if changed:
+        _write_json(MANIFEST_PATH, dict(sorted(manifest.items())))
+    return changed
+
+
+def load_store():
+    partitions = sorted(load_manifest())
+    if not partitions:
+        raise FileNotFoundError(f"No training data in {STORE_DIR}; run `ingest` first")
+    return pd.concat([data_prep.read_frame(partition_path(p)) for p in partitions], ignore_index=True)
+
+
+# --- Versions ---
+
+
+def latest_version():
+    """Name of the version LATEST points to, or None."""
+    try:
+        with open(LATEST_PATH, encoding="utf-8") as f:
+            version = f.read().strip()
+    except OSError:
+        return None
+    return version if os.path.isdir(os.path.join(VERSIONS_DIR, version)) else None
+
+
+def version_meta(version):
+    if version is None:
+        return {}
+    return _read_json(os.path.join(VERSIONS_DIR, version, "meta.json"), {})
+
+
+def next_version():
+    existing = [
+        int(name[1:]) for name in os.listdir(VERSIONS_DIR)
+        if name.startswith("v") and name[1:].isdigit()
+    ] if os.path.isdir(VERSIONS_DIR) else []
+    return f"v{max(existing, default=0) + 1:04d}"
+
+
+def promote(version):
+    """Point LATEST at `version` with an atomic rename, so readers never see a partial file."""
+    fd, temp_path = tempfile.mkstemp(dir=MODEL_DIR, prefix=".latest_", suffix=".tmp")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(version + "\n")
+    _publish(temp_path, LATEST_PATH)
+
+
+def search_due(meta, now):
+    searched_at = meta.get("searched_at")
+    if not meta.get("params") or not searched_at:
+        return True
+    return now - datetime.fromisoformat(searched_at) >= timedelta(days=SEARCH_INTERVAL_DAYS)
+
+
+def train(search=False, force=False, trials=SEARCH_TRIALS, storage=DEFAULT_STORAGE):
+    """Train a new version if the store changed (or `force`); returns its name or None."""
+    now = datetime.now()
+    manifest = load_manifest()
+    current = latest_version()
+    meta = version_meta(current)
+    changed = sorted(p for p, digest in manifest.items() if meta.get("manifest", {}).get(p) != digest)
+    if not changed and not force:
+        print(f"Training data unchanged since {current}; nothing to do.")
+        return None
+    print(f"Changed partitions: {', '.join(changed) or 'none (forced)'}")
+
+    data = data_prep.prepare_training_frame(load_store())
+    X, y = data[TRAINING_COLUMNS], data[TARGET_COLUMN].values.ravel()
+    X_train_scaled, X_test_scaled, y_train, y_test, scaler = split_and_scale(X, y)
+
+    params, searched_at = meta.get("params"), meta.get("searched_at")
+    if search or search_due(meta, now):
+        if storage.startswith("sqlite:///"):
+            os.makedirs(os.path.dirname(os.path.abspath(storage[len("sqlite:///"):])), exist_ok=True)
+        study = run_search(
+            X_train_scaled, y_train, mode="pruned", n_trials=trials, storage=storage,
+            # A fresh study per search: the data (and so the scores) changed since the last one
+            study_name=f"{DEFAULT_STUDY_NAME}-{now:%Y%m%d-%H%M%S}",
+            enqueue=[params] if params else None,
+        )
+        params, searched_at = study.best_params, now.isoformat(timespec="seconds")
+    else:
+        print(f"Refitting with the hyperparameters searched at {searched_at}")
+
+    model = train_best(params, X_train_scaled, y_train)
+    metrics = evaluate(model, X_test_scaled, y_test)
+
+    version = next_version()
+    out_dir = os.path.join(VERSIONS_DIR, version)
+    save_artifacts(model, scaler, out_dir)
+    _write_json(os.path.join(out_dir, "meta.json"), {
+        "version": version,
+        "trained_at": now.isoformat(timespec="seconds"),
+        "searched_at": searched_at,
+        "params": params,
+        "metrics": metrics,
+        "rows": int(len(data)),
+        "previous": current,
+        "manifest": manifest,
+    })
+    promote(version)
+    print(f"Promoted {version} (previous: {current})")
+    return version
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Incremental retraining of the stargazing model.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    ingest_parser = commands.add_parser("ingest", help="upsert new NSB/weather rows into the store")
+    ingest_parser.add_argument("--nsb", required=True)
+    ingest_parser.add_argument("--weather", required=True)
+    train_parser = commands.add_parser("train", help="train a new version if the store changed")
+    train_parser.add_argument("--search", action="store_true", help="re-run the hyperparameter search")
+    train_parser.add_argument("--force", action="store_true", help="train even if nothing changed")
+    train_parser.add_argument("--trials", type=int, default=SEARCH_TRIALS)
+    train_parser.add_argument("--storage", default=DEFAULT_STORAGE)
+    args = parser.parse_args()
+
+    if args.command == "ingest":
+        merged = data_prep.merge_nsb_weather(data_prep.load_nsb(args.nsb), data_prep.load_weather(args.weather))
+        changed = ingest(merged)
+        print(f"Updated partitions: {', '.join(changed) or 'none'}")
+    else:
+        train(search=args.search, force=args.force, trials=args.trials, storage=args.storage)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,21 @@
-import requests
-import statistics
-import csv
-from datetime import datetime
 import numpy as np
 import joblib
 import warnings
 import os
-import json
+import threading
+
+if __package__:
+    from . import ephemeris
+    from .compact_forest import CompactForest, is_exported
+    from .features import build_feature_matrix
+    from .forecast_cache import ForecastCache
+    from .open_meteo import UpstreamError, fetch_ensemble
+else:  # run as a script from this folder
+    import ephemeris
+    from compact_forest import CompactForest, is_exported
+    from features import build_feature_matrix
+    from forecast_cache import ForecastCache
+    from open_meteo import UpstreamError, fetch_ensemble
 
 warnings.filterwarnings("ignore", category=UserWarning)
 
@@ -52,84 +61,79 @@ VAR_METHOD = {
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
 
 CACHE_PATH = os.path.join(BASE_DIR, "data", "forecast_cache.json")
-SUN_CSV = os.path.join(BASE_DIR, "data", "Sun_rise_set_2025.csv")
-MOON_CSV = os.path.join(BASE_DIR, "data", "Moon_rise_set_2025.csv")
 MODEL_PATH = os.path.join(BASE_DIR, "model", "stargazing_model.pkl")
+# Seconds a forecast is served without refreshing
+FORECAST_TTL = float(os.environ.get("STARGAZING_CACHE_TTL", str(6 * 3600)))
+# Default forecast location (Tsim Sha Tsui)
+DEFAULT_LAT = 22.311724466022362
+DEFAULT_LON = 114.17319166264973
 SCALER_PATH = os.path.join(BASE_DIR, "model", "stargazing_scaler.pkl")
+# Flat export of the model with the scaler folded in (see compact_forest.py)
+FOREST_DIR = os.path.join(BASE_DIR, "model", "stargazing_forest")
+# Names the retrained version in model/versions/ to serve (written by retrain.py)
+LATEST_PATH = os.path.join(BASE_DIR, "model", "LATEST")
+VERSIONS_DIR = os.path.join(BASE_DIR, "model", "versions")
 
+_models_lock = threading.Lock()
+_loaded_models = {"dir": None, "models": None}
+
+
+def index_member_keys(daily):
+    """Map each variable name to its `<var>_memberNN` keys in one pass over `daily`."""
+    members = {}
+    for key in daily:
+        base, sep, _ = key.rpartition("_member")
+        if sep:
+            members.setdefault(base, []).append(key)
+    return members
 
-def process_ensemble_grouped(data):
-    import math
 
+def process_ensemble_grouped(data):
     if isinstance(data, list):
         data = data[0]
     daily = data["daily"]
     daily_units = data.get("daily_units", {})
     dates = daily["time"]
     date_dict = {date: {"date": date} for date in dates}
+    members = index_member_keys(daily)
     for var, method in VAR_METHOD.items():
-        member_keys = [k for k in daily if k.startswith(var + "_member")]
         det_key = f"{var}_icon_seamless"
+        keys = list(members.get(var, []))
+        if det_key in daily:
+            keys.append(det_key)
+        if not keys:
+            continue
         unit = daily_units.get(det_key) or daily_units.get(var) or ""
-        for idx, date in enumerate(dates):
-            values = []
-            for mk in member_keys:
-                values.append(daily[mk][idx])
-            if det_key in daily:
-                values.append(daily[det_key][idx])
-            values = [
-                v
-                for v in values
-                if v is not None and not (isinstance(v, float) and math.isnan(v))
-            ]
-            if not values:
-                continue
+        # (members x days); None becomes NaN and is skipped like before
+        values = np.array([daily[k] for k in keys], dtype=float)
+        has_value = (~np.isnan(values)).any(axis=0)
+        with warnings.catch_warnings():
+            # All-NaN days are skipped below; silence "empty slice" warnings for them
+            warnings.simplefilter("ignore", RuntimeWarning)
             if method == "mean":
-                value = float(statistics.mean(values))
+                combined = np.nanmean(values, axis=0)
             else:
-                value = float(statistics.median(values))
-            date_dict[date][var] = value
+                combined = np.nanmedian(values, axis=0)
+        for idx, date in enumerate(dates):
+            if not has_value[idx]:
+                continue
+            date_dict[date][var] = float(combined[idx])
             date_dict[date][f"{var}_unit"] = unit
     return list(date_dict.values())
 
 
-def load_times_csv(filepath):
-    times = {}
-    with open(filepath, newline="", encoding="utf-8-sig") as csvfile:
-        reader = csv.DictReader(csvfile, delimiter=",")
-        for row in reader:
-            date_key = list(row.keys())[0]
-            date_obj = datetime.strptime(row[date_key].strip(), "%Y-%m-%d")
-            date_str = date_obj.strftime("%Y-%m-%d")
-            times[date_str] = {
-                "rise": row["RISE"].strip(),
-                "transit": row["TRAN."].strip(),
-                "set": row["SET"].strip(),
-            }
-    return times
-
-
-def merge_astronomy_grouped(processed_weather, sun_times, moon_times):
+def merge_astronomy_grouped(
+    processed_weather, lat=DEFAULT_LAT, lon=DEFAULT_LON, utc_offset_minutes=ephemeris.HK_UTC_OFFSET_MINUTES
+):
+    """Add sun/moon rise, transit and set (minutes since local midnight) and moon illumination."""
+    astronomy = ephemeris.astronomy_for_dates(
+        [entry["date"] for entry in processed_weather], lat, lon, utc_offset_minutes
+    )
     for entry in processed_weather:
-        date = entry["date"]
-        if date in sun_times:
-            entry["sun_rise"] = sun_times[date]["rise"]
-            entry["sun_transit"] = sun_times[date]["transit"]
-            entry["sun_set"] = sun_times[date]["set"]
-        if date in moon_times:
-            entry["moon_rise"] = moon_times[date]["rise"]
-            entry["moon_transit"] = moon_times[date]["transit"]
-            entry["moon_set"] = moon_times[date]["set"]
+        entry.update(astronomy[entry["date"]])
     return processed_weather
 
 
-def time_to_minutes(tstr):
-    if not tstr or tstr in ["", None]:
-        return -1
-    h, m = map(int, tstr.split(":"))
-    return h * 60 + m
-
-
 def mpsas_to_bortle(mpsas):
     if mpsas >= 21.99:
         return "1"
@@ -163,106 +167,90 @@ def mpsas_to_bortle(mpsas):
         return "8-9"
 
 
-def is_cache_today(cache_path):
-    if not os.path.exists(cache_path):
-        return False
+def predict_mpsas(model, scaler, entries):
+    """Predicted MPSAS for every entry, scaled and predicted as one matrix.
+
+    `scaler` is None for a compact forest, which has it folded into its thresholds.
+    """
+    if not entries:
+        return np.empty(0)
+    X = build_feature_matrix(entries)
+    if scaler is not None:
+        X = scaler.transform(X)
+    return model.predict(X)
+
+
+def preload_ephemeris():
+    """Build/load this year's and next year's ephemeris for the default location."""
+    ephemeris.preload(DEFAULT_LAT, DEFAULT_LON)
+
+
+def current_model_dir():
+    """The version directory LATEST points to, or model/ itself before any retrain."""
     try:
-        with open(cache_path, "r", encoding="utf-8") as f:
-            cache = json.load(f)
-        today = datetime.now().strftime("%Y-%m-%d")
-        if cache and isinstance(cache, list) and "date" in cache[0]:
-            return cache[0]["date"] == today
-        return False
-    except Exception:
-        return False
+        with open(LATEST_PATH, encoding="utf-8") as f:
+            version_dir = os.path.join(VERSIONS_DIR, f.read().strip())
+    except OSError:
+        return os.path.dirname(MODEL_PATH)
+    return version_dir if os.path.isdir(version_dir) else os.path.dirname(MODEL_PATH)
 
 
-def save_cache(cache_path, data):
-    with open(cache_path, "w", encoding="utf-8") as f:
-        json.dump(data, f, ensure_ascii=False, indent=2)
+def _load_model_dir(model_dir):
+    forest_dir = os.path.join(model_dir, os.path.basename(FOREST_DIR))
+    if is_exported(forest_dir):
+        return CompactForest.load(forest_dir), None
+    return (
+        joblib.load(os.path.join(model_dir, os.path.basename(MODEL_PATH))),
+        joblib.load(os.path.join(model_dir, os.path.basename(SCALER_PATH))),
+    )
 
 
-def load_cache(cache_path):
-    with open(cache_path, "r", encoding="utf-8") as f:
-        return json.load(f)
+def load_models():
+    """Stargazing model and scaler, loaded once per version.
 
+    Prefers the memory-mapped compact export; falls back to the joblib pickles.
+    When retraining promotes a new version, the next call loads it.
+    """
+    model_dir = current_model_dir()
+    with _models_lock:
+        if _loaded_models["dir"] != model_dir:
+            _loaded_models["models"] = _load_model_dir(model_dir)
+            _loaded_models["dir"] = model_dir
+            print(f"Loaded stargazing model from {model_dir}")
+        return _loaded_models["models"]
 
-def get_7day_stargazing_forecast():
-    # --- Try cache first ---
-    if is_cache_today(CACHE_PATH):
-        try:
-            return load_cache(CACHE_PATH)
-        except Exception:
-            pass
 
+def compute_7day_stargazing_forecast(lat=DEFAULT_LAT, lon=DEFAULT_LON):
+    """Fetch the ensemble forecast and predict sky brightness (no caching).
+
+    Raises UpstreamError when Open-Meteo cannot be reached, so a failed fetch
+    never replaces the last good forecast with an empty one.
+    """
     # --- Weather API ---
-    url = "https://ensemble-api.open-meteo.com/v1/ensemble?latitude=22.311724466022362&longitude=114.17319166264973&daily=temperature_2m_mean,temperature_2m_min,temperature_2m_max,apparent_temperature_mean,apparent_temperature_min,apparent_temperature_max,wind_speed_10m_mean,wind_speed_10m_min,wind_speed_10m_max,wind_direction_10m_dominant,relative_humidity_2m_mean,relative_humidity_2m_max,relative_humidity_2m_min,wind_gusts_10m_mean,wind_gusts_10m_min,wind_gusts_10m_max,cloud_cover_mean,cloud_cover_min,precipitation_sum,precipitation_hours,rain_sum,pressure_msl_mean,pressure_msl_min,pressure_msl_max,surface_pressure_min,surface_pressure_mean,surface_pressure_max,dew_point_2m_mean,dew_point_2m_min,dew_point_2m_max,et0_fao_evapotranspiration,shortwave_radiation_sum,cloud_cover_max&models=ecmwf_ifs025&timezone=auto&wind_speed_unit=ms"
-    response = requests.get(url)
-    if response.status_code == 200:
-        data = response.json()
-        processed = process_ensemble_grouped(data)
-    else:
-        processed = []
+    return forecast_from_ensemble(fetch_ensemble(lat, lon))
+
+
+def forecast_from_ensemble(data):
+    """Sky-brightness forecast for one Open-Meteo ensemble response."""
+    if isinstance(data, list):
+        data = data[0]
+    processed = process_ensemble_grouped(data)
 
-    # --- Astronomy Data ---
-    sun_times = load_times_csv(SUN_CSV)
-    moon_times = load_times_csv(MOON_CSV)
-    processed = merge_astronomy_grouped(processed, sun_times, moon_times)
+    # --- Astronomy Data (dates are local to the location, timezone=auto) ---
+    processed = merge_astronomy_grouped(
+        processed,
+        data.get("latitude", DEFAULT_LAT),
+        data.get("longitude", DEFAULT_LON),
+        data.get("utc_offset_seconds", ephemeris.HK_UTC_OFFSET_MINUTES * 60) // 60,
+    )
 
     # --- Model ---
-    model = joblib.load(MODEL_PATH)
-    scaler = joblib.load(SCALER_PATH)
+    model, scaler = load_models()
 
-    # --- Prediction ---
+    # --- Prediction (all days in one batched call) ---
     results = []
-    for entry in processed:
-        features = [
-            time_to_minutes(entry.get("sun_rise", None)),
-            time_to_minutes(entry.get("sun_transit", None)),
-            time_to_minutes(entry.get("sun_set", None)),
-            time_to_minutes(entry.get("moon_rise", None)),
-            time_to_minutes(entry.get("moon_transit", None)),
-            time_to_minutes(entry.get("moon_set", None)),
-            entry.get("temperature_2m_mean", 0),
-            entry.get("temperature_2m_max", 0),
-            entry.get("temperature_2m_min", 0),
-            entry.get("apparent_temperature_mean", 0),
-            entry.get("apparent_temperature_max", 0),
-            entry.get("apparent_temperature_min", 0),
-            entry.get("rain_sum", 0),
-            entry.get("wind_speed_10m_max", 0),
-            entry.get("wind_gusts_10m_max", 0),
-            entry.get("wind_direction_10m_dominant", 0),
-            entry.get("shortwave_radiation_sum", 0),
-            entry.get("et0_fao_evapotranspiration", 0),
-            entry.get("cloud_cover_mean", 0),
-            entry.get("cloud_cover_max", 0),
-            entry.get("cloud_cover_min", 0),
-            entry.get("dew_point_2m_mean", 0),
-            entry.get("dew_point_2m_min", 0),
-            entry.get("dew_point_2m_max", 0),
-            entry.get("wind_speed_10m_mean", 0),
-            entry.get("wind_speed_10m_min", 0),
-            entry.get("winddirection_10m_dominant", 0),
-            entry.get("precipitation_sum", 0),
-            entry.get("snowfall_sum", 0),
-            entry.get("pressure_msl_mean", 0),
-            entry.get("pressure_msl_max", 0),
-            entry.get("pressure_msl_min", 0),
-            entry.get("surface_pressure_mean", 0),
-            entry.get("surface_pressure_max", 0),
-            entry.get("surface_pressure_min", 0),
-            entry.get("wind_gusts_10m_mean", 0),
-            entry.get("wind_gusts_10m_min", 0),
-            entry.get("relative_humidity_2m_mean", 0),
-            entry.get("relative_humidity_2m_max", 0),
-            entry.get("relative_humidity_2m_min", 0),
-            entry.get("et0_fao_evapotranspiration_sum", 0),
-        ]
-        X = np.array(features).reshape(1, -1)
-        X_scaled = scaler.transform(X)
-        y_pred = model.predict(X_scaled)
-        mpsas = float(y_pred[0])
+    for entry, prediction in zip(processed, predict_mpsas(model, scaler, processed)):
+        mpsas = float(prediction)
         bortle = mpsas_to_bortle(mpsas)
         results.append(
             {
@@ -270,13 +258,29 @@ def get_7day_stargazing_forecast():
                 "mpsas": round(mpsas, 2),
                 "bortle": bortle,
                 "cloud_cover_mean": round(entry.get("cloud_cover_mean", 0), 1),
+                "moon_illumination": round(entry["moon_illumination"], 2),
             }
         )
-    # Save results to cache
-    save_cache(CACHE_PATH, results)
     return results
 
 
+# Served from memory; refreshed in the background once older than the TTL
+forecast_cache = ForecastCache(
+    compute_7day_stargazing_forecast,
+    ttl=FORECAST_TTL,
+    cache_path=CACHE_PATH,
+)
+
+
+def get_7day_stargazing_forecast():
+    try:
+        return forecast_cache.get()
+    except UpstreamError as e:
+        # Nothing cached yet and upstream is down
+        print(f"Stargazing forecast unavailable: {e}")
+        return forecast_cache.value or []
+
+
 # For standalone test
 if __name__ == "__main__":
     forecast = get_7day_stargazing_forecast()
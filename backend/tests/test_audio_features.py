@@ -0,0 +1,43 @@
+"""Parity of the shared-spectrogram feature engine with the original per-feature librosa calls.
+
+Run from the backend folder:
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+from benchmarks.bench_audio_features import (
+    FEATURE_LENGTH,
+    PARITY_ATOL,
+    PARITY_RTOL,
+    legacy_features,
+    synthetic_track,
+)
+from music_to_image.audio_features import RunningStats, aggregate, features_from_signal
+
+
+@pytest.fixture(scope="module")
+def track():
+    # Deterministic (seeded) 8 s track: chords, a kick drum and a little noise
+    return synthetic_track(8, sr=22050)
+
+
+def test_features_from_signal_matches_legacy(track):
+    y, sr = track
+    expected = legacy_features(y, sr)
+    actual = features_from_signal(y, sr)
+    assert actual.shape == expected.shape == (FEATURE_LENGTH,)
+    np.testing.assert_allclose(actual, expected, rtol=PARITY_RTOL, atol=PARITY_ATOL)
+
+
+def test_features_are_deterministic(track):
+    y, sr = track
+    np.testing.assert_array_equal(features_from_signal(y, sr), features_from_signal(y, sr))
+
+
+def test_running_stats_match_aggregate():
+    rng = np.random.default_rng(1)
+    matrix = rng.normal(3.0, 2.0, size=(5, 1000))
+    stats = RunningStats()
+    for start in range(0, 1000, 137):
+        stats.update(matrix[:, start:start + 137])
+    np.testing.assert_allclose(stats.aggregate(), aggregate(matrix), rtol=1e-12)
@@ -0,0 +1,52 @@
+"""The compact forest export must predict what the sklearn forest + scaler it came from predicts.
+
+Run from the backend folder:
+    python -m pytest tests
+"""
+import numpy as np
+import pytest
+from sklearn.ensemble import RandomForestRegressor
+from sklearn.preprocessing import StandardScaler
+from stargazing import compact_forest
+from stargazing.compact_forest import CompactForest, export_forest, is_exported
+
+
+@pytest.fixture(scope="module")
+def fitted():
+    rng = np.random.default_rng(0)
+    X = rng.normal(20, 5, size=(600, 12))
+    y = 19 + 0.1 * X[:, :4].sum(axis=1) + rng.normal(0, 0.1, 600)
+    scaler = StandardScaler().fit(X)
+    model = RandomForestRegressor(n_estimators=40, max_depth=10, random_state=0)
+    model.fit(scaler.transform(X), y)
+    return model, scaler
+
+
+@pytest.fixture(scope="module")
+def forest_dir(fitted, tmp_path_factory):
+    out_dir = str(tmp_path_factory.mktemp("forest"))
+    export_forest(*fitted, out_dir)
+    return out_dir
+
+
+def test_export_is_complete(forest_dir, fitted):
+    assert is_exported(forest_dir)
+    forest = CompactForest.load(forest_dir)
+    assert forest.meta["n_trees"] == len(fitted[0].estimators_)
+    assert isinstance(forest.left, np.memmap)
+
+
+@pytest.mark.parametrize("rows", [1, 7, compact_forest.PREDICT_CHUNK_ROWS + 3])
+def test_predict_matches_sklearn(forest_dir, fitted, rows):
+    model, scaler = fitted
+    rng = np.random.default_rng(rows)
+    # Wider than the training data, so some rows reach the outermost leaves
+    X = rng.normal(20, 7.5, size=(rows, 12))
+    expected = model.predict(scaler.transform(X))
+    # Only the folded thresholds differ, by float rounding; no split flips on this data
+    np.testing.assert_allclose(CompactForest.load(forest_dir).predict(X), expected, rtol=0, atol=1e-9)
+
+
+def test_predict_rejects_wrong_width(forest_dir):
+    with pytest.raises(ValueError):
+        CompactForest.load(forest_dir).predict(np.zeros((2, 11)))
@@ -0,0 +1,159 @@
+"""Benchmarks for image_resize.py, run next to the photos folder (as image_resize.py is):
+
+    python ../../scripts/bench_image_resize.py encode [--limit 10]
+    python ../../scripts/bench_image_resize.py resize [--limit 10]
+
+`encode` times the in-memory JPEG size search against the old quality -= 5
+loop. `resize` compares the old full decode plus repeated 0.8 resizes with the
+draft-mode decode and single resample in load_derivatives, measuring time and
+peak memory (max RSS of a fresh worker process per photo and method).
+
+Nothing in the photos folder is modified; the old loop writes its temp files
+to a scratch directory.
+"""
+import argparse
+import os
+import resource
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from PIL import Image
+import image_resize
+
+
+def linear_search(img, target, quality, temp_path, **options):
+    """The previous approach: encode to disk and step quality down by 5."""
+    encodes = 0
+    while True:
+        img.save(temp_path, format="JPEG", quality=quality, **options)
+        encodes += 1
+        if os.path.getsize(temp_path) <= target or quality <= image_resize.MIN_QUALITY:
+            return os.path.getsize(temp_path), quality, encodes
+        quality -= 5
+
+
+def preview_input(img):
+    if img.width <= image_resize.LOW_QUALITY_WIDTH:
+        return img
+    ratio = image_resize.LOW_QUALITY_WIDTH / img.width
+    return img.resize((image_resize.LOW_QUALITY_WIDTH, int(img.height * ratio)), Image.Resampling.LANCZOS)
+
+
+def timed(fn, *args, **kwargs):
+    start = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def photo_files(limit):
+    return sorted(f for f in os.listdir(image_resize.folder) if f.lower().endswith(".jpg"))[:limit]
+
+
+def bench_encode(files):
+    totals = {"linear": [0, 0.0], "binary": [0, 0.0]}
+    with tempfile.TemporaryDirectory() as workdir:
+        temp_path = os.path.join(workdir, "temp.jpg")
+        for image_file in files:
+            with Image.open(os.path.join(image_resize.folder, image_file)) as img:
+                img.load()
+                jobs = [
+                    (preview_input(img), image_resize.LOW_QUALITY_TARGET, 60, {"dpi": (72, 72), "optimize": True}),
+                    (img, image_resize.MAX_SIZE, 95, {}),
+                ]
+                for source, target, start_quality, options in jobs:
+                    (old_bytes, old_quality, old_encodes), old_time = timed(
+                        linear_search, source, target, start_quality, temp_path, **options)
+                    (data, quality, _, encodes), new_time = timed(
+                        image_resize.encode_to_target, source, target, start_quality, **options)
+                    totals["linear"][0] += old_encodes
+                    totals["linear"][1] += old_time
+                    totals["binary"][0] += encodes
+                    totals["binary"][1] += new_time
+                    print(f"{image_file[:28]:<28} {target // 1024:>5}KB  "
+                          f"linear q={old_quality:<3}{old_bytes // 1024:>6}KB {old_encodes:>2} enc {old_time:6.2f}s  "
+                          f"binary q={quality:<3}{len(data) // 1024:>6}KB {encodes:>2} enc {new_time:6.2f}s")
+
+    for name, (encodes, seconds) in totals.items():
+        print(f"{name:<7} {encodes / max(len(files), 1):5.1f} encodes/photo, {seconds / max(len(files), 1):6.2f} s/photo")
+
+
+# --- Resize stage ---
+
+
+def old_derivatives(file_path, reduce):
+    """The previous approach: full decode, preview from it, original shrunk by 0.8 steps."""
+    with Image.open(file_path) as img:
+        img.load()
+        preview = preview_input(img)
+        original = None
+        if reduce:
+            original = img
+            while original.size[0] * original.size[1] > image_resize.MAX_PIXELS:
+                new_size = (int(original.size[0] * 0.8), int(original.size[1] * 0.8))
+                original = original.resize(new_size, Image.Resampling.LANCZOS)
+    return preview, original
+
+
+def new_derivatives(file_path, reduce):
+    """load_derivatives restricted to the same two outputs as the old path."""
+    targets = {"low_quality": {"max_width": image_resize.LOW_QUALITY_WIDTH}}
+    if reduce:
+        targets["original"] = {"max_pixels": image_resize.MAX_PIXELS}
+    images, _ = image_resize.load_derivatives(file_path, targets)
+    return images["low_quality"], images.get("original")
+
+
+def measure(method, file_path, reduce):
+    """Run one method in this (fresh) worker; returns seconds, peak RSS in MB and output sizes."""
+    start = time.perf_counter()
+    if method == "idle":
+        outputs = ()
+    else:
+        load = old_derivatives if method == "old" else new_derivatives
+        outputs = load(file_path, reduce)
+    seconds = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KB on Linux
+    return seconds, peak, [img.size if img else None for img in outputs]
+
+
+def isolated(method, file_path=None, reduce=False):
+    with ProcessPoolExecutor(max_workers=1) as pool:
+        return pool.submit(measure, method, file_path, reduce).result()
+
+
+def bench_resize(files):
+    _, baseline, _ = isolated("idle")
+    print(f"worker baseline {baseline:.0f} MB (subtracted below)")
+    totals = {"old": [0.0, 0.0], "new": [0.0, 0.0]}
+    for image_file in files:
+        file_path = os.path.join(image_resize.folder, image_file)
+        reduce = os.path.getsize(file_path) > image_resize.MAX_SIZE
+        with Image.open(file_path) as img:
+            source = img.size
+        row = []
+        for method in ("old", "new"):
+            seconds, peak, sizes = isolated(method, file_path, reduce)
+            totals[method][0] += seconds
+            totals[method][1] = max(totals[method][1], peak - baseline)
+            row.append(f"{method} {seconds:5.2f}s {peak - baseline:6.0f}MB {sizes}")
+        print(f"{image_file[:28]:<28} {source[0]}x{source[1]:<6} " + "  ".join(row))
+
+    for name, (seconds, peak) in totals.items():
+        print(f"{name:<4} {seconds / max(len(files), 1):5.2f} s/photo, peak {peak:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("stage", choices=["encode", "resize"])
+    parser.add_argument("--limit", type=int, default=10, help="number of photos to try")
+    args = parser.parse_args()
+
+    files = photo_files(args.limit)
+    if args.stage == "encode":
+        bench_encode(files)
+    else:
+        bench_resize(files)
+
+
+if __name__ == "__main__":
+    main()
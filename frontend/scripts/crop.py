@@ -1,39 +1,355 @@
-from PIL import Image
+"""從世界光污染圖裁出區域，並產生 XYZ 圖磚 (tile pyramid)。
+
+The world raster is several gigapixels, so it is never decoded as a whole:
+
+- PNG sources are read row by row (zlib stream + PNG unfiltering), keeping only
+  the rows/columns inside the requested regions, and reading stops after the
+  last row any region needs.
+- `--cache world2024.npy` converts the PNG once into a memory-mapped .npy;
+  later runs slice windows out of it directly.
 
-Image.MAX_IMAGE_PIXELS = None
+Several named regions are extracted in the same pass. For each region an XYZ
+(Web Mercator, 256 px) tile pyramid is written to <tiles>/<region>/{z}/{x}/{y}.png,
+sampled nearest-neighbour so the atlas colours stay exact, plus tiles.json
+with the bounds and zoom range. `--crop` additionally saves the plain crop
+(the old hk_lightpollution.png).
 
-# === 你的參數 ===
-img_path = (
-    r"C:\Users\cxoox\Desktop\stargazing-map-app\public\world2024.png"  # 原始圖片路徑
-)
-out_path = r"C:\Users\cxoox\Desktop\stargazing-map-app\public\hk_lightpollution.png"  # 輸出圖片路徑
+    python crop.py world2024.png --region hk --tiles public/tiles --zoom 6 12
+    python crop.py world2024.png --cache world2024.npy --region hk --crop hk_lightpollution.png
+    python crop.py world2024.npy --region "sai_kung:22.25,22.5,114.2,114.45"
+"""
+import argparse
+import io
+import json
+import math
+import os
+import struct
+import zlib
+import numpy as np
+from PIL import Image
 
 # 原圖覆蓋的經緯度範圍
 lat_min, lat_max = -90, 90
 lon_min, lon_max = -180, 180
 
-# 香港經緯度範圍
-hk_lat_min, hk_lat_max = 21.8, 22.8
-hk_lon_min, hk_lon_max = 113.5, 114.7
+# 區域經緯度範圍: (lat_min, lat_max, lon_min, lon_max)
+REGIONS = {
+    # 香港經緯度範圍
+    "hk": (21.8, 22.8, 113.5, 114.7),
+}
 
-# === 開始計算 ===
-img = Image.open(img_path)
-w, h = img.size
+TILE_SIZE = 256
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+# PNG colour type -> channels per pixel
+PNG_CHANNELS = {0: 1, 2: 3, 3: 1, 4: 2, 6: 4}
+PNG_MODES = {0: "L", 2: "RGB", 3: "P", 4: "LA", 6: "RGBA"}
+# Bytes per pixel -> a colour type with that pixel size, for unfiltering through Pillow
+UNFILTER_COLOR_TYPES = {1: 0, 2: 4, 3: 2, 4: 6}
 
 
 # 經緯度轉像素座標
-def geo_to_pixel(lat, lon):
+def geo_to_pixel(lat, lon, w, h):
     x = int((lon - lon_min) / (lon_max - lon_min) * w)
     y = int((lat_max - lat) / (lat_max - lat_min) * h)
     return x, y
 
 
-# 左上、右下像素座標
-x1, y1 = geo_to_pixel(hk_lat_max, hk_lon_min)  # 左上
-x2, y2 = geo_to_pixel(hk_lat_min, hk_lon_max)  # 右下
+def region_window(bounds, w, h):
+    """Pixel box (x1, y1, x2, y2) of a region, as the original crop computed it."""
+    r_lat_min, r_lat_max, r_lon_min, r_lon_max = bounds
+    x1, y1 = geo_to_pixel(r_lat_max, r_lon_min, w, h)  # 左上
+    x2, y2 = geo_to_pixel(r_lat_min, r_lon_max, w, h)  # 右下
+    return x1, y1, x2, y2
+
+
+# --- Streaming PNG reader ---
+
+
+def png_chunk(chunk_type, data):
+    return struct.pack(">I", len(data)) + chunk_type + data + struct.pack(">I", zlib.crc32(chunk_type + data))
+
+
+class PngRowReader:
+    """Decodes a non-interlaced 8-bit PNG one row at a time."""
+
+    def __init__(self, path):
+        self.path = path
+        self.palette = None
+        self.transparency = None
+        with open(path, "rb") as f:
+            if f.read(8) != PNG_SIGNATURE:
+                raise ValueError(f"{path} is not a PNG file")
+            while True:
+                length, chunk_type = struct.unpack(">I4s", f.read(8))
+                if chunk_type == b"IDAT":
+                    self._idat_offset = f.tell() - 8
+                    break
+                data = f.read(length)
+                f.seek(4, 1)  # CRC
+                if chunk_type == b"IHDR":
+                    (self.width, self.height, depth, self.color_type,
+                     _, _, interlace) = struct.unpack(">IIBBBBB", data)
+                elif chunk_type == b"PLTE":
+                    self.palette = np.frombuffer(data, dtype=np.uint8).reshape(-1, 3)
+                elif chunk_type == b"tRNS":
+                    self.transparency = np.frombuffer(data, dtype=np.uint8)
+        if depth != 8 or interlace:
+            raise ValueError("Only non-interlaced 8-bit PNGs can be streamed; convert the source first")
+        self.channels = PNG_CHANNELS[self.color_type]
+        self.mode = PNG_MODES[self.color_type]
+        self.stride = self.width * self.channels
+
+    def _idat_data(self):
+        with open(self.path, "rb") as f:
+            f.seek(self._idat_offset)
+            while True:
+                length, chunk_type = struct.unpack(">I4s", f.read(8))
+                if chunk_type == b"IEND":
+                    return
+                if chunk_type != b"IDAT":
+                    f.seek(length + 4, 1)
+                    continue
+                remaining = length
+                while remaining:
+                    data = f.read(min(remaining, 1 << 20))
+                    remaining -= len(data)
+                    yield data
+                f.seek(4, 1)
+
+    def _unfilter(self, filter_type, raw, prev):
+        bpp = self.channels
+        if filter_type == 0:
+            return raw
+        if filter_type == 1:  # Sub: running sum along the row, per channel
+            return (np.cumsum(raw.reshape(-1, bpp), axis=0, dtype=np.uint32) & 0xFF).astype(np.uint8).ravel()
+        if filter_type == 2:  # Up
+            return raw + prev
+        # Average and Paeth depend on the reconstructed left neighbour, which numpy
+        # cannot express; Pillow's C decoder unfilters a two-row PNG built around the row
+        width = len(raw) // bpp
+        header = struct.pack(">IIBBBBB", width, 2, 8, UNFILTER_COLOR_TYPES[bpp], 0, 0, 0)
+        scanlines = b"\0" + prev.tobytes() + bytes([filter_type]) + raw.tobytes()
+        png = (PNG_SIGNATURE + png_chunk(b"IHDR", header)
+               + png_chunk(b"IDAT", zlib.compress(scanlines, 0)) + png_chunk(b"IEND", b""))
+        with Image.open(io.BytesIO(png)) as image:
+            return np.asarray(image)[1].ravel()
+
+    def rows(self, stop=None):
+        """Yield (y, row) for rows 0..stop-1; row is (width,) or (width, channels) uint8."""
+        stop = self.height if stop is None else min(stop, self.height)
+        row_bytes = self.stride + 1
+        decompressor = zlib.decompressobj()
+        buffer = bytearray()
+        prev = np.zeros(self.stride, dtype=np.uint8)
+        y = 0
+        for data in self._idat_data():
+            while data:
+                # Bounded output per call, so a highly compressed chunk cannot balloon
+                buffer += decompressor.decompress(data, row_bytes * 16)
+                data = decompressor.unconsumed_tail
+                while len(buffer) >= row_bytes:
+                    raw = np.frombuffer(bytes(buffer[1:row_bytes]), dtype=np.uint8)
+                    prev = self._unfilter(buffer[0], raw, prev)
+                    del buffer[:row_bytes]
+                    yield y, prev if self.channels == 1 else prev.reshape(-1, self.channels)
+                    y += 1
+                    if y >= stop:
+                        return
+
+
+# --- Sources ---
+
+
+class Raster:
+    """Source pixels plus how to turn them into colours."""
+
+    def __init__(self, width, height, mode, palette=None, transparency=None):
+        self.width, self.height, self.mode = width, height, mode
+        self.palette, self.transparency = palette, transparency
+
+    def info(self):
+        return {
+            "width": self.width,
+            "height": self.height,
+            "mode": self.mode,
+            "palette": None if self.palette is None else self.palette.tolist(),
+            "transparency": None if self.transparency is None else self.transparency.tolist(),
+        }
+
+    @classmethod
+    def from_info(cls, info):
+        palette = info.get("palette")
+        transparency = info.get("transparency")
+        return cls(
+            info["width"], info["height"], info["mode"],
+            None if palette is None else np.array(palette, dtype=np.uint8),
+            None if transparency is None else np.array(transparency, dtype=np.uint8),
+        )
+
+    def to_rgba(self, pixels):
+        if self.mode == "P":
+            lut = np.full((256, 4), 255, dtype=np.uint8)
+            lut[: len(self.palette), :3] = self.palette
+            if self.transparency is not None:
+                lut[: len(self.transparency), 3] = self.transparency
+            return lut[pixels]
+        if self.mode == "L":
+            return np.dstack([pixels, pixels, pixels, np.full_like(pixels, 255)])
+        if self.mode == "LA":
+            return np.dstack([pixels[..., 0]] * 3 + [pixels[..., 1]])
+        if self.mode == "RGB":
+            return np.dstack([pixels, np.full(pixels.shape[:2], 255, dtype=np.uint8)])
+        return pixels
+
+    def to_image(self, pixels):
+        image = Image.fromarray(np.ascontiguousarray(pixels), self.mode)
+        if self.mode == "P":
+            image.putpalette(self.palette.ravel().tolist())
+            if self.transparency is not None:
+                image.info["transparency"] = self.transparency.tobytes()
+        return image
+
+
+def cache_info_path(npy_path):
+    return npy_path + ".json"
+
+
+def convert_to_memmap(png_path, npy_path):
+    """One-time streamed conversion of the PNG into a memory-mappable .npy."""
+    reader = PngRowReader(png_path)
+    shape = (reader.height, reader.width) + (() if reader.channels == 1 else (reader.channels,))
+    temp_path = npy_path + ".tmp.npy"
+    out = np.lib.format.open_memmap(temp_path, mode="w+", dtype=np.uint8, shape=shape)
+    for y, row in reader.rows():
+        out[y] = row
+    out.flush()
+    del out
+    os.replace(temp_path, npy_path)
+    raster = Raster(reader.width, reader.height, reader.mode, reader.palette, reader.transparency)
+    with open(cache_info_path(npy_path), "w", encoding="utf-8") as f:
+        json.dump(raster.info(), f)
+    print(f"Converted {png_path} to {npy_path}")
+
+
+def extract_regions(source, regions):
+    """{name: (pixels, window)} for all regions, plus the Raster describing them."""
+    if source.endswith(".npy"):
+        with open(cache_info_path(source), encoding="utf-8") as f:
+            raster = Raster.from_info(json.load(f))
+        data = np.load(source, mmap_mode="r")
+        windows = {name: region_window(b, raster.width, raster.height) for name, b in regions.items()}
+        crops = {name: (np.array(data[y1:y2, x1:x2]), (x1, y1, x2, y2))
+                 for name, (x1, y1, x2, y2) in windows.items()}
+        return crops, raster
+
+    reader = PngRowReader(source)
+    raster = Raster(reader.width, reader.height, reader.mode, reader.palette, reader.transparency)
+    windows = {name: region_window(b, reader.width, reader.height) for name, b in regions.items()}
+    buffers = {
+        name: np.empty((y2 - y1, x2 - x1) + (() if reader.channels == 1 else (reader.channels,)), dtype=np.uint8)
+        for name, (x1, y1, x2, y2) in windows.items()
+    }
+    last_row = max(y2 for _, _, _, y2 in windows.values())
+    for y, row in reader.rows(stop=last_row):
+        for name, (x1, y1, x2, y2) in windows.items():
+            if y1 <= y < y2:
+                buffers[name][y - y1] = row[x1:x2]
+    print(f"Read {last_row}/{reader.height} rows of {source}")
+    return {name: (buffers[name], windows[name]) for name in regions}, raster
+
+
+# --- XYZ tiles ---
+
+
+def lon_to_tile(lon, zoom):
+    return int((lon + 180) / 360 * 2 ** zoom)
+
+
+def lat_to_tile(lat, zoom):
+    lat = max(min(lat, 85.0511), -85.0511)
+    return int((1 - math.asinh(math.tan(math.radians(lat))) / math.pi) / 2 * 2 ** zoom)
+
+
+def write_tiles(name, bounds, pixels, window, raster, out_dir, zooms):
+    """Web Mercator tiles covering `bounds`, sampled from the region's pixels."""
+    r_lat_min, r_lat_max, r_lon_min, r_lon_max = bounds
+    x1, y1, x2, y2 = window
+    rgba = raster.to_rgba(pixels)
+    offsets = np.arange(TILE_SIZE) + 0.5
+    count = 0
+    for zoom in zooms:
+        world = TILE_SIZE * 2 ** zoom
+        for tx in range(lon_to_tile(r_lon_min, zoom), lon_to_tile(r_lon_max, zoom) + 1):
+            lon = (tx * TILE_SIZE + offsets) / world * 360 - 180
+            cols = np.floor((lon - lon_min) / (lon_max - lon_min) * raster.width).astype(np.int64) - x1
+            for ty in range(lat_to_tile(r_lat_max, zoom), lat_to_tile(r_lat_min, zoom) + 1):
+                n = np.pi * (1 - 2 * (ty * TILE_SIZE + offsets) / world)
+                lat = np.degrees(np.arctan(np.sinh(n)))
+                rows = np.floor((lat_max - lat) / (lat_max - lat_min) * raster.height).astype(np.int64) - y1
+                valid = ((rows >= 0) & (rows < y2 - y1))[:, None] & ((cols >= 0) & (cols < x2 - x1))[None, :]
+                if not valid.any():
+                    continue
+                tile = np.zeros((TILE_SIZE, TILE_SIZE, 4), dtype=np.uint8)
+                r = np.clip(rows, 0, y2 - y1 - 1)[:, None]
+                c = np.clip(cols, 0, x2 - x1 - 1)[None, :]
+                tile[valid] = rgba[np.broadcast_to(r, valid.shape), np.broadcast_to(c, valid.shape)][valid]
+                path = os.path.join(out_dir, name, str(zoom), str(tx), f"{ty}.png")
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                Image.fromarray(tile, "RGBA").save(path, optimize=True)
+                count += 1
+    os.makedirs(os.path.join(out_dir, name), exist_ok=True)
+    with open(os.path.join(out_dir, name, "tiles.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "name": name,
+            "bounds": {"lat_min": r_lat_min, "lat_max": r_lat_max, "lon_min": r_lon_min, "lon_max": r_lon_max},
+            "minzoom": min(zooms),
+            "maxzoom": max(zooms),
+            "tiles": f"{name}/{{z}}/{{x}}/{{y}}.png",
+        }, f, indent=2)
+    return count
+
+
+def parse_region(value):
+    """"hk" or "name:lat_min,lat_max,lon_min,lon_max"."""
+    if ":" not in value:
+        if value not in REGIONS:
+            raise argparse.ArgumentTypeError(f"Unknown region '{value}', choose from: {', '.join(REGIONS)}")
+        return value, REGIONS[value]
+    name, coords = value.split(":", 1)
+    bounds = tuple(float(v) for v in coords.split(","))
+    if len(bounds) != 4:
+        raise argparse.ArgumentTypeError("Region bounds are lat_min,lat_max,lon_min,lon_max")
+    return name, bounds
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Crop regions from the world light-pollution map.")
+    parser.add_argument("source", help="world2024.png, or a .npy made with --cache")
+    parser.add_argument("--region", type=parse_region, action="append", help="repeatable; default: hk")
+    parser.add_argument("--cache", help="convert the PNG to this .npy first (once) and read from it")
+    parser.add_argument("--tiles", help="output folder for XYZ tiles")
+    parser.add_argument("--zoom", type=int, nargs=2, default=[6, 12], metavar=("MIN", "MAX"))
+    parser.add_argument("--crop", help="also save the plain crop; with several regions use {name} in the path")
+    args = parser.parse_args()
+
+    regions = dict(args.region or [("hk", REGIONS["hk"])])
+    source = args.source
+    if args.cache:
+        if not os.path.exists(args.cache):
+            convert_to_memmap(source, args.cache)
+        source = args.cache
+
+    crops, raster = extract_regions(source, regions)
+    for name, (pixels, window) in crops.items():
+        if args.crop:
+            out_path = args.crop.format(name=name)
+            raster.to_image(pixels).save(out_path)
+            print(f"已裁剪並保存到 {out_path}")
+        if args.tiles:
+            zooms = range(args.zoom[0], args.zoom[1] + 1)
+            count = write_tiles(name, regions[name], pixels, window, raster, args.tiles, zooms)
+            print(f"{name}: {count} tiles (z{args.zoom[0]}-{args.zoom[1]}) in {os.path.join(args.tiles, name)}")
+
 
-# 裁剪
-box = (x1, y1, x2, y2)
-cropped = img.crop(box)
-cropped.save(out_path)
-print(f"已裁剪並保存到 {out_path}")
+if __name__ == "__main__":
+    main()
@@ -1,69 +1,447 @@
-from PIL import Image
+from PIL import Image, ImageOps
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from io import BytesIO
+from urllib.parse import quote
+import base64
+import hashlib
+import json
+import math
 import os
+import tempfile
+import time
+
+try:
+    import pillow_avif  # noqa: F401  (registers AVIF on Pillow < 11.2)
+except ImportError:
+    pass
 
 folder = r"photos"
 low_quality_folder = r"low_quality"
+responsive_folder = r"responsive"
+PUBLIC_URL = "/images"  # where this folder is served from (frontend/public/images)
 MAX_SIZE = int(1.5 * 1048576)  # 1.5MB for reduced image
 MAX_PIXELS = 10000000  # 10MP for reduced image
 LOW_QUALITY_TARGET = 200 * 1024  # 200KB for low quality preview
 LOW_QUALITY_WIDTH = 1280  # Max width for low quality
+MIN_QUALITY = 20  # Lowest JPEG quality the size search may go to
+EXIF_ORIENTATION = 0x0112
+ROTATED_ORIENTATIONS = (5, 6, 7, 8)  # EXIF orientations that swap width and height
+
+# Extra encoder options to try per output (IMAGE_SEARCH_VARIANTS=1): the search
+# keeps whichever fits the byte target at the highest quality, then the smallest.
+SEARCH_VARIANTS = os.environ.get("IMAGE_SEARCH_VARIANTS") == "1"
+JPEG_VARIANTS = [
+    {},
+    {"progressive": True},
+    {"subsampling": 0},  # 4:4:4, sharper colour edges at a higher byte cost
+]
+
+# --- Responsive derivatives ---
+# Width ladder and formats for <picture>/srcset in the gallery, e.g.
+# IMAGE_WIDTHS=480,960 IMAGE_FORMATS=webp,jpeg. Formats are listed in order of
+# preference; ones this Pillow cannot write are skipped, and JPEG is always
+# kept as the fallback.
+RESPONSIVE_WIDTHS = sorted(int(w) for w in os.environ.get("IMAGE_WIDTHS", "480,768,1080,1600").split(","))
+FORMATS = {
+    "avif": {"pil": "AVIF", "ext": ".avif", "mime": "image/avif", "quality": 50, "options": {}},
+    "webp": {"pil": "WEBP", "ext": ".webp", "mime": "image/webp", "quality": 75, "options": {}},
+    "jpeg": {"pil": "JPEG", "ext": ".jpg", "mime": "image/jpeg", "quality": 78,
+             "options": {"progressive": True, "optimize": True}},
+}
+PLACEHOLDER_WIDTH = 16  # tiny image inlined in the manifest, blurred by the frontend
+PLACEHOLDER_QUALITY = 30
+RESPONSIVE_MANIFEST_PATH = os.path.join(responsive_folder, "manifest.json")
+
+
+def supported_formats(requested):
+    Image.init()
+    formats = [name for name in requested if name in FORMATS and FORMATS[name]["pil"] in Image.SAVE]
+    if "jpeg" not in formats:
+        formats.append("jpeg")
+    return formats
+
+
+RESPONSIVE_FORMATS = supported_formats(os.environ.get("IMAGE_FORMATS", "avif,webp,jpeg").split(","))
+PLACEHOLDER_FORMAT = "webp" if "WEBP" in Image.SAVE else "jpeg"
+
+# Remembers each source's signature and outputs, so unchanged photos are skipped
+MANIFEST_PATH = r".image_build_manifest.json"
+# Bump when the processing changes, so every photo is rebuilt once
+PIPELINE_VERSION = 4
+SETTINGS = {
+    "version": PIPELINE_VERSION,
+    "max_size": MAX_SIZE,
+    "max_pixels": MAX_PIXELS,
+    "low_quality_target": LOW_QUALITY_TARGET,
+    "low_quality_width": LOW_QUALITY_WIDTH,
+    "min_quality": MIN_QUALITY,
+    "search_variants": SEARCH_VARIANTS,
+    "responsive_widths": RESPONSIVE_WIDTHS,
+    "responsive_formats": RESPONSIVE_FORMATS,
+    "qualities": {name: FORMATS[name]["quality"] for name in RESPONSIVE_FORMATS},
+    "placeholder": [PLACEHOLDER_FORMAT, PLACEHOLDER_WIDTH, PLACEHOLDER_QUALITY],
+}
+WORKERS = int(os.environ.get("IMAGE_WORKERS", os.cpu_count() or 1))
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def source_signature(path, with_hash=True):
+    stat = os.stat(path)
+    signature = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+    if with_hash:
+        signature["sha256"] = file_sha256(path)
+    return signature
+
+
+def load_manifest():
+    try:
+        with open(MANIFEST_PATH, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {"settings": SETTINGS, "images": {}}
+    if manifest.get("settings") != SETTINGS:
+        print("Settings changed since the last run; rebuilding every photo.")
+        return {"settings": SETTINGS, "images": {}}
+    return manifest
+
+
+def save_manifest(manifest):
+    temp_path = MANIFEST_PATH + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+    os.replace(temp_path, MANIFEST_PATH)
 
-os.makedirs(low_quality_folder, exist_ok=True)
 
-for image_file in os.listdir(folder):
-    if not image_file.lower().endswith(".jpg"):
-        continue
+def is_unchanged(image_file, entry):
+    """True if the source still matches the manifest and its outputs exist."""
+    if not entry:
+        return False
     file_path = os.path.join(folder, image_file)
+    if not all(os.path.exists(output["path"]) for output in entry["outputs"].values()):
+        return False
+    current = source_signature(file_path, with_hash=False)
+    recorded = entry["source"]
+    if current["size"] != recorded["size"]:
+        return False
+    if current["mtime_ns"] == recorded["mtime_ns"]:
+        return True
+    # Touched but maybe not modified (e.g. a fresh checkout): compare contents
+    if file_sha256(file_path) == recorded["sha256"]:
+        recorded["mtime_ns"] = current["mtime_ns"]
+        return True
+    return False
 
-    # --- Generate low quality preview for web (always) ---
-    with Image.open(file_path) as img:
-        img_low = img.copy()
-        # Resize if needed
-        if img_low.width > LOW_QUALITY_WIDTH:
-            ratio = LOW_QUALITY_WIDTH / img_low.width
-            new_size = (LOW_QUALITY_WIDTH, int(img_low.height * ratio))
-            img_low = img_low.resize(new_size, Image.Resampling.LANCZOS)
-        # Compress to ~200KB
-        low_quality_path = os.path.join(low_quality_folder, image_file)
-        quality = 60
-        temp_path = os.path.join(low_quality_folder, "temp_" + image_file)
-        while True:
-            img_low.save(temp_path, quality=quality, dpi=(72, 72), optimize=True)
-            if os.path.getsize(temp_path) <= LOW_QUALITY_TARGET or quality <= 20:
-                break
-            quality -= 5
-        os.replace(temp_path, low_quality_path)
-        print(
-            f"Saved low quality preview: {low_quality_path} (quality={quality}, size={os.path.getsize(low_quality_path)//1024}KB)"
-        )
-
-    # --- Reduce original image if needed (for enlargement/fullscreen) ---
-    # Skip if already small enough
-    if os.path.getsize(file_path) <= MAX_SIZE:
-        continue
-
-    # Resize if too many pixels
+
+def encode(img, pil_format, quality, **options):
+    buffer = BytesIO()
+    img.save(buffer, format=pil_format, quality=quality, **options)
+    return buffer.getvalue()
+
+
+def encode_jpeg(img, quality, **options):
+    return encode(img, "JPEG", quality, **options)
+
+
+def encode_to_target(img, target, max_quality, variants=None, **options):
+    """Binary-search the highest JPEG quality that fits in `target` bytes, in memory.
+
+    Returns (data, quality, variant, encodes). If nothing fits, the MIN_QUALITY
+    encode is returned, as the old quality -= 5 loop did.
+    """
+    encodes = 0
+    best = None  # (quality, -bytes, data, variant)
+    for variant in variants or [{}]:
+        low, high = MIN_QUALITY, max_quality
+        found = None
+        smallest = None
+        while low <= high:
+            quality = (low + high) // 2
+            data = encode_jpeg(img, quality, **options, **variant)
+            encodes += 1
+            if quality == MIN_QUALITY:
+                smallest = data
+            if len(data) <= target:
+                found = (quality, data)
+                low = quality + 1
+            else:
+                high = quality - 1
+        if found is None:
+            found = (MIN_QUALITY, smallest)
+        candidate = (found[0], -len(found[1]), found[1], variant)
+        if best is None or candidate[:2] > best[:2]:
+            best = candidate
+    quality, _, data, variant = best
+    return data, quality, variant, encodes
+
+
+def describe_variant(variant):
+    return "".join(f", {key}={value}" for key, value in variant.items())
+
+
+def file_mode(path):
+    """Mode for a file replacing `path`: the existing file's, else what open() would give."""
+    try:
+        return os.stat(path).st_mode & 0o777
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+def write_atomic(path, data):
+    """Write the final bytes once, via a temp file in the same folder and a rename."""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path) or ".", prefix=".resize_", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        # mkstemp creates 0600; published images must stay readable by the web server
+        os.chmod(temp_path, file_mode(path))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def fit_size(size, max_width=None, max_pixels=None):
+    """Final size for `size` under a width and/or pixel-count cap, keeping the aspect ratio."""
+    width, height = size
+    scale = 1.0
+    if max_width and width > max_width:
+        scale = max_width / width
+    if max_pixels and width * height * scale * scale > max_pixels:
+        scale = math.sqrt(max_pixels / (width * height))
+    if scale == 1.0:
+        return size
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+def resize_to(img, size):
+    if img.size == size:
+        return img
+    return img.resize(size, Image.Resampling.LANCZOS)
+
+
+def load_derivatives(file_path, targets):
+    """Decode a photo once, at the smallest JPEG scale that still covers every target.
+
+    `targets` maps a name to fit_size() limits, e.g. {"low_quality": {"max_width": 1280}}.
+    Returns ({name: image}, icc_profile), each image upright and resized with a
+    single LANCZOS pass. The sizes are worked out from the header first, so
+    draft() can let libjpeg scale by 1/2, 1/4 or 1/8 while decoding instead of
+    producing the full-resolution pixels.
+    """
     with Image.open(file_path) as img:
-        resized = False
-        while img.size[0] * img.size[1] > MAX_PIXELS:
-            new_size = (int(img.size[0] * 0.8), int(img.size[1] * 0.8))
-            img = img.resize(new_size, Image.Resampling.LANCZOS)
-            resized = True
-            print(f"Resized {image_file} to {new_size} pixels")
-        if resized:
-            img.save(file_path, quality=95)
-
-    # Compress to ≤1.5MB
-    if os.path.getsize(file_path) > MAX_SIZE:
-        with Image.open(file_path) as img:
-            quality = 95
-            temp_path = os.path.join(folder, "temp_" + image_file)
-            while True:
-                img.save(temp_path, quality=quality)
-                if os.path.getsize(temp_path) <= MAX_SIZE or quality <= 20:
-                    break
-                quality -= 5
-            os.replace(temp_path, file_path)
-            print(
-                f"Compressed {image_file} to <= 1.5MB (quality={quality}, size={os.path.getsize(file_path)//1024}KB)"
-            )
+        orientation = img.getexif().get(EXIF_ORIENTATION, 1)
+        rotated = orientation in ROTATED_ORIENTATIONS
+        upright = img.size[::-1] if rotated else img.size
+        sizes = {name: fit_size(upright, **limits) for name, limits in targets.items()}
+        # Cover every target (a tall panorama can need more height for one than another)
+        largest = tuple(max(dims) for dims in zip(*sizes.values()))
+        img.draft(img.mode, largest[::-1] if rotated else largest)
+        icc_profile = img.info.get("icc_profile")
+        # Bake the orientation into the pixels; the outputs carry no EXIF
+        decoded = ImageOps.exif_transpose(img)
+    return {name: resize_to(decoded, size) for name, size in sizes.items()}, icc_profile
+
+
+def derivative_targets(reduce):
+    targets = {
+        "low_quality": {"max_width": LOW_QUALITY_WIDTH},
+        "placeholder": {"max_width": PLACEHOLDER_WIDTH},
+    }
+    targets.update({f"w{width}": {"max_width": width} for width in RESPONSIVE_WIDTHS})
+    if reduce:
+        targets["original"] = {"max_pixels": MAX_PIXELS}
+    return targets
+
+
+def responsive_url(name):
+    return f"{PUBLIC_URL}/{responsive_folder}/{quote(name)}"
+
+
+def placeholder_uri(img):
+    if img.mode not in ("RGB", "L"):
+        img = img.convert("RGB")
+    options = FORMATS[PLACEHOLDER_FORMAT]
+    data = encode(img, options["pil"], PLACEHOLDER_QUALITY)
+    return f"data:{options['mime']};base64,{base64.b64encode(data).decode('ascii')}"
+
+
+def save_responsive(images, image_file, icc_profile=None):
+    """Write the width ladder in every format; returns (outputs, manifest entry).
+
+    Rungs wider than the photo collapse into one at its own width, which is
+    always the top of the ladder.
+    """
+    stem = os.path.splitext(image_file)[0]
+    ladder = {}
+    for width in RESPONSIVE_WIDTHS:
+        img = images[f"w{width}"]
+        ladder[img.width] = img
+    outputs = {}
+    sources = []
+    for name in RESPONSIVE_FORMATS:
+        fmt = FORMATS[name]
+        files = []
+        for width, img in sorted(ladder.items()):
+            profile = icc_profile
+            if img.mode not in ("RGB", "L"):
+                img, profile = img.convert("RGB"), None
+            data = encode(img, fmt["pil"], fmt["quality"], icc_profile=profile, **fmt["options"])
+            filename = f"{stem}-{width}{fmt['ext']}"
+            path = os.path.join(responsive_folder, filename)
+            write_atomic(path, data)
+            outputs[f"{name}-{width}"] = {"path": path, "quality": fmt["quality"], "bytes": len(data), "encodes": 1}
+            files.append({"src": responsive_url(filename), "width": width, "height": img.height, "bytes": len(data)})
+        sources.append({
+            "format": name,
+            "type": fmt["mime"],
+            "srcset": ", ".join(f"{f['src']} {f['width']}w" for f in files),
+            "files": files,
+        })
+    top = ladder[max(ladder)]
+    entry = {
+        "width": top.width,
+        "height": top.height,
+        "placeholder": placeholder_uri(images["placeholder"]),
+        "sources": sources,
+        # Plain <img src> fallback: the largest JPEG
+        "src": sources[RESPONSIVE_FORMATS.index("jpeg")]["files"][-1]["src"],
+    }
+    total = sum(output["bytes"] for output in outputs.values())
+    print(f"Saved {len(outputs)} responsive images for {image_file} "
+          f"(widths={sorted(ladder)}, formats={RESPONSIVE_FORMATS}, total={total//1024}KB)")
+    return outputs, entry
+
+
+def save_responsive_manifest(images):
+    """srcset data for the gallery, keyed by photo file name, from every built photo."""
+    entries = {f: entry["responsive"] for f, entry in sorted(images.items()) if "responsive" in entry}
+    data = json.dumps(entries, ensure_ascii=False, indent=1, sort_keys=True).encode("utf-8")
+    write_atomic(RESPONSIVE_MANIFEST_PATH, data)
+
+
+def save_preview(img, image_file, icc_profile=None):
+    """Low quality preview for web, compressed to ~200KB."""
+    low_quality_path = os.path.join(low_quality_folder, image_file)
+    data, quality, variant, encodes = encode_to_target(
+        img, LOW_QUALITY_TARGET, 60,
+        variants=JPEG_VARIANTS if SEARCH_VARIANTS else None,
+        dpi=(72, 72), optimize=True, icc_profile=icc_profile,
+    )
+    write_atomic(low_quality_path, data)
+    print(f"Saved low quality preview: {low_quality_path} "
+          f"(quality={quality}{describe_variant(variant)}, size={len(data)//1024}KB, encodes={encodes})")
+    return {"path": low_quality_path, "quality": quality, "bytes": len(data), "encodes": encodes}
+
+
+def reduce_original(img, image_file, icc_profile=None):
+    """Shrink the original in place (for enlargement/fullscreen) to <= 10MP and <= 1.5MB."""
+    file_path = os.path.join(folder, image_file)
+    # Compress to ≤1.5MB, starting from the decoded pixels rather than a re-encode
+    data, quality, variant, encodes = encode_to_target(
+        img, MAX_SIZE, 95, variants=JPEG_VARIANTS if SEARCH_VARIANTS else None,
+        icc_profile=icc_profile,
+    )
+    write_atomic(file_path, data)
+    print(f"Compressed {image_file} to <= 1.5MB "
+          f"(quality={quality}{describe_variant(variant)}, size={len(data)//1024}KB, "
+          f"pixels={img.size[0]}x{img.size[1]}, encodes={encodes})")
+    return {"path": file_path, "quality": quality, "bytes": len(data), "encodes": encodes}
+
+
+def process_image(image_file):
+    """Decode one photo once and write all its derivatives; returns its manifest entry."""
+    start = time.perf_counter()
+    file_path = os.path.join(folder, image_file)
+    # Skip the original if it is already small enough
+    reduce = os.path.getsize(file_path) > MAX_SIZE
+    images, icc_profile = load_derivatives(file_path, derivative_targets(reduce))
+    outputs = {"low_quality": save_preview(images["low_quality"], image_file, icc_profile)}
+    if reduce:
+        outputs["original"] = reduce_original(images["original"], image_file, icc_profile)
+    responsive_outputs, responsive = save_responsive(images, image_file, icc_profile)
+    outputs.update(responsive_outputs)
+    return {
+        # Signature after any in-place reduction, so the next run sees it as unchanged
+        "source": source_signature(file_path),
+        "outputs": outputs,
+        "responsive": responsive,
+        "encodes": sum(output["encodes"] for output in outputs.values()),
+        "seconds": round(time.perf_counter() - start, 3),
+    }
+
+
+def prune_outputs(images):
+    """Delete previews and responsive files no manifest entry refers to; returns how many.
+
+    Catches photos removed from `folder` as well as outputs left behind when a
+    photo or the settings changed. Dotfiles (in-flight temp files) and the
+    responsive manifest are left alone.
+    """
+    referenced = {
+        os.path.normpath(output["path"]) for entry in images.values() for output in entry["outputs"].values()
+    }
+    referenced.add(os.path.normpath(RESPONSIVE_MANIFEST_PATH))
+    removed = 0
+    for output_folder in (low_quality_folder, responsive_folder):
+        for name in os.listdir(output_folder):
+            path = os.path.normpath(os.path.join(output_folder, name))
+            if name.startswith(".") or path in referenced or not os.path.isfile(path):
+                continue
+            os.remove(path)
+            removed += 1
+    return removed
+
+
+def main():
+    os.makedirs(low_quality_folder, exist_ok=True)
+    os.makedirs(responsive_folder, exist_ok=True)
+    print(f"Responsive widths {RESPONSIVE_WIDTHS} as {', '.join(RESPONSIVE_FORMATS)}")
+    manifest = load_manifest()
+    images = manifest["images"]
+    files = sorted(f for f in os.listdir(folder) if f.lower().endswith(".jpg"))
+
+    start = time.perf_counter()
+    todo = [f for f in files if not is_unchanged(f, images.get(f))]
+    skipped = [f for f in files if f not in todo]
+    failed = []
+    if todo:
+        with ProcessPoolExecutor(max_workers=min(WORKERS, len(todo))) as pool:
+            futures = {pool.submit(process_image, f): f for f in todo}
+            for future in as_completed(futures):
+                image_file = futures[future]
+                try:
+                    images[image_file] = future.result()
+                except Exception as e:
+                    failed.append(image_file)
+                    print(f"Failed {image_file}: {e}")
+    # Forget photos that were removed from the folder
+    for image_file in set(images) - set(files):
+        del images[image_file]
+    save_manifest(manifest)
+    save_responsive_manifest(images)
+    pruned = prune_outputs(images)
+
+    elapsed = time.perf_counter() - start
+    saved = sum(images[f]["seconds"] for f in skipped)
+    done = [images[f] for f in todo if f in images]
+    work = sum(entry["seconds"] for entry in done)
+    encodes = sum(entry["encodes"] for entry in done)
+    print(
+        f"Processed {len(done)}, skipped {len(skipped)} unchanged, failed {len(failed)} "
+        f"in {elapsed:.1f}s ({work:.1f}s of work on {min(WORKERS, max(len(todo), 1))} workers, "
+        f"{encodes / max(len(done), 1):.1f} encodes per photo); "
+        f"skipping saved ~{saved:.1f}s; pruned {pruned} stale files"
+    )
+
+
+if __name__ == "__main__":
+    main()